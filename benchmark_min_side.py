@@ -0,0 +1,47 @@
+"""
+Compare min_side per building (shapely minimum_rotated_rectangle, .apply) with min_sides (numpy rotating calipers)
+on real footprints from a bbox of the building file. Checks both agree and prints the best of N times for each.
+
+Usage: python benchmark_min_side.py BUILDING_PATH minx miny maxx maxy [--repeats 3]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.postcode_utils import read_vector
+from src.pre_process_buildings import min_side, min_sides
+
+
+def benchmark_min_side(path, bbox, repeats=3):
+    """Best of repeats time (s) of each implementation, the number of buildings and the largest difference (m)."""
+    geoms = read_vector(path, bbox=bbox, columns=['geometry']).geometry
+    implementations = {'apply': lambda: geoms.astype(object).apply(min_side).values,
+                       'vectorized': lambda: min_sides(geoms.values)}
+    results, sides = {}, {}
+    for name, fn in implementations.items():
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            sides[name] = fn()
+            times.append(time.perf_counter() - start)
+        results[name] = min(times)
+
+    max_diff = float(np.max(np.abs(sides['apply'] - sides['vectorized']), initial=0))
+    if not np.allclose(sides['apply'], sides['vectorized'], rtol=1e-9, atol=1e-9):
+        raise ValueError(f'Implementations disagree, largest difference {max_diff}')
+    return results, len(geoms), max_diff
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark min_side on the footprints in one bbox')
+    parser.add_argument('building_path', type=str, help='Path to the building GeoPackage')
+    parser.add_argument('bbox', type=float, nargs=4, help='minx miny maxx maxy')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    results, n_buildings, max_diff = benchmark_min_side(args.building_path, tuple(args.bbox), args.repeats)
+    for name, seconds in results.items():
+        print(f'{name}: {seconds:.3f}s for {n_buildings} buildings')
+    print(f"vectorized speed up: {results['apply'] / results['vectorized']:.1f}x, largest difference {max_diff:.2e}m")
@@ -0,0 +1,50 @@
+"""
+Compare the fiona and Arrow read engines (postcode_utils.READ_ENGINE) on the same bbox of the building file.
+Checks both engines return the same buildings and prints the best of N read times for each.
+
+Usage: python benchmark_read_engines.py BUILDING_PATH minx miny maxx maxy [--repeats 3] [--columns fuel]
+"""
+
+import argparse
+import time
+
+from src.postcode_utils import read_vector, READ_ENGINES
+from src.fuel_calc import FUEL_COLUMNS
+from src.age_perc_calc import AGE_COLUMNS
+from src.type_calc import TYPE_COLUMNS
+
+THEME_COLUMNS = {'fuel': FUEL_COLUMNS, 'age': AGE_COLUMNS, 'type': TYPE_COLUMNS}
+
+
+def benchmark_read_engines(path, bbox, repeats=3, columns=None):
+    """Best of repeats read time (s) per engine, plus the number of buildings read."""
+    results = {}
+    upns = {}
+    for engine in READ_ENGINES:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            buildings = read_vector(path, bbox=bbox, columns=columns, engine=engine)
+            times.append(time.perf_counter() - start)
+        results[engine] = {'seconds': min(times), 'n_buildings': len(buildings)}
+        upns[engine] = set(buildings['upn'])
+
+    if len(set(map(frozenset, upns.values()))) != 1:
+        raise ValueError('Read engines returned different buildings')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark building read engines on one bbox')
+    parser.add_argument('building_path', type=str, help='Path to the building GeoPackage')
+    parser.add_argument('bbox', type=float, nargs=4, help='minx miny maxx maxy')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--columns', choices=list(THEME_COLUMNS), default=None,
+                        help='Read only the column manifest of a theme')
+    args = parser.parse_args()
+
+    columns = THEME_COLUMNS[args.columns] if args.columns else None
+    results = benchmark_read_engines(args.building_path, tuple(args.bbox), args.repeats, columns)
+    for engine, res in results.items():
+        print(f"{engine}: {res['seconds']:.3f}s for {res['n_buildings']} buildings")
+    print(f"arrow speed up: {results['fiona']['seconds'] / results['arrow']['seconds']:.1f}x")
@@ -0,0 +1,10 @@
+from src.building_store import convert_gpkg_to_store
+# Update paths as required
+BUILDING_PATH = '/rds/user/gb669/hpc-work/energy_map/data/building_files/UKBuildings_Edition_15_new_format_upn.gpkg'
+PC_SHP_PATH = '/rds/user/gb669/hpc-work/energy_map/data/postcode_polygons/codepoint-poly_5267291'
+# Output store directory, pass this as BUILDING_PATH once converted
+STORE_PATH = '/rds/user/gb669/hpc-work/energy_map/data/building_files/UKBuildings_Edition_15_store'
+
+# One-time conversion of the building GeoPackage into the postcode area partitioned store
+manifest = convert_gpkg_to_store(BUILDING_PATH, PC_SHP_PATH, STORE_PATH)
+print(f'Successfully converted {manifest.n_rows.sum()} buildings into {len(manifest)} partitions at {STORE_PATH}')
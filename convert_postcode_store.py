@@ -0,0 +1,9 @@
+from src.postcode_store import convert_pc_shapefiles_to_store
+# Update paths as required
+PC_SHP_PATH = '/rds/user/gb669/hpc-work/energy_map/data/postcode_polygons/codepoint-poly_5267291'
+# Output store directory, pass this as PC_STORE_PATH once converted
+STORE_PATH = '/rds/user/gb669/hpc-work/energy_map/data/postcode_polygons/codepoint_store'
+
+# One-time conversion of the postcode area shapefiles into the postcode store
+manifest = convert_pc_shapefiles_to_store(PC_SHP_PATH, STORE_PATH)
+print(f'Successfully converted {manifest.n_rows.sum()} postcodes from {len(manifest)} area shapefiles at {STORE_PATH}')
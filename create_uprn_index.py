@@ -0,0 +1,10 @@
+from src.postcode_utils import ensure_uprn_index
+# Update paths as required
+BUILDING_PATH = '/rds/user/gb669/hpc-work/energy_map/data/building_files/UKBuildings_Edition_15_new_format_upn.gpkg'
+
+# One-time index on the uprn column of the building GeoPackage, for RETRIEVAL='sql'.
+# Run before submitting any jobs: it writes to the GeoPackage, which the jobs only read
+if ensure_uprn_index(BUILDING_PATH):
+    print(f'uprn index ready on {BUILDING_PATH}')
+else:
+    print(f'Could not create the uprn index on {BUILDING_PATH}, check write access')
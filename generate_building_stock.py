@@ -10,7 +10,8 @@ import os
 import logging
 from src.split_onsud_file import split_onsud_and_postcodes
 from src.postcode_utils import load_ids_from_file
-from src.pc_main import postcode_main, run_fuel_process, run_age_process, run_type_process
+from src.pc_main import postcode_main, multi_theme_main, run_fuel_process, run_age_process, run_type_process
+from src.pc_assignment import run_assignment
 from src.post_process import apply_filters, unify_dataset
 from src.logging_config import get_logger, setup_logging
 import argparse 
@@ -27,6 +28,7 @@ def determine_process_settings():
         'STAGE0_split_onsud': False,
         'STAGE1_generate_census': False,
         'STAGE1_generate_climate': False,
+        'STAGE1_build_assignment': os.getenv('ASSIGN', 'no').lower() == 'yes',
         'STAGE1_generate_buildings_energy': os.getenv('ENERGY', 'no').lower() == 'yes',
         'STAGE1_generate_building_age': os.getenv('AGE', 'no').lower() == 'yes',
         'STAGE1_generate_building_typology': os.getenv('TYPE', 'no').lower() == 'yes',
@@ -62,10 +64,14 @@ def main():
     
     # Get paths from environment variables
     ONSUD_BASE = os.getenv('ONSUD_BASE')
-    PC_SHP_PATH = os.getenv('PC_SHP_PATH')
+    # a postcode store (convert_postcode_store.py) is read in place of the shapefiles when given
+    PC_SHP_PATH = os.getenv('PC_STORE_PATH') or os.getenv('PC_SHP_PATH')
     BUILDING_PATH = os.getenv('BUILDING_PATH')
     GAS_PATH = os.getenv('GAS_PATH')
     ELEC_PATH = os.getenv('ELEC_PATH')
+    RETRIEVAL = os.getenv('RETRIEVAL', 'batch')
+    TILE_CACHE_MB = int(os.getenv('TILE_CACHE_MB', '0')) or None
+    SINGLE_PASS = os.getenv('SINGLE_PASS', 'yes').lower() == 'yes'
     
     # Validate input paths
     required_paths = {
@@ -90,8 +96,35 @@ def main():
     batch_id = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
     print('batch_id:', batch_id)
     onsud_path = os.path.join(os.path.dirname(batch_path), f'onsud_{batch_id}.csv') 
+    # Precompute the building to postcode assignment
+    if stages['STAGE1_build_assignment']:
+        run_assignment(batch_path, 'intermediate_data', onsud_path, PC_SHP_PATH, BUILDING_PATH,
+                       label, batch_id, log_size=args.log_size)
+
+    # RETRIEVAL=scan reads the buildings staged by stage_national_scan.py, run once for all batches beforehand
+    # Run the enabled themes in one pass over the batch
+    themes = [theme for theme, stage in [('fuel', 'STAGE1_generate_buildings_energy'), ('age', 'STAGE1_generate_building_age'),
+                                         ('type', 'STAGE1_generate_building_typology')] if stages[stage]]
+    single_pass = SINGLE_PASS and len(themes) > 1
+    if single_pass:
+        multi_theme_main(
+            batch_path=batch_path,
+            data_dir='intermediate_data',
+            path_to_onsud_file=onsud_path,
+            path_to_pcshp=PC_SHP_PATH,
+            INPUT_GPK=BUILDING_PATH,
+            region_label=label,
+            batch_label=batch_id,
+            themes=themes,
+            gas_path=GAS_PATH,
+            elec_path=ELEC_PATH,
+            log_size=args.log_size,
+            retrieval=RETRIEVAL,
+            tile_cache_mb=TILE_CACHE_MB
+        )
+
     # Run fuel calculations
-    if stages['STAGE1_generate_buildings_energy']:
+    if stages['STAGE1_generate_buildings_energy'] and not single_pass:
         print('starting fuel')  
         postcode_main(
             batch_path=batch_path,
@@ -107,11 +140,13 @@ def main():
             elec_path=ELEC_PATH,
             overlap_outcode=None,
             overlap='No',
-            log_size=args.log_size
+            log_size=args.log_size,
+            retrieval=RETRIEVAL,
+            tile_cache_mb=TILE_CACHE_MB
         )
 
     # Run age calculations
-    if stages['STAGE1_generate_building_age']:
+    if stages['STAGE1_generate_building_age'] and not single_pass:
         
         postcode_main(
             batch_path=batch_path,
@@ -123,11 +158,13 @@ def main():
             batch_label=batch_id,
             attr_lab='age',
             process_function=run_age_process,
-            log_size=args.log_size
+            log_size=args.log_size,
+            retrieval=RETRIEVAL,
+            tile_cache_mb=TILE_CACHE_MB
         )
 
     # Run typology calculations
-    if stages['STAGE1_generate_building_typology']:
+    if stages['STAGE1_generate_building_typology'] and not single_pass:
         
         postcode_main(
             batch_path=batch_path,
@@ -139,7 +176,9 @@ def main():
             batch_label=batch_id,
             attr_lab='type',
             process_function=run_type_process,
-            log_size=args.log_size
+            log_size=args.log_size,
+            retrieval=RETRIEVAL,
+            tile_cache_mb=TILE_CACHE_MB
         )
 
 
@@ -31,6 +31,10 @@ import os
 
 # Location of postcode shapefiles (we use codepoint edina)
 PC_SHP_PATH = '/Volumes/T9/2024_Data_downloads/codepoint_polygons_edina/Download_all_postcodes_2378998/codepoint-poly_5267291' 
+# Optional postcode store made from PC_SHP_PATH with convert_postcode_store.py, used in place of the shapefiles by
+# the assignment, scan and theme stages (each batch then reads only its own postcodes). None to read the shapefiles
+PC_STORE_PATH = None
+PC_POLYGON_PATH = PC_STORE_PATH or PC_SHP_PATH
 # Location of building stock dataset (we use Verisk buildings from Edina)
 BUILDING_PATH = '/Volumes/T9/2024_Data_downloads/Versik_building_data/2024_03_22_updated_data/UKBuildings_Edition_15_new_format_upn.gpkg'
 
@@ -44,6 +48,8 @@ location_input_data_folder = '/Volumes/T9/2024_Data_downloads/2024_11_nebula_pap
 onsud_path_base = os.path.join(location_input_data_folder, 'ONS_UPRN_database/ONSUD_DEC_2022/Data')
 GAS_PATH = os.path.join(location_input_data_folder, 'energy_data/Postcode_level_gas_2022.csv')
 ELEC_PATH = os.path.join(location_input_data_folder, 'energy_data/Postcode_level_all_meters_electricity_2022.csv')
+# Gas and electricity years joined to the fuel building aggregates by STAGE2_join_fuel_years: year -> (gas, elec)
+FUEL_YEARS = {2022: (GAS_PATH, ELEC_PATH)}
 TEMP_1KM_PATH = os.path.join(location_input_data_folder, 'climate_data/tas_hadukgrid_uk_1km_mon_202201-202212.nc')
 # Output directory, do not update if you want to save in the repo
 OUTPUT_DIR = 'final_dataset'
@@ -64,9 +70,11 @@ batch_id = os.getenv('BATCH_ID')  # Only used in HPC mode
 STAGE0_split_onsud = False 
 STAGE1_generate_census = False 
 STAGE1_generate_climate = False 
+STAGE1_build_assignment = False
 STAGE1_generate_buildings_energy= False
 STAGE1_generate_building_age = False 
 STAGE1_generate_building_typology = False 
+STAGE2_join_fuel_years = False
 STAGE3_post_process_data = True 
 
 #########################################  Set variables, no need to update   ################################################################# 
@@ -74,14 +82,27 @@ STAGE3_post_process_data = True
 batch_size = 10000
 log_size = 1000
 UPRN_TO_GAS_THRESHOLD = 40
+# Building retrieval for the theme stages: 'batch', 'postcode', 'assigned' (needs STAGE1_build_assignment run
+# first, and BUILDING_PATH to be a building store made with convert_building_store.py), or 'scan' (one sequential
+# pass over the building file for all batches, staged before the theme stages), or 'sql' (per postcode, with the UPRN
+# and R-tree filters run inside the building GeoPackage; run create_uprn_index.py once first)
+RETRIEVAL = 'batch'
+# Memory budget (MB) for the tile cache in front of 'batch' / 'postcode' building reads, None to read directly
+TILE_CACHE_MB = None
+# Run the enabled fuel / age / typology stages in one pass per batch: buildings are retrieved and pre processed
+# once for all of them. Each theme still writes its own log file
+SINGLE_PASS_THEMES = True
 
 
 #########################################    Script      ###################################################################################### 
 
 from src.split_onsud_file import split_onsud_and_postcodes
 from src.postcode_utils import load_ids_from_file
-from src.pc_main import postcode_main , run_fuel_process, run_age_process, run_type_process
+from src.pc_main import postcode_main , multi_theme_main, run_fuel_process, run_age_process, run_type_process
+from src.pc_assignment import run_assignment
+from src.national_scan import run_national_scan
 from src.post_process import  apply_filters, unify_dataset
+from src.fuel_years import run_fuel_year_join
 import os
 import logging 
 
@@ -132,11 +153,43 @@ def main():
         create_climate.main( PC_SHP_PATH, TEMP_1KM_PATH )
 
 
+    # Precompute the building to postcode assignment for each batch
+    if STAGE1_build_assignment:
+        batch_paths = list(set(load_ids_from_file('batch_paths.txt')))
+        logger.info(f"Found {len(batch_paths)} unique batch paths to assign")
+        for i, batch_path in enumerate(batch_paths, 1):
+            logger.info(f"Assigning batch {i}/{len(batch_paths)}: {batch_path}")
+            label = batch_path.split('/')[-2]
+            batch_id = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
+            onsud_path = os.path.join(os.path.dirname(batch_path), f'onsud_{batch_id}.csv') 
+            run_assignment(batch_path, 'intermediate_data', onsud_path, PC_POLYGON_PATH, BUILDING_PATH, label, batch_id, log_size=log_size)
+
+    # One pass over the building file, staging the buildings of every batch for the theme stages
+    if RETRIEVAL == 'scan' and (STAGE1_generate_buildings_energy or STAGE1_generate_building_age or STAGE1_generate_building_typology):
+        batch_paths = list(set(load_ids_from_file('batch_paths.txt')))
+        run_national_scan(batch_paths, 'intermediate_data', PC_POLYGON_PATH, BUILDING_PATH)
+
+    # Run the theme calculations in one pass over each batch
+    themes = [theme for theme, enabled in [('fuel', STAGE1_generate_buildings_energy), ('age', STAGE1_generate_building_age),
+                                           ('type', STAGE1_generate_building_typology)] if enabled]
+    single_pass = SINGLE_PASS_THEMES and len(themes) > 1
+    if single_pass:
+        batch_paths = list(set(load_ids_from_file('batch_paths.txt')))
+        logger.info(f"Found {len(batch_paths)} unique batch paths to process for {themes}")
+        for i, batch_path in enumerate(batch_paths, 1):
+            logger.info(f"Processing batch {i}/{len(batch_paths)}: {batch_path}")
+            label = batch_path.split('/')[-2]
+            batch_id = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
+            onsud_path = os.path.join(os.path.dirname(batch_path), f'onsud_{batch_id}.csv') 
+            multi_theme_main(batch_path=batch_path, data_dir='intermediate_data', path_to_onsud_file=onsud_path, path_to_pcshp=PC_POLYGON_PATH, INPUT_GPK=BUILDING_PATH, region_label=label,
+                             batch_label=batch_id, themes=themes, gas_path=GAS_PATH, elec_path=ELEC_PATH, log_size=log_size, retrieval=RETRIEVAL, tile_cache_mb=TILE_CACHE_MB)
+            logger.info(f"Successfully processed batch for {themes}: {batch_path}")
+
     # Run fuel calculations
     overlap_outcode= None 
     overlap = 'No'
     
-    if STAGE1_generate_buildings_energy:
+    if STAGE1_generate_buildings_energy and not single_pass:
         batch_paths = list(set(load_ids_from_file('batch_paths.txt')))
         logger.info(f"Found {len(batch_paths)} unique batch paths to process")
         
@@ -146,12 +199,12 @@ def main():
             batch_id = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
             onsud_path = os.path.join(os.path.dirname(batch_path), f'onsud_{batch_id}.csv') 
 
-            postcode_main(batch_path = batch_path, data_dir = 'intermediate_data', path_to_onsud_file = onsud_path, path_to_pcshp = PC_SHP_PATH, INPUT_GPK=BUILDING_PATH, region_label=label, 
-                    batch_label=batch_id, attr_lab='fuel', process_function=run_fuel_process, gas_path=GAS_PATH, elec_path=ELEC_PATH, overlap_outcode=overlap_outcode, overlap=overlap, log_size=log_size)
+            postcode_main(batch_path = batch_path, data_dir = 'intermediate_data', path_to_onsud_file = onsud_path, path_to_pcshp = PC_POLYGON_PATH, INPUT_GPK=BUILDING_PATH, region_label=label, 
+                    batch_label=batch_id, attr_lab='fuel', process_function=run_fuel_process, gas_path=GAS_PATH, elec_path=ELEC_PATH, overlap_outcode=overlap_outcode, overlap=overlap, log_size=log_size, retrieval=RETRIEVAL, tile_cache_mb=TILE_CACHE_MB)
             logger.info(f"Successfully processed batch for fuel: {batch_path}")
 
     # Run age calculations
-    if STAGE1_generate_building_age :
+    if STAGE1_generate_building_age and not single_pass:
         batch_paths = list(set(load_ids_from_file('batch_paths.txt')))
         logger.info(f"Found {len(batch_paths)} unique batch paths to process")
         for i, batch_path in enumerate(batch_paths, 1):
@@ -159,12 +212,12 @@ def main():
                 label = batch_path.split('/')[-2]
                 batch_id = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
                 onsud_path = os.path.join(os.path.dirname(batch_path), f'onsud_{batch_id}.csv') 
-                postcode_main(batch_path = batch_path, data_dir = 'intermediate_data', path_to_onsud_file = onsud_path, path_to_pcshp = PC_SHP_PATH, INPUT_GPK=BUILDING_PATH, region_label=label, 
-                        batch_label=batch_id, attr_lab='age', process_function=run_age_process, log_size=log_size)
+                postcode_main(batch_path = batch_path, data_dir = 'intermediate_data', path_to_onsud_file = onsud_path, path_to_pcshp = PC_POLYGON_PATH, INPUT_GPK=BUILDING_PATH, region_label=label, 
+                        batch_label=batch_id, attr_lab='age', process_function=run_age_process, log_size=log_size, retrieval=RETRIEVAL, tile_cache_mb=TILE_CACHE_MB)
                 logger.info(f"Successfully processed batch for age: {batch_path}")
 
     # Run typology calculations
-    if STAGE1_generate_building_typology:
+    if STAGE1_generate_building_typology and not single_pass:
         batch_paths = list(set(load_ids_from_file('batch_paths.txt')))
         logger.info(f"Found {len(batch_paths)} unique batch paths to process")
         for i, batch_path in enumerate(batch_paths, 1):
@@ -172,11 +225,18 @@ def main():
                 label = batch_path.split('/')[-2]
                 batch_id = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
                 onsud_path = os.path.join(os.path.dirname(batch_path), f'onsud_{batch_id}.csv') 
-                postcode_main(batch_path = batch_path, data_dir = 'intermediate_data', path_to_onsud_file = onsud_path, path_to_pcshp = PC_SHP_PATH, INPUT_GPK=BUILDING_PATH, region_label=label, 
-                        batch_label=batch_id, attr_lab='type', process_function=run_type_process, log_size=log_size)
+                postcode_main(batch_path = batch_path, data_dir = 'intermediate_data', path_to_onsud_file = onsud_path, path_to_pcshp = PC_POLYGON_PATH, INPUT_GPK=BUILDING_PATH, region_label=label, 
+                        batch_label=batch_id, attr_lab='type', process_function=run_type_process, log_size=log_size, retrieval=RETRIEVAL, tile_cache_mb=TILE_CACHE_MB)
                 logger.info(f"Successfully processed batch for type: {batch_path}")
 
 
+    # Join every year in FUEL_YEARS to the fuel building aggregates, without rerunning the fuel theme
+    if STAGE2_join_fuel_years:
+        for year, paths in FUEL_YEARS.items():
+            for path in paths:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Fuel data for {year} not found at: {path}")
+        run_fuel_year_join('intermediate_data', FUEL_YEARS)
 
     # Unify the results from the log files
     if STAGE3_post_process_data:
@@ -1,5 +1,7 @@
-from src.pre_process_buildings import pre_process_building_data 
-from src.postcode_utils import check_duplicate_primary_key, find_data_pc_joint
+from src.pre_process_buildings import pre_process_postcode_buildings, PRE_PROCESS_PROFILE_COLUMNS, ATTRIBUTES
+from src.building_schema import PRE_1919_AGES, PREMISE_AGES, to_categorical
+from src.postcode_utils import (check_duplicate_primary_key, find_data_pc_joint, get_pc_buildings, building_columns,
+                                residential_category_counts)
 import numpy as np 
 import pandas as pd
 import sys 
@@ -8,6 +10,15 @@ import numpy as np
 from src.logging_config import get_logger
 logger = get_logger(__name__)
 
+# pre processing the age theme needs: premise_age is used as read, so no geometry or floor count maths
+AGE_PROFILE = ATTRIBUTES
+# building columns the age theme reads
+AGE_COLUMNS = building_columns(PRE_PROCESS_PROFILE_COLUMNS[AGE_PROFILE], ['premise_use', 'premise_age'])
+# age buckets in the log file, in column order
+AGE_TYPES = ['Pre 1919', '1919-1944', '1945-1959', '1960-1979', '1980-1989', '1990-1999', 'Post 1999']
+# pre processed building columns summarise_building_age_batch uses
+AGE_BATCH_COLUMNS = ['upn', 'premise_use', 'premise_age']
+
 def calc_filtered_percentage_of_building_age(df, age_types):
     """
     Function to create percentage of different building ages, filtered by specified types,
@@ -18,7 +29,7 @@ def calc_filtered_percentage_of_building_age(df, age_types):
     age_types : List of building ages to include in the output.
     """
     # Calculate the count of each age and normalize to get percentages
-    df['premise_age_bucketed'] = np.where(df['premise_age'].isin(['Pre 1837', '1837-1869', '1870-1918']), 'Pre 1919', df['premise_age'])
+    df['premise_age_bucketed'] = np.where(df['premise_age'].isin(PRE_1919_AGES), 'Pre 1919', df['premise_age'])
 
     df = df[df['premise_use'] == 'Residential']
     all_building_ages = df['premise_age_bucketed'].value_counts()
@@ -34,7 +45,7 @@ def calc_res_clean_counts(df):
     res = df[df['premise_use'] == 'Residential']
     return len(res)
 
-def process_postcode_building_age(pc, onsud_data, INPUT_GPK, overlap=False, batch_dir=None, path_to_pcshp=None):
+def process_postcode_building_age(pc, onsud_data, INPUT_GPK, overlap=False, batch_dir=None, path_to_pcshp=None, batch_buildings=None):
     """Process one postcode, deriving building attributes and electricity and fuel info.
     
     Inputs: 
@@ -45,19 +56,20 @@ def process_postcode_building_age(pc, onsud_data, INPUT_GPK, overlap=False, batc
     overlap: bool, is this for the overlapping postcodes? 
     batch_dir = needed for overlap - where are the batches stored?
     path_to_pcshp: path to postcode shapefiles location, needed for overlap 
+    batch_buildings: optional output of find_data_pc_batch for the sub-batch, avoids a per postcode read
     """
-    age_types =  [  'Pre 1919',
-                        '1919-1944',
-                        '1945-1959', 
-                        '1960-1979',
-                        '1980-1989',
-                        '1990-1999',
-                        'Post 1999' 
-                        ]
-
     pc = pc.strip()
+    uprn_match = get_pc_buildings(pc, onsud_data, INPUT_GPK, batch_buildings, columns=AGE_COLUMNS)
+    return summarise_building_age(pc, uprn_match, pre_process_postcode_buildings(uprn_match, AGE_PROFILE))
+
+
+def summarise_building_age(pc, uprn_match, df):
+    """Age attributes for one postcode.
+    uprn_match: the postcode's buildings as retrieved
+    df: the same buildings after pre_process_postcode_buildings (None if there are none)
+    """
+    age_types = AGE_TYPES
 
-    uprn_match = find_data_pc_joint(pc, onsud_data, input_gpk=INPUT_GPK)
     dc_full = {'postcode': pc}
 
     for val in age_types:
@@ -65,12 +77,9 @@ def process_postcode_building_age(pc, onsud_data, INPUT_GPK, overlap=False, batc
     dc_full['len_res'] = np.nan 
     dc_full['None_age'] = np.nan
 
-    if uprn_match.empty or uprn_match is None:
+    if df is None:
         logger.debug('Empty uprn match')
     else:
-        df = pre_process_building_data(uprn_match)
-        if len(df) != len(uprn_match):
-            raise Exception('Error in pre-process - some cols dropped?')
         dc = calc_filtered_percentage_of_building_age(df, age_types)
         if df is not None:
             if check_duplicate_primary_key(df, 'upn'):
@@ -82,3 +91,26 @@ def process_postcode_building_age(pc, onsud_data, INPUT_GPK, overlap=False, batc
         dc_full.update(dc)
 
     return dc_full
+
+
+def summarise_building_age_batch(pcs, buildings):
+    """
+    Age attributes for a whole sub-batch, the same values and log format as summarise_building_age per postcode,
+    without a value_counts per postcode.
+
+    pcs: postcodes in output order
+    buildings: the sub-batch's pre processed buildings with a 'postcode' column (see stack_postcode_buildings),
+        postcodes with no buildings are absent
+    Returns: DataFrame with one row per postcode
+    """
+    if buildings[['postcode', 'upn']].duplicated().any():
+        logger.debug('Duplicate primary key found for upn')
+        sys.exit()
+
+    # bucket on Categorical codes: each premise_age category maps to its AGE_TYPES position, -1 if none
+    age = to_categorical(buildings['premise_age'].values, PREMISE_AGES, 'premise_age')
+    bucket_codes = np.array([AGE_TYPES.index('Pre 1919') if a in PRE_1919_AGES else
+                             AGE_TYPES.index(a) if a in AGE_TYPES else -1 for a in age.categories] + [-1])
+    bucketed = pd.Categorical.from_codes(bucket_codes[age.codes], categories=AGE_TYPES)
+    unknown = (age.codes == -1) | (age.codes == age.categories.get_loc('Unknown date'))
+    return residential_category_counts(pcs, buildings, bucketed, AGE_TYPES, unknown, 'None_age')
@@ -1,24 +1,31 @@
 import pandas as pd 
 import os 
-from src.age_perc_calc import process_postcode_building_age  # Updated import
+from src.age_perc_calc import summarise_building_age_batch, AGE_COLUMNS, AGE_BATCH_COLUMNS, AGE_PROFILE
+from src.pre_process_buildings import retrieve_subbatch_buildings
 
 from src.logging_config import get_logger
 logger = get_logger(__name__)
 
-def process_age_batch(pc_batch, data, INPUT_GPK, process_batch_name, log_file, overlap):
+def process_age_batch(pc_batch, data, INPUT_GPK, process_batch_name, log_file, overlap, retrieval='batch', retrieval_context=None):
     logger.debug('Starting batch processing for age batch...')
-
-    # Initialize an empty list to collect results
-    results = []
-    for pc in pc_batch:
-        logger.debug('Processing postcode:', pc)
-        pc_result = process_postcode_building_age(pc, data, INPUT_GPK)  # Updated function call
-        if pc_result is not None:
-            results.append(pc_result)
+    pcs, buildings = retrieve_subbatch_buildings(pc_batch, data, INPUT_GPK, AGE_COLUMNS, AGE_BATCH_COLUMNS, AGE_PROFILE,
+                                                 retrieval, retrieval_context)
+    results = summarise_building_age_batch(pcs, buildings)
     
     logger.debug(f'Number of processed results: {len(results)}')
 
-    if results:
+    save_age_results(results, log_file, process_batch_name)
+
+
+def run_age_calc(pcs_list, data, INPUT_GPK, batch_size, batch_label, log_file, overlap, retrieval='batch', retrieval_context=None):
+    for i in range(0, len(pcs_list), batch_size):
+        batch = pcs_list[i:i + batch_size]
+        process_age_batch(batch, data, INPUT_GPK, batch_label, log_file, overlap, retrieval, retrieval_context)
+
+
+def save_age_results(results, log_file, process_batch_name):
+    """Append a sub-batch of age results (list of per postcode dicts or a DataFrame) to the log file."""
+    if len(results):
         df = pd.DataFrame(results)
         logger.debug('Saving results to log file...')
         if df.groupby('postcode').size().max() > 1:
@@ -36,9 +43,3 @@ def process_age_batch(pc_batch, data, INPUT_GPK, process_batch_name, log_file, o
             df.to_csv(log_file, mode='a', header=False, index=False)
 
         logger.info(f'Log file saved for batch: {process_batch_name}')
-
-
-def run_age_calc(pcs_list, data, INPUT_GPK, batch_size, batch_label, log_file, overlap):
-    for i in range(0, len(pcs_list), batch_size):
-        batch = pcs_list[i:i + batch_size]
-        process_age_batch(batch, data, INPUT_GPK, batch_label, log_file, overlap)  # Updated function call
@@ -0,0 +1,107 @@
+"""
+Module: building_schema.py
+Description: Category sets of the Verisk string attributes, and their conversion to pandas Categoricals.
+
+Building reads (postcode_utils.read_vector, building_store and the national scan) convert these columns once,
+so the themes' masks and counts compare integer codes instead of strings, and a sub-batch holds each string
+once instead of once per building.
+
+Key features
+ - one category order per attribute, shared by every read, so frames concatenate without falling back to object
+ - values outside a set are kept (the column's categories are extended) and logged once per value
+ - height buckets as integer codes into one label table (height_bucket_codes), labels only on request
+"""
+
+import numpy as np
+import pandas as pd
+
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+USES = ['Residential', 'Mixed Use', 'Commercial', 'Non Residential']
+
+# residential premise types, the clean residential buildings of the fuel theme
+RESIDENTIAL_TYPES = [
+    'Medium height flats 5-6 storeys', 'Small low terraces',
+    '3-4 storey and smaller flats', 'Tall terraces 3-4 storeys',
+    'Large semi detached', 'Standard size detached',
+    'Standard size semi detached', '2 storeys terraces with t rear extension',
+    'Semi type house in multiples', 'Tall flats 6-15 storeys',
+    'Large detached', 'Very tall point block flats',
+    'Very large detached', 'Planned balanced mixed estates',
+    'Linked and step linked premises'
+]
+PREMISE_TYPES = RESIDENTIAL_TYPES + ['Domestic outbuilding', 'Unknown']
+
+# premise_age values bucketed together as 'Pre 1919'
+PRE_1919_AGES = ['Pre 1837', '1837-1869', '1870-1918']
+PREMISE_AGES = PRE_1919_AGES + ['1919-1944', '1945-1959', '1960-1979', '1980-1989', '1990-1999', 'Post 1999',
+                                'Unknown date']
+
+BASEMENTS = ['Basement confirmed', 'Basement likely', 'No basement']
+
+HEIGHT_BINS = [0, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 22, 24, 26, 28, 30, 35, 40,
+               45, 50, 55, 60, 70, 80, 90, 100, 200]
+HEIGHT_BUCKETS = [f"{b}-{HEIGHT_BINS[i+1]}m" for i, b in enumerate(HEIGHT_BINS[:-1])]
+_HEIGHT_EDGES = np.asarray(HEIGHT_BINS, dtype=float)
+
+# building columns read as Categoricals, and their categories
+BUILDING_CATEGORIES = {
+    'premise_use': USES,
+    'map_simple_use': USES,
+    'premise_type': PREMISE_TYPES,
+    'premise_age': PREMISE_AGES,
+    'basement': BASEMENTS,
+}
+
+# values outside the category sets already logged
+_reported = set()
+
+
+def to_categorical(values, categories, name=None):
+    """
+    values as a Categorical with the given categories. Values outside them are appended as extra categories
+    (logged once), so nothing becomes null.
+    """
+    values = pd.Series(values)
+    cat = pd.Categorical(values, categories=categories)
+    outside = values.notna().values & (cat.codes == -1)
+    if outside.any():
+        extra = list(dict.fromkeys(values[outside]))
+        new = [v for v in extra if (name, v) not in _reported]
+        if new:
+            logger.warning(f'Values outside the {name} categories, kept as extra categories: {new}')
+            _reported.update((name, v) for v in new)
+        cat = pd.Categorical(values, categories=list(categories) + extra)
+    return cat
+
+
+def has_schema_categories(dtype, categories):
+    """Whether a dtype is already a Categorical led by the schema's categories, in order."""
+    return (isinstance(dtype, pd.CategoricalDtype)
+            and list(dtype.categories[:len(categories)]) == list(categories))
+
+
+def apply_building_schema(df):
+    """Convert the BUILDING_CATEGORIES columns of a building frame to Categoricals, in place. Returns df."""
+    for col, categories in BUILDING_CATEGORIES.items():
+        if col in df.columns and not has_schema_categories(df[col].dtype, categories):
+            df[col] = to_categorical(df[col].values, categories, col)
+    return df
+
+
+def height_bucket_codes(heights):
+    """
+    Index into HEIGHT_BUCKETS of each height, bins closed on the left as pd.cut(right=False).
+    -1 for null heights and heights outside [HEIGHT_BINS[0], HEIGHT_BINS[-1]).
+    """
+    heights = np.asarray(heights, dtype=float)
+    codes = np.searchsorted(_HEIGHT_EDGES, heights, side='right') - 1
+    codes[(codes >= len(HEIGHT_BUCKETS)) | np.isnan(heights)] = -1
+    return codes.astype(np.int8)
+
+
+def height_bucket_labels(codes):
+    """HEIGHT_BUCKETS labels of bucket codes as an ordered Categorical, null for -1 (the pd.cut result)."""
+    return pd.Categorical.from_codes(codes, categories=HEIGHT_BUCKETS, ordered=True)
@@ -0,0 +1,469 @@
+"""
+Module: building_store.py
+Description: Columnar copy of the Verisk building GeoPackage, partitioned by postcode area.
+
+The GeoPackage is read through GDAL's SQLite driver, and each bbox query is a burst of small random
+reads - on the shared HPC filesystem this is the biggest cost per batch. The store is a one-time
+conversion of the same data into GeoParquet files that can be read with large sequential reads.
+
+Key features
+ - one GeoParquet file per postcode area (same one / two letter split as find_postcode_for_ONSUD_file)
+ - rows sorted along a Hilbert curve so nearby buildings sit in the same row groups
+ - per building bbox columns, so parquet row group statistics give a bbox for every row group
+ - a partition manifest (_partitions.csv) with the bbox of each partition
+ - reads only open partitions and row groups whose bbox intersects the query
+ - memory mapped uprn / upn -> row location indexes, so UPRN matches (and buildings from a precomputed
+   postcode assignment) are gathered with no spatial query
+
+Store layout:
+    store_dir/
+    ├── _partitions.csv        (pc_area, file, n_rows, n_row_groups, minx, miny, maxx, maxy)
+    ├── _index_uprn/           (sorted keys.npy, part.npy, row_group.npy, offset.npy)
+    ├── _index_upn/
+    ├── AB.parquet
+    ├── B.parquet
+    └── ...
+
+The reader returns the same columns and rows as gpd.read_file on the GeoPackage. Rows come back in
+GeoPackage fid order (GDAL returns bbox reads in R-tree order, which cannot be reproduced here).
+"""
+
+import os
+import glob
+import json
+import shutil
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
+from pyogrio.raw import read as ogr_read
+from pyogrio import read_info
+from shapely.geometry import box
+from shapely.prepared import prep
+
+from .building_schema import apply_building_schema
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+# ============================================================
+# Constants
+# ============================================================
+
+MANIFEST_NAME = '_partitions.csv'
+GEOMETRY_COL = 'geometry'
+# original row position in the GeoPackage, used to return rows in file order
+SOURCE_ROW_COL = 'source_row'
+BBOX_COLS = ['bbox_minx', 'bbox_miny', 'bbox_maxx', 'bbox_maxy']
+STORE_ONLY_COLS = [SOURCE_ROW_COL] + BBOX_COLS
+# buildings whose representative point is not inside any postcode area polygon
+UNASSIGNED_AREA = 'NONE'
+# British National Grid extent, used to scale coordinates for the Hilbert key
+BNG_EXTENT = (0, 0, 700000, 1300000)
+HILBERT_ORDER = 16
+
+
+# ============================================================
+# Space filling curve
+# ============================================================
+
+def hilbert_index(x, y, extent=BNG_EXTENT, order=HILBERT_ORDER):
+    """Hilbert curve index of points (x, y) on a 2**order grid over extent."""
+    n = 1 << order
+    minx, miny, maxx, maxy = extent
+    size = max(maxx - minx, maxy - miny)
+    x = np.clip(((np.asarray(x, dtype=float) - minx) / size * n).astype(np.int64), 0, n - 1)
+    y = np.clip(((np.asarray(y, dtype=float) - miny) / size * n).astype(np.int64), 0, n - 1)
+
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        swap = ry == 0
+        flip = swap & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s //= 2
+    return d
+
+
+# ============================================================
+# Conversion
+# ============================================================
+
+def load_pc_area_polygons(path_to_pcshp):
+    """Dissolve each one / two letter postcode shapefile into a single postcode area polygon."""
+    shp_paths = (glob.glob(os.path.join(path_to_pcshp, 'one_letter_pc_code/*/*.shp')) +
+                 glob.glob(os.path.join(path_to_pcshp, 'two_letter_pc_code/*.shp')))
+    if not shp_paths:
+        raise ValueError(f'No postcode shapefiles found in {path_to_pcshp}')
+
+    areas = []
+    for shp in shp_paths:
+        logger.debug(f'Dissolving postcode area shapefile: {shp}')
+        pc_shp = gpd.read_file(shp)
+        areas.append(pc_shp[['PC_AREA', 'geometry']].dissolve('PC_AREA').reset_index())
+    return pd.concat(areas, ignore_index=True)
+
+
+def assign_pc_area(geoms, areas):
+    """Postcode area for each building, from its representative point. Unmatched go to UNASSIGNED_AREA."""
+    points = gpd.GeoDataFrame(geometry=geoms.representative_point().values, crs=geoms.crs)
+    joined = points.sjoin(areas, how='left', predicate='within')
+    # a point on a shared boundary can match two areas, keep the first
+    joined = joined[~joined.index.duplicated(keep='first')]
+    return joined['PC_AREA'].fillna(UNASSIGNED_AREA).values
+
+
+def geo_metadata(crs, bounds):
+    """GeoParquet metadata for a WKB geometry column."""
+    return {
+        'version': '0.4.0',
+        'primary_column': GEOMETRY_COL,
+        'columns': {
+            GEOMETRY_COL: {
+                'encoding': 'WKB',
+                'crs': CRS.from_user_input(crs).to_json_dict() if crs else None,
+                'geometry_type': ['Polygon', 'MultiPolygon'],
+                'bbox': [float(b) for b in bounds],
+            }
+        },
+    }
+
+
+def read_gpkg_chunk(input_gpk, skip_features, max_features):
+    """Read a chunk of the GeoPackage in file order, geometry left as WKB. Returns (DataFrame, crs)."""
+    meta, _, geometry, field_data = ogr_read(input_gpk, skip_features=skip_features, max_features=max_features)
+    df = pd.DataFrame({name: values for name, values in zip(meta['fields'], field_data)})
+    df[GEOMETRY_COL] = geometry
+    return df, meta['crs']
+
+
+def store_schema(df):
+    """Arrow schema for a chunk, fixed up front so all-null chunks keep their column types."""
+    fields = []
+    for col, dtype in df.dtypes.items():
+        if col == GEOMETRY_COL:
+            fields.append(pa.field(col, pa.binary()))
+        elif dtype == object:
+            fields.append(pa.field(col, pa.string()))
+        else:
+            fields.append(pa.field(col, pa.from_numpy_dtype(dtype)))
+    return pa.schema(fields)
+
+
+def convert_gpkg_to_store(input_gpk, path_to_pcshp, output_dir, chunk_size=500000, row_group_size=10000):
+    """
+    One-time conversion of the building GeoPackage into a postcode area partitioned GeoParquet store.
+
+    Args:
+        input_gpk: Path to the Verisk building GeoPackage
+        path_to_pcshp: Path to the directory containing postcode shapefiles
+        output_dir: Directory to write the store to
+        chunk_size: Number of buildings read from the GeoPackage at a time
+        row_group_size: Number of buildings per parquet row group (the unit of a bbox read)
+
+    Returns:
+        DataFrame of the partition manifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    staging_dir = os.path.join(output_dir, '_staging')
+    os.makedirs(staging_dir, exist_ok=True)
+
+    areas = load_pc_area_polygons(path_to_pcshp)
+    n_features = read_info(input_gpk)['features']
+    logger.info(f'Converting {n_features} buildings from {input_gpk} to store at {output_dir}')
+
+    # Stage 1: stream the GeoPackage in file order, split each chunk by postcode area
+    crs, schema = None, None
+    for chunk_num, skip in enumerate(range(0, n_features, chunk_size)):
+        df, crs = read_gpkg_chunk(input_gpk, skip, chunk_size)
+        geoms = gpd.GeoSeries.from_wkb(df[GEOMETRY_COL], crs=crs)
+
+        df[SOURCE_ROW_COL] = np.arange(skip, skip + len(df), dtype=np.int64)
+        df[BBOX_COLS] = geoms.bounds.values
+        if schema is None:
+            schema = store_schema(df)
+        df['pc_area'] = assign_pc_area(geoms, areas)
+
+        for pc_area, part in df.groupby('pc_area'):
+            area_dir = os.path.join(staging_dir, pc_area)
+            os.makedirs(area_dir, exist_ok=True)
+            part = part.drop(columns='pc_area')
+            pq.write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False),
+                           os.path.join(area_dir, f'part_{chunk_num}.parquet'))
+        logger.info(f'Staged buildings {skip} to {skip + len(df)}')
+
+    # Stage 2: one Hilbert sorted file per postcode area
+    manifest = []
+    for pc_area in sorted(os.listdir(staging_dir)):
+        parts = sorted(glob.glob(os.path.join(staging_dir, pc_area, '*.parquet')))
+        table = pa.concat_tables([pq.read_table(p) for p in parts])
+
+        bounds = np.column_stack([table[c].to_numpy() for c in BBOX_COLS])
+        key = hilbert_index((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2)
+        table = table.take(pa.array(np.argsort(key, kind='stable')))
+
+        area_bounds = [bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()]
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'geo'] = json.dumps(geo_metadata(crs, area_bounds)).encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+
+        file_name = f'{pc_area}.parquet'
+        pq.write_table(table, os.path.join(output_dir, file_name), row_group_size=row_group_size)
+        manifest.append({
+            'pc_area': pc_area,
+            'file': file_name,
+            'n_rows': table.num_rows,
+            'n_row_groups': pq.ParquetFile(os.path.join(output_dir, file_name)).num_row_groups,
+            'minx': area_bounds[0], 'miny': area_bounds[1], 'maxx': area_bounds[2], 'maxy': area_bounds[3],
+        })
+        logger.info(f'Wrote partition {pc_area}: {table.num_rows} buildings')
+
+    shutil.rmtree(staging_dir)
+    manifest = pd.DataFrame(manifest)
+    manifest.to_csv(os.path.join(output_dir, MANIFEST_NAME), index=False)
+
+    if manifest['n_rows'].sum() != n_features:
+        raise ValueError(f"Store has {manifest['n_rows'].sum()} buildings, expected {n_features}")
+
+    load_store_manifest.cache_clear()
+    build_key_index(output_dir, 'uprn')
+    build_key_index(output_dir, 'upn')
+    logger.info(f'Building store complete: {len(manifest)} partitions')
+    return manifest
+
+
+# ============================================================
+# Reading
+# ============================================================
+
+def is_building_store(path):
+    """True if path is a converted building store directory rather than a GeoPackage."""
+    return isinstance(path, (str, os.PathLike)) and os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+@lru_cache(maxsize=8)
+def load_store_manifest(store_dir):
+    """Partition manifest, loaded once per process."""
+    return pd.read_csv(os.path.join(store_dir, MANIFEST_NAME))
+
+
+@lru_cache(maxsize=256)
+def open_partition(path):
+    """
+    Open a partition file once per process.
+    Returns (ParquetFile, row group bboxes array of minx, miny, maxx, maxy, crs)
+    """
+    pf = pq.ParquetFile(path)
+    names = pf.schema_arrow.names
+    col_idx = [names.index(c) for c in BBOX_COLS]
+    rg_bounds = np.empty((pf.num_row_groups, 4))
+    for i in range(pf.num_row_groups):
+        rg = pf.metadata.row_group(i)
+        stats = [rg.column(j).statistics for j in col_idx]
+        # mins of the min columns, maxes of the max columns
+        rg_bounds[i] = [stats[0].min, stats[1].min, stats[2].max, stats[3].max]
+    geo = json.loads(pf.schema_arrow.metadata[b'geo'])
+    crs = geo['columns'][GEOMETRY_COL]['crs']
+    return pf, rg_bounds, CRS.from_user_input(crs) if crs else None
+
+
+def bounds_intersect(bounds, query):
+    """Boolean mask of rows of a (n, 4) bounds array that intersect the query bounds."""
+    minx, miny, maxx, maxy = query
+    return ((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) &
+            (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))
+
+
+def bounds_within(bounds, query):
+    """Boolean mask of rows of a (n, 4) bounds array that lie inside the query bounds."""
+    minx, miny, maxx, maxy = query
+    return ((bounds[:, 0] >= minx) & (bounds[:, 2] <= maxx) &
+            (bounds[:, 1] >= miny) & (bounds[:, 3] <= maxy))
+
+
+def store_columns(store_dir, columns, geometry=False):
+    """
+    Parquet columns to read for a set of requested building columns, None for all of them.
+    The store only columns are always read, geometry only if requested or needed for a spatial filter.
+    """
+    if columns is None:
+        return None
+    manifest = load_store_manifest(store_dir)
+    pf, _, _ = open_partition(os.path.join(store_dir, manifest['file'].iloc[0]))
+    keep = set(columns) | set(STORE_ONLY_COLS) | ({GEOMETRY_COL} if geometry else set())
+    return [c for c in pf.schema_arrow.names if c in keep]
+
+
+def empty_store_table(store_dir, read_cols=None):
+    """Empty table with the store schema, so reads with no matches still have every column."""
+    manifest = load_store_manifest(store_dir)
+    pf, _, crs = open_partition(os.path.join(store_dir, manifest['file'].iloc[0]))
+    table = pf.schema_arrow.empty_table()
+    return (table if read_cols is None else table.select(read_cols)), crs
+
+
+def store_table_to_gdf(table, crs, geom=None, envelope_within=False, row_id_col=None):
+    """
+    Filter rows read from the store to those intersecting geom, decode geometry and return in GeoPackage
+    fid order with the store only columns dropped, Verisk string attributes as Categoricals (see building_schema).
+    envelope_within: keep only rows whose bbox lies inside the geom bounds (candidates for a within join)
+    row_id_col: keep each row's position in the GeoPackage as this column
+    Tables read without the geometry column (and no geom) come back as a DataFrame, with nothing decoded.
+    """
+    df = apply_building_schema(table.to_pandas())
+    if row_id_col is not None:
+        df[row_id_col] = df[SOURCE_ROW_COL]
+    if GEOMETRY_COL not in df.columns:
+        return df.sort_values(SOURCE_ROW_COL).drop(columns=STORE_ONLY_COLS).reset_index(drop=True)
+    if geom is not None:
+        # bbox prefilter on the stored bounds before decoding any geometry
+        bounds_filter = bounds_within if envelope_within else bounds_intersect
+        df = df[bounds_filter(df[BBOX_COLS].values, geom.bounds)]
+
+    gdf = gpd.GeoDataFrame(df.drop(columns=[GEOMETRY_COL]),
+                           geometry=gpd.GeoSeries.from_wkb(df[GEOMETRY_COL].values, crs=crs, index=df.index))
+    if geom is not None and not envelope_within:
+        prepared = prep(geom)
+        gdf = gdf[np.array([prepared.intersects(g) for g in gdf.geometry], dtype=bool)]
+
+    gdf = gdf.sort_values(SOURCE_ROW_COL).drop(columns=STORE_ONLY_COLS).reset_index(drop=True)
+    return gdf
+
+
+def read_building_store(store_dir, bbox=None, mask=None, envelope_within=False, columns=None, row_id_col=None):
+    """
+    Read buildings intersecting a bbox or mask geometry from the building store.
+    Same columns and rows as gpd.read_file(input_gpk, bbox=bbox, mask=mask), in GeoPackage fid order.
+    envelope_within: only return buildings whose bbox lies inside the query bounds, i.e. the only
+        buildings that can be within a polygon with those bounds
+    columns: only read these building columns (None for all), geometry is always read
+    row_id_col: also return each building's position in the GeoPackage in this column
+    """
+    geom = mask if mask is not None else bbox
+    if geom is not None and not hasattr(geom, 'bounds'):
+        geom = box(*geom)
+    manifest = load_store_manifest(store_dir)
+
+    if geom is None:
+        parts = manifest
+    else:
+        parts = manifest[bounds_intersect(manifest[['minx', 'miny', 'maxx', 'maxy']].values, geom.bounds)]
+
+    read_cols = store_columns(store_dir, columns, geometry=True)
+    table, crs = empty_store_table(store_dir, read_cols)
+    tables = [table]
+    for file_name in parts['file']:
+        pf, rg_bounds, crs = open_partition(os.path.join(store_dir, file_name))
+        row_groups = np.arange(pf.num_row_groups) if geom is None else np.flatnonzero(bounds_intersect(rg_bounds, geom.bounds))
+        if len(row_groups):
+            tables.append(pf.read_row_groups(row_groups.tolist(), columns=read_cols))
+
+    return store_table_to_gdf(pa.concat_tables(tables), crs, geom, envelope_within, row_id_col)
+
+
+# ============================================================
+# Key index
+# ============================================================
+
+def key_index_dir(store_dir, key_col):
+    return os.path.join(store_dir, f'_index_{key_col}')
+
+
+def has_key_index(store_dir, key_col='uprn'):
+    return os.path.exists(os.path.join(key_index_dir(store_dir, key_col), 'keys.npy'))
+
+
+def normalise_keys(values, numeric):
+    """Index keys: int64 for numeric keys such as uprn (nulls dropped), fixed width bytes otherwise."""
+    values = pd.Series(values)
+    if numeric:
+        return pd.to_numeric(values, errors='coerce').dropna().astype(np.int64).values
+    return values.dropna().astype(str).values.astype('S')
+
+
+def build_key_index(store_dir, key_col='uprn'):
+    """
+    Build a persistent key -> row location index over the store, e.g. for uprn.
+
+    Saved as sorted .npy arrays (keys, partition number, row group, offset within row group)
+    under store_dir/_index_{key_col}/ so they can be memory mapped at startup.
+    """
+    manifest = load_store_manifest(store_dir)
+    keys, parts, row_groups, offsets = [], [], [], []
+    numeric = None
+    for part_num, file_name in enumerate(manifest['file']):
+        pf = pq.ParquetFile(os.path.join(store_dir, file_name))
+        for rg in range(pf.num_row_groups):
+            values = pf.read_row_group(rg, columns=[key_col]).column(key_col).to_pandas()
+            if numeric is None:
+                numeric = pd.api.types.is_numeric_dtype(values)
+            valid = values.notna().values
+            keys.append(normalise_keys(values, numeric))
+            offsets.append(np.flatnonzero(valid).astype(np.int32))
+            parts.append(np.full(valid.sum(), part_num, dtype=np.int16))
+            row_groups.append(np.full(valid.sum(), rg, dtype=np.int32))
+
+    keys = np.concatenate(keys)
+    order = np.argsort(keys, kind='stable')
+    out_dir = key_index_dir(store_dir, key_col)
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, 'keys.npy'), keys[order])
+    np.save(os.path.join(out_dir, 'part.npy'), np.concatenate(parts)[order])
+    np.save(os.path.join(out_dir, 'row_group.npy'), np.concatenate(row_groups)[order])
+    np.save(os.path.join(out_dir, 'offset.npy'), np.concatenate(offsets)[order])
+    logger.info(f'Built {key_col} index over {len(keys)} buildings')
+
+
+@lru_cache(maxsize=8)
+def load_key_index(store_dir, key_col='uprn'):
+    """Memory map the key index, once per process. Returns (keys, part, row_group, offset)."""
+    index_dir = key_index_dir(store_dir, key_col)
+    return tuple(np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+                 for name in ['keys', 'part', 'row_group', 'offset'])
+
+
+def lookup_key_positions(keys, values):
+    """Positions in the sorted key array of every entry matching any of values (keys may repeat)."""
+    lo = np.searchsorted(keys, values, side='left')
+    hi = np.searchsorted(keys, values, side='right')
+    counts = hi - lo
+    starts = np.repeat(lo, counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return starts + within
+
+
+def gather_by_key(store_dir, values, key_col='uprn', bbox=None, columns=None):
+    """
+    Buildings whose key_col value is in values, gathered through the key index with no spatial query.
+    bbox: optionally keep only buildings intersecting bbox, to match a bbox read followed by isin
+    columns: only read these building columns (None for all). Without 'geometry' (and no bbox) nothing
+        is decoded and a DataFrame is returned.
+    Same columns as read_building_store, in GeoPackage fid order.
+    """
+    keys, part, row_group, offset = load_key_index(store_dir, key_col)
+    query = np.unique(normalise_keys(values, keys.dtype.kind in 'iu'))
+    pos = lookup_key_positions(keys, query)
+
+    manifest = load_store_manifest(store_dir)
+    read_cols = store_columns(store_dir, columns, geometry=bbox is not None or GEOMETRY_COL in (columns or []))
+    table, crs = empty_store_table(store_dir, read_cols)
+    tables = [table]
+    locations = pd.DataFrame({'part': part[pos], 'row_group': row_group[pos], 'offset': offset[pos]})
+    for (part_num, rg), group in locations.groupby(['part', 'row_group']):
+        pf, _, crs = open_partition(os.path.join(store_dir, manifest['file'].iloc[part_num]))
+        tables.append(pf.read_row_group(rg, columns=read_cols).take(pa.array(group['offset'].values)))
+
+    geom = None
+    if bbox is not None:
+        geom = bbox if hasattr(bbox, 'bounds') else box(*bbox)
+    return store_table_to_gdf(pa.concat_tables(tables), crs, geom)
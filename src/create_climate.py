@@ -29,6 +29,7 @@ import glob
 from pathlib import Path
 import rioxarray as rxr 
 
+from .postcode_utils import read_vector
 from .logging_config import get_logger
 logger = get_logger(__name__)
 
@@ -196,7 +197,7 @@ def run_all_pc_shps(output_path: Path, pc_base_path: Path, temp_file: Path):
             logger.info(f"Temperature Output file {output_file} already exists. Skipping...")
             continue
         logger.info(f"For temperature, processing postcode {pc_name}...")
-        pc_df = gpd.read_file(pc)
+        pc_df = read_vector(pc)
         res = calc_HDD_CDD_pc(pc_df, xds)
         save_pc_file(res, output_file)
 
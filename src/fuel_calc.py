@@ -1,8 +1,11 @@
 import pandas as pd
 import sys 
 import numpy as np
-from .pre_process_buildings import pre_process_building_data 
-from .postcode_utils import check_duplicate_primary_key, find_data_pc_joint
+from .pre_process_buildings import pre_process_postcode_buildings, PRE_PROCESS_PROFILE_COLUMNS, VOLUMETRICS
+from .building_schema import RESIDENTIAL_TYPES
+from .fuel_store import as_fuel_store, fuel_positions, take_fuel_column
+from .postcode_utils import (check_duplicate_primary_key, find_data_pc_joint, get_pc_buildings, building_columns,
+                             postcode_codes, match_record_dtypes)
 
 import pandas as pd
 import numpy as np
@@ -13,17 +16,21 @@ COLS = ['premise_area', 'total_fl_area_H', 'total_fl_area_FC',
  'base_floor', 'basement_heated_vol', 'listed_bool', 'uprn_count']
 
 COLS_OB = ['premise_area', 'total_fl_area_H', 'total_fl_area_FC', 'uprn_count']
-RES_USE_TYPES = [
-    'Medium height flats 5-6 storeys', 'Small low terraces',
-    '3-4 storey and smaller flats', 'Tall terraces 3-4 storeys',
-    'Large semi detached', 'Standard size detached',
-    'Standard size semi detached', '2 storeys terraces with t rear extension',
-    'Semi type house in multiples', 'Tall flats 6-15 storeys',
-    'Large detached', 'Very tall point block flats',
-    'Very large detached', 'Planned balanced mixed estates',
-    'Linked and step linked premises'
-]
+RES_USE_TYPES = RESIDENTIAL_TYPES
 EXCL_RES_TYPES = ['Domestic outbuilding', None]
+# columns with a null count in the log file
+AREA_COLS = ['premise_area', 'total_fl_area_H', 'total_fl_area_FC']
+# pre processing the fuel theme needs: the floor areas of create_heated_vol
+FUEL_PROFILE = VOLUMETRICS
+# building columns the fuel theme reads
+FUEL_COLUMNS = building_columns(PRE_PROCESS_PROFILE_COLUMNS[FUEL_PROFILE], ['map_simple_use', 'premise_type', 'premise_area', 'uprn_count'])
+# pre processed building columns summarise_fuel_batch uses
+FUEL_BATCH_COLUMNS = ['map_simple_use', 'premise_type'] + COLS
+# log file suffix -> fuel data column
+FUEL_VARS = {'num_meters': 'Num_meters', 'total': 'Total_cons_kwh', 'avg': 'Mean_cons_kwh', 'median': 'Median_cons_kwh'}
+# map_simple_use counted for every building, by log file column
+USE_COUNTS = {'mixed_alltypes_count': 'Mixed Use', 'comm_alltypes_count': 'Commercial',
+              'unknown_alltypes_count': 'Non Residential'}
 
 
 
@@ -56,9 +63,8 @@ def calc_df_sum_attribute(df: pd.DataFrame, cols: List[str], prefix: str = '') -
     }
     
     # Add null counts for specific columns directly in the calculation
-    area_cols = ['premise_area', 'total_fl_area_H', 'total_fl_area_FC']
     for col in cols:
-        if col in area_cols:
+        if col in AREA_COLS:
             result[f'{prefix}{col}_null_count'] = df[col].isna().sum()
     
     return result
@@ -90,7 +96,8 @@ def process_buildings(df: Optional[pd.DataFrame]) -> Dict:
             'outbuilding': res_df['premise_type'] == 'Domestic outbuilding',
             'all_res' : res_df['map_simple_use'] == 'Residential'
         }
-        unexpected_types = set(res_df['premise_type']) - set(RES_USE_TYPES + EXCL_RES_TYPES)
+        # null types (None, or NaN from a Categorical) are expected
+        unexpected_types = set(res_df['premise_type'].dropna()) - set(RES_USE_TYPES + EXCL_RES_TYPES)
         if unexpected_types:
             raise ValueError(f"Unexpected residential types: {unexpected_types}")
     
@@ -114,33 +121,32 @@ def process_buildings(df: Optional[pd.DataFrame]) -> Dict:
 
 def process_postcode_fuel(pc: str, onsud_data: pd.DataFrame, 
                          gas_df: pd.DataFrame, elec_df: pd.DataFrame, 
-                         input_gpk: str, **kwargs) -> Dict:
-    """Process postcode fuel data with centralized null handling."""
+                         input_gpk: str, batch_buildings: Optional[Dict] = None, **kwargs) -> Dict:
+    """Process postcode fuel data with centralized null handling.
+    batch_buildings: optional output of find_data_pc_batch for the sub-batch, avoids a per postcode read
+    """
     pc = pc.strip()
-    uprn_match = find_data_pc_joint(pc, onsud_data, input_gpk=input_gpk)
-    
-    building_data = (None if uprn_match is None or uprn_match.empty 
-                    else pre_process_building_data(uprn_match))
-    
-    if building_data is not None and len(building_data) != len(uprn_match):
-        raise ValueError("Data loss during pre-processing")
-    
-    def get_fuel_vars(fuel_type: str, fuel_df: pd.DataFrame) -> Dict:
-        pc_fuel = fuel_df[fuel_df['Postcode'] == pc]
-        if pc_fuel.empty:
+    uprn_match = get_pc_buildings(pc, onsud_data, input_gpk, batch_buildings, columns=FUEL_COLUMNS)
+    return summarise_postcode_fuel(pc, pre_process_postcode_buildings(uprn_match, FUEL_PROFILE), gas_df, elec_df)
+
+
+def summarise_postcode_fuel(pc: str, building_data: Optional[pd.DataFrame],
+                            gas_df: pd.DataFrame, elec_df: pd.DataFrame) -> Dict:
+    """Fuel attributes for one postcode.
+    building_data: the postcode's buildings after pre_process_postcode_buildings (None if there are none)
+    gas_df, elec_df: FuelStore (see load_fuel_data) or DESNZ DataFrame
+    """
+    def get_fuel_vars(fuel_type: str, fuel_df) -> Dict:
+        store = as_fuel_store(fuel_df)
+        pos = fuel_positions(store, [pc])[0]
+        if pos < 0:
             return {
                 f'total_{fuel_type}': np.nan,
                 f'avg_{fuel_type}': np.nan,
                 f'median_{fuel_type}': np.nan,
                 f'num_meters_{fuel_type}': np.nan
             }
-        row = pc_fuel.iloc[0]
-        return {
-            f'num_meters_{fuel_type}': row['Num_meters'],
-            f'total_{fuel_type}': row['Total_cons_kwh'],
-            f'avg_{fuel_type}': row['Mean_cons_kwh'],
-            f'median_{fuel_type}': row['Median_cons_kwh']
-        }
+        return {f'{var}_{fuel_type}': store.columns[col][pos] for var, col in FUEL_VARS.items()}
     
     return {
         'postcode': pc,
@@ -148,3 +154,113 @@ def process_postcode_fuel(pc: str, onsud_data: pd.DataFrame,
         **get_fuel_vars('gas', gas_df),
         **get_fuel_vars('elec', elec_df)
     }
+
+
+def fuel_record_keys(has_buildings, has_clean, has_outb, has_gas, has_elec):
+    """
+    Keys of a summarise_postcode_fuel record, in order. They depend on which parts of the postcode had data:
+    null counts only come with buildings, and the fuel variables are ordered differently when missing.
+    """
+    def attribute_keys(cols, prefix, has_rows):
+        keys = [f'{prefix}total_buildings'] + [f'{prefix}{col}_total' for col in cols]
+        return keys + [f'{prefix}{col}_null_count' for col in cols if col in AREA_COLS] if has_rows else keys
+
+    if has_buildings:
+        keys = [*attribute_keys(COLS_OB, 'all_types_', True), *USE_COUNTS, 'all_residential_types_count',
+                *attribute_keys(COLS, 'clean_res_', has_clean), *attribute_keys(COLS_OB, 'outb_res_', has_outb)]
+    else:
+        keys = [*attribute_keys(COLS, 'clean_res_', False), *attribute_keys(COLS_OB, 'outb_res_', False),
+                *attribute_keys(COLS_OB, 'all_types_', False), *USE_COUNTS]
+    for fuel_type, has_fuel in [('gas', has_gas), ('elec', has_elec)]:
+        order = ['num_meters', 'total', 'avg', 'median'] if has_fuel else ['total', 'avg', 'median', 'num_meters']
+        keys += [f'{var}_{fuel_type}' for var in order]
+    return ['postcode'] + keys
+
+
+def fuel_record_columns(shapes):
+    """
+    Column order pd.DataFrame gives a list of summarise_postcode_fuel records: keys in order of first appearance.
+    shapes: bool array (n postcodes, 5) of the fuel_record_keys flags per postcode
+    """
+    _, first = np.unique(shapes, axis=0, return_index=True)
+    columns = {}
+    for i in sorted(first):
+        columns.update(dict.fromkeys(fuel_record_keys(*shapes[i])))
+    return list(columns)
+
+
+def lookup_fuel_vars(pcs, fuel_type, fuel_df):
+    """
+    Fuel variables of postcodes (first row per postcode, as summarise_postcode_fuel), NaN where missing.
+    One hashed join of the whole sub-batch against the store.
+    fuel_df: FuelStore (see load_fuel_data) or DESNZ DataFrame
+    Returns: DataFrame aligned with pcs, bool array of the postcodes found
+    """
+    store = as_fuel_store(fuel_df)
+    positions = fuel_positions(store, pcs)
+    return pd.DataFrame({f'{var}_{fuel_type}': take_fuel_column(store, col, positions)
+                         for var, col in FUEL_VARS.items()}), positions >= 0
+
+
+def summarise_fuel_batch(pcs, buildings, gas_df, elec_df):
+    """
+    Fuel attributes for a whole sub-batch, the same values and log format as summarise_postcode_fuel per postcode.
+    Buildings are split into residential clean, residential outbuilding and other, and every sum, non null count
+    and building count is one bincount over (postcode, category) codes; the all_types_ columns add the three up.
+
+    pcs: postcodes in output order
+    buildings: the sub-batch's pre processed buildings with a 'postcode' column (see stack_postcode_buildings),
+        postcodes with no buildings are absent
+    Returns: DataFrame with one row per postcode
+    """
+    unique_pcs = list(dict.fromkeys(pcs))
+    n_pcs = len(unique_pcs)
+    pc_codes = postcode_codes(buildings, unique_pcs)
+    buildings, pc_codes = buildings[pc_codes >= 0], pc_codes[pc_codes >= 0]
+
+    # masks compare Categorical codes (see building_schema), not strings
+    use, premise_type = buildings['map_simple_use'], buildings['premise_type']
+    res = (use == 'Residential').values
+    clean = res & premise_type.isin(RES_USE_TYPES).values
+    outb = res & (premise_type == 'Domestic outbuilding').values
+    unexpected = res & ~clean & ~outb & premise_type.notna().values
+    if unexpected.any():
+        raise ValueError(f"Unexpected residential types: {set(premise_type[unexpected])}")
+
+    # category 0 clean residential, 1 residential outbuilding, 2 everything else
+    keys = pc_codes * 3 + np.where(clean, 0, np.where(outb, 1, 2))
+    n_rows = np.bincount(keys, minlength=n_pcs * 3).reshape(n_pcs, 3)
+    has_buildings = n_rows.sum(axis=1) > 0
+    blocks = {'clean_res_': (COLS, n_rows[:, 0], [0]), 'outb_res_': (COLS_OB, n_rows[:, 1], [1]),
+              'all_types_': (COLS_OB, n_rows.sum(axis=1), [0, 1, 2])}
+
+    out = {'postcode': unique_pcs}
+    int_cols = []
+    for prefix, (cols, n_block, cats) in blocks.items():
+        out[f'{prefix}total_buildings'] = np.where(n_block > 0, n_block, np.nan)
+        int_cols.append(f'{prefix}total_buildings')
+        for col in cols:
+            values = buildings[col].to_numpy(dtype=float, na_value=np.nan)
+            valid = ~np.isnan(values)
+            sums = np.bincount(keys, weights=np.where(valid, values, 0), minlength=n_pcs * 3).reshape(n_pcs, 3)
+            non_null = np.bincount(keys[valid], minlength=n_pcs * 3).reshape(n_pcs, 3)
+            sums, non_null = sums[:, cats].sum(axis=1), non_null[:, cats].sum(axis=1)
+            # sum(min_count=1): NaN unless some value is not null
+            out[f'{prefix}{col}_total'] = np.where(non_null > 0, sums, np.nan)
+            if pd.api.types.is_integer_dtype(buildings[col]) or pd.api.types.is_bool_dtype(buildings[col]):
+                int_cols.append(f'{prefix}{col}_total')
+            if col in AREA_COLS:
+                out[f'{prefix}{col}_null_count'] = np.where(n_block > 0, n_block - non_null, np.nan)
+                int_cols.append(f'{prefix}{col}_null_count')
+
+    for col, use_type in {**USE_COUNTS, 'all_residential_types_count': 'Residential'}.items():
+        out[col] = np.where(has_buildings, np.bincount(pc_codes[(use == use_type).values], minlength=n_pcs), np.nan)
+        int_cols.append(col)
+
+    gas, has_gas = lookup_fuel_vars(unique_pcs, 'gas', gas_df)
+    elec, has_elec = lookup_fuel_vars(unique_pcs, 'elec', elec_df)
+    order = pd.Index(unique_pcs).get_indexer(pcs)
+    result = pd.concat([pd.DataFrame(out), gas, elec], axis=1).iloc[order].reset_index(drop=True)
+    shapes = np.column_stack([has_buildings, n_rows[:, 0] > 0, n_rows[:, 1] > 0, has_gas, has_elec])[order]
+    result = result[fuel_record_columns(shapes)]
+    return match_record_dtypes(result, [col for col in int_cols if col in result.columns])
@@ -3,7 +3,9 @@ import pandas as pd
 import tempfile
 import os
 import logging
-from src.fuel_calc import process_postcode_fuel
+from src.fuel_calc import summarise_fuel_batch, FUEL_COLUMNS, FUEL_BATCH_COLUMNS, FUEL_PROFILE
+from src.pre_process_buildings import retrieve_subbatch_buildings
+from src.fuel_store import load_fuel_store
 import threading
 import geopandas as gpd
 
@@ -12,13 +14,13 @@ logger = get_logger(__name__)
 
 
 def load_fuel_data(gas_path, elec_path):
-    """Load gas and electricity data from CSV files."""
+    """Load gas and electricity data from CSV files, as postcode indexed FuelStores (cached next to the CSVs)."""
     try:
         logger.debug(f"Loading gas data from {gas_path}")
-        gas_df = pd.read_csv(gas_path)
+        gas_df = load_fuel_store(gas_path)
         
         logger.debug(f"Loading electricity data from {elec_path}")
-        elec_df = pd.read_csv(elec_path)
+        elec_df = load_fuel_store(elec_path)
         
         logger.debug("Successfully loaded fuel data")
         return gas_df, elec_df
@@ -27,15 +29,17 @@ def load_fuel_data(gas_path, elec_path):
         raise
 
 def process_fuel_batch_main(pc_batch, data, gas_df, elec_df, INPUT_GPK, 
-                          process_batch_name, log_file):
+                          process_batch_name, log_file, retrieval='batch', retrieval_context=None):
     """Process a batch of postcodes for fuel calculation."""
-    process_fuel_batch_base(
-        process_postcode_fuel, pc_batch, data, gas_df, elec_df,
-        INPUT_GPK, process_batch_name, log_file
-    )
+    logger.debug(f'Starting fuel batch for batch of pcs: {len(pc_batch)}')
+    pcs, buildings = retrieve_subbatch_buildings(pc_batch, data, INPUT_GPK, FUEL_COLUMNS, FUEL_BATCH_COLUMNS, FUEL_PROFILE,
+                                                 retrieval, retrieval_context)
+    results = summarise_fuel_batch(pcs, buildings, gas_df, elec_df)
+
+    save_fuel_results(results, log_file, process_batch_name)
 
 def run_fuel_calc_main(pcs_list, onsud_data, INPUT_GPK, subbatch_size, 
-                      batch_label, log_file, gas_df, elec_df):
+                      batch_label, log_file, gas_df, elec_df, retrieval='batch', retrieval_context=None):
     """Main function to run fuel calculations for a list of postcodes."""
     logger.info(f"Starting fuel calculations for {len(pcs_list)} postcodes")
     logger.debug(f"Batch size: {subbatch_size}, Batch label: {batch_label}")
@@ -45,33 +49,16 @@ def run_fuel_calc_main(pcs_list, onsud_data, INPUT_GPK, subbatch_size,
         logger.info(f"Processing sub-batch {i//subbatch_size + 1}, postcodes {i} to {min(i+subbatch_size, len(pcs_list))} for batch {batch_label}")
         process_fuel_batch_main(
             batch, onsud_data, gas_df, elec_df,
-            INPUT_GPK, batch_label, log_file
+            INPUT_GPK, batch_label, log_file, retrieval=retrieval, retrieval_context=retrieval_context
         )
 
-def process_fuel_batch_base(process_fn, pc_batch, data, gas_df, elec_df, 
-                          INPUT_GPK, process_batch_name, log_file, 
-                          overlap=None, batch_dir=None, path_to_pcshp=None):
-    """Base function for processing a batch of postcodes."""
-    logger.debug(f'Starting batch base function for batch of pcs: {len(pc_batch)}')
-    
-    # Initialize results list
-    results = []
-    for pc in pc_batch:
-        try:
-            pc_result = process_fn(
-                pc, data, gas_df, elec_df, INPUT_GPK,)
-            if pc_result is not None:
-                results.append(pc_result)
-            else:
-                logger.warning(f"No results generated for postcode {pc}")
-        except Exception as e:
-            logger.error(f"Error processing postcode {pc}: {str(e)}")
-            raise
-    
-    
-    
+def save_fuel_results(results, log_file, process_batch_name):
+    """
+    Append a sub-batch of fuel results (list of per postcode dicts or a DataFrame) to the log file, checking the
+    header matches.
+    """
     # Process results if we have any
-    if results:
+    if len(results):
         try:
             df = pd.DataFrame(results)
             
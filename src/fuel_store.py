@@ -0,0 +1,151 @@
+"""
+Module: fuel_store.py
+Description: Postcode indexed store of the DESNZ postcode level gas and electricity tables.
+
+Looking a postcode up by filtering the national table scans over a million rows, twice per postcode. The store
+keeps each table as sorted fixed width postcode keys plus one array per fuel column aligned with them, so a
+postcode (or a whole sub-batch of them) is found with a binary search.
+
+The cache next to the CSV is a directory of .npy files that every worker memory maps read only: the pages are
+shared through the OS page cache, so each extra worker on a node adds no copy of the tables and no Python
+objects per postcode.
+
+Store layout:
+    {csv name}.store/
+    ├── postcode_keys.npy      (sorted postcode keys, fixed width bytes)
+    ├── Num_meters.npy         (one array per FUEL_DATA_COLUMNS, aligned with postcodes)
+    └── ...
+
+Key features
+ - keys are the exact Postcode strings, so a postcode matches only the rows the DataFrame filter
+   (Postcode == pc) matched; the first row is kept for repeated postcodes
+ - fuel columns keep their dtype, so lookups give the values and dtypes the DataFrame filter gave
+ - the cache is rebuilt when the CSV is newer, and written to a temporary directory first so workers starting
+   together never read a partial one; a read only input directory only costs the rebuild
+"""
+
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+# DESNZ columns kept in the store, in log file order of fuel_calc.FUEL_VARS
+FUEL_DATA_COLUMNS = ['Num_meters', 'Total_cons_kwh', 'Mean_cons_kwh', 'Median_cons_kwh']
+POSTCODE_COL = 'Postcode'
+CACHE_SUFFIX = '.store'
+# caches from before exact keys (normalised postcodes.npy) have no such file, so are rebuilt
+KEYS_NAME = 'postcode_keys'
+
+# postcodes: sorted postcode keys (fixed width bytes), columns: dict of fuel column -> array aligned with them
+FuelStore = namedtuple('FuelStore', ['postcodes', 'columns'])
+
+
+def postcode_keys(values):
+    """
+    Postcodes as fixed width UTF-8 bytes, unchanged so lookups are exact string matches (case, spacing and
+    padding included). Nulls become b'', which matches no key.
+    """
+    values = np.asarray(values, dtype=object)
+    keys = np.where(pd.isna(values), '', values).astype(str)
+    return np.char.encode(keys, 'utf-8') if len(keys) else keys.astype('S')
+
+
+def fuel_store_from_frame(fuel_df):
+    """FuelStore of a DESNZ postcode level table (Postcode plus FUEL_DATA_COLUMNS)."""
+    keys = postcode_keys(fuel_df[POSTCODE_COL].values)
+    _, first = np.unique(keys, return_index=True)
+    first = first[keys[first] != b'']
+    # np.unique gives the first row of each key, in key order
+    return FuelStore(keys[first], {col: fuel_df[col].values[first] for col in FUEL_DATA_COLUMNS})
+
+
+def as_fuel_store(fuel):
+    """fuel as a FuelStore, building one when it is a DataFrame."""
+    return fuel if isinstance(fuel, FuelStore) else fuel_store_from_frame(fuel)
+
+
+def fuel_cache_path(csv_path):
+    return csv_path + CACHE_SUFFIX
+
+
+def save_fuel_store(store, path):
+    """Write the store's arrays as .npy files under path, replacing an older cache there."""
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.fuel_store_')
+    try:
+        np.save(os.path.join(tmp, f'{KEYS_NAME}.npy'), store.postcodes)
+        for col, values in store.columns.items():
+            np.save(os.path.join(tmp, f'{col}.npy'), values)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def load_fuel_cache(path):
+    """Memory map a cached store read only."""
+    return FuelStore(np.load(os.path.join(path, f'{KEYS_NAME}.npy'), mmap_mode='r'),
+                     {col: np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r') for col in FUEL_DATA_COLUMNS})
+
+
+def fuel_cache_is_fresh(cache, csv_path):
+    keys = os.path.join(cache, f'{KEYS_NAME}.npy')
+    return os.path.exists(keys) and os.path.getmtime(keys) >= os.path.getmtime(csv_path)
+
+
+@lru_cache(maxsize=4)
+def load_fuel_store(csv_path):
+    """
+    FuelStore of a DESNZ postcode level CSV, memory mapped from its cache when that is newer than the CSV
+    (once per process). Otherwise the CSV is read and the cache written next to it (skipped with a warning when
+    that is not possible, the store is then held in memory).
+    """
+    cache = fuel_cache_path(csv_path)
+    if fuel_cache_is_fresh(cache, csv_path):
+        logger.debug(f'Memory mapping fuel store {cache}')
+        return load_fuel_cache(cache)
+
+    logger.debug(f'Building fuel store from {csv_path}')
+    store = fuel_store_from_frame(pd.read_csv(csv_path, usecols=[POSTCODE_COL] + FUEL_DATA_COLUMNS))
+    try:
+        save_fuel_store(store, cache)
+    except OSError as e:
+        if fuel_cache_is_fresh(cache, csv_path):
+            # another worker wrote it first
+            return load_fuel_cache(cache)
+        logger.warning(f'Could not cache fuel store at {cache}: {e}')
+        return store
+    return load_fuel_cache(cache)
+
+
+def fuel_positions(store, pcs):
+    """Row of each postcode in the store, -1 where it has none."""
+    keys = postcode_keys(pcs)
+    if len(store.postcodes) == 0:
+        return np.full(len(keys), -1)
+    pos = np.minimum(np.searchsorted(store.postcodes, keys), len(store.postcodes) - 1)
+    return np.where(store.postcodes[pos] == keys, pos, -1)
+
+
+def take_fuel_column(store, col, positions):
+    """
+    Values of a fuel column at positions, NaN at -1. Keeps the column dtype when every position is found, as
+    reindexing the table did.
+    """
+    values = store.columns[col]
+    found = positions >= 0
+    if found.all():
+        return np.asarray(values[positions])
+    out = np.full(len(positions), np.nan)
+    out[found] = values[positions[found]]
+    return out
@@ -0,0 +1,94 @@
+"""
+Module: fuel_years.py
+Description: Join several years of DESNZ gas and electricity data to the fuel theme's building aggregates.
+
+The fuel log files (intermediate_data/fuel/{region}/{batch}_log_file.csv) already hold every per postcode
+building aggregate of the fuel theme, next to the gas and electricity variables of one year. A new year of
+DESNZ data therefore only needs those variables joined again. This stage does that for a list of years in one
+pass over the log files, with no building retrieval or pre processing.
+
+Key features
+ - one output file per fuel log file, under intermediate_data/fuel_years/{region}/, resumable per batch: an
+   output that already has every requested year and is newer than its log file is skipped, so adding a year
+   rewrites each batch once and a log file that gained rows (a resumed fuel run) is joined again
+ - the log file's own fuel variables are replaced by {var}_{fuel}_{year} columns for every year,
+   e.g. total_gas_2021, total_gas_2022, with the same lookups (and NaN for missing postcodes) as the fuel theme
+ - each year's tables are memory mapped fuel stores (see fuel_store), loaded once for all batches
+"""
+
+import os
+import glob
+
+import pandas as pd
+
+from .fuel_calc import lookup_fuel_vars, FUEL_VARS
+from .fuel_store import load_fuel_store
+
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+FUEL_TYPES = ['gas', 'elec']
+# fuel variables of a fuel log file, replaced by the per year columns
+FUEL_VAR_COLUMNS = [f'{var}_{fuel_type}' for fuel_type in FUEL_TYPES for var in FUEL_VARS]
+
+
+def fuel_year_columns(year):
+    return [f'{col}_{year}' for col in FUEL_VAR_COLUMNS]
+
+
+def join_fuel_years(aggregates, fuel_years):
+    """
+    Building aggregates of the fuel theme with the fuel variables of every year.
+    aggregates: fuel log file rows (a 'postcode' column plus building aggregates; its own fuel variables are dropped)
+    fuel_years: dict of year -> (gas csv path, elec csv path), or of year -> (gas FuelStore, elec FuelStore)
+    Returns: DataFrame of the aggregates followed by {var}_{fuel}_{year} columns, year by year
+    """
+    df = aggregates.drop(columns=[c for c in FUEL_VAR_COLUMNS if c in aggregates.columns]).reset_index(drop=True)
+    pcs = df['postcode'].values
+    joined = [df]
+    for year, fuel_paths in fuel_years.items():
+        for fuel_type, fuel in zip(FUEL_TYPES, fuel_paths):
+            store = load_fuel_store(fuel) if isinstance(fuel, str) else fuel
+            values, found = lookup_fuel_vars(pcs, fuel_type, store)
+            logger.debug(f'{fuel_type} {year}: {found.sum()} of {len(pcs)} postcodes found')
+            joined.append(values.add_suffix(f'_{year}'))
+    return pd.concat(joined, axis=1)
+
+
+def fuel_year_log_files(intermed_dir):
+    """Fuel log files of every region and batch, as the post processing loads them."""
+    return sorted(glob.glob(os.path.join(intermed_dir, 'fuel', '*', '*_log_file.csv')))
+
+
+def has_fuel_years(out_file, log_file, years):
+    """Whether an output of run_fuel_year_join exists with the columns of every year, written after log_file."""
+    if not os.path.exists(out_file) or os.path.getmtime(out_file) < os.path.getmtime(log_file):
+        return False
+    header = set(pd.read_csv(out_file, nrows=0).columns)
+    return all(col in header for year in years for col in fuel_year_columns(year))
+
+
+def run_fuel_year_join(intermed_dir, fuel_years):
+    """
+    Join the fuel variables of several years to every fuel log file under intermed_dir/fuel.
+    Writes intermed_dir/fuel_years/{region}/{batch}_log_file.csv. Batches whose output already has every year
+    and is newer than the log file are skipped, so the stage resumes after a timeout.
+    fuel_years: dict of year -> (gas csv path, elec csv path)
+    """
+    log_files = fuel_year_log_files(intermed_dir)
+    logger.info(f'Joining fuel years {list(fuel_years)} to {len(log_files)} fuel log files')
+    for log_file in log_files:
+        region = os.path.basename(os.path.dirname(log_file))
+        out_dir = os.path.join(intermed_dir, 'fuel_years', region)
+        out_file = os.path.join(out_dir, os.path.basename(log_file))
+        if has_fuel_years(out_file, log_file, fuel_years):
+            logger.debug(f'Fuel years already joined for {log_file}')
+            continue
+        aggregates = pd.read_csv(log_file).drop_duplicates()
+        os.makedirs(out_dir, exist_ok=True)
+        # written whole then moved into place, so a timeout never leaves a partial output to be skipped
+        join_fuel_years(aggregates, fuel_years).to_csv(out_file + '.tmp', index=False)
+        os.replace(out_file + '.tmp', out_file)
+        logger.debug(f'Saved {len(aggregates)} postcodes to {out_file}')
+    logger.info('Fuel year join complete')
@@ -1,6 +1,7 @@
 
 from scipy.stats import mode
 from .pre_process_buildings import create_age_buckets, create_height_bucket_cols
+from .postcode_utils import read_buildings
 
 import geopandas as gpd
 import pandas as pd
@@ -35,7 +36,7 @@ def process_single_bbox(
     
     Args:
         bbox: Tuple of bounding box coordinates (minx, miny, maxx, maxy)
-        input_gpk: Path to input geopackage file
+        input_gpk: Path to input geopackage file or building store
         height_range: Tuple of min and max average floor heights to consider
         
     Returns:
@@ -44,7 +45,7 @@ def process_single_bbox(
     logging.info(f'Processing bounding box: {bbox}')
     
     # Read and validate data
-    subset = gpd.read_file(input_gpk, bbox=bbox)
+    subset = read_buildings(str(input_gpk), bbox=bbox)
     if subset.empty:
         logging.warning(f'Empty subset for bounding box: {bbox}')
         return pd.DataFrame()
@@ -73,7 +74,7 @@ def process_single_bbox(
     subset = subset[subset['av_fl_height'].between(min_height, max_height)]
     
     # Calculate statistics
-    stats = (subset.groupby(['map_simple_use', 'premise_age_bucketed', 'height_bucket'])
+    stats = (subset.groupby(['map_simple_use', 'premise_age_bucketed', 'height_bucket'], observed=True)
             ['floor_count_numeric']
             .agg(mean_height='mean', count='size')
             .reset_index())
@@ -121,7 +122,7 @@ def compute_global_fc(
     full_df = pd.concat(processed_stats, ignore_index=True)
     
     # Calculate global statistics
-    total_stats = (full_df.groupby(['map_simple_use', 'premise_age_bucketed', 'height_bucket'])
+    total_stats = (full_df.groupby(['map_simple_use', 'premise_age_bucketed', 'height_bucket'], observed=True)
                   .agg(
                       total_count=('count', 'sum'),
                       sum_weighted_height=('weighted_height', 'sum')
@@ -180,7 +181,7 @@ def compute_global_heights(
         
 
         # Read and process subset
-        subset = gpd.read_file(input_gpk, bbox=bbox)
+        subset = read_buildings(input_gpk, bbox=bbox)
         
         if subset.empty:
             logger.warning(f'Empty subset for bounding box: {bbox}')
@@ -212,7 +213,7 @@ def compute_global_heights(
         
         # Group and calculate statistics
         stats = (subset
-                .groupby(['map_simple_use', 'premise_age_bucketed', 'floor_count_numeric'])
+                .groupby(['map_simple_use', 'premise_age_bucketed', 'floor_count_numeric'], observed=True)
                 .agg(
                     mean_height=('height', 'mean'),
                     count=('height', 'size')
@@ -231,7 +232,7 @@ def compute_global_heights(
     
     # Calculate final statistics
     total_stats = (full_df
-                  .groupby(['map_simple_use', 'premise_age_bucketed', 'floor_count_numeric'])
+                  .groupby(['map_simple_use', 'premise_age_bucketed', 'floor_count_numeric'], observed=True)
                   .agg(
                       total_count=('count', 'sum'),
                       sum_weighted_height=('weighted_height', 'sum')
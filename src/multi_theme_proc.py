@@ -0,0 +1,88 @@
+"""
+Module: multi_theme_proc.py
+Description: One pass over a batch for several postcode themes (fuel, age, typology).
+
+Run as separate passes, each theme reloads ONSUD and the postcode shapefiles, retrieves every postcode's
+buildings and pre processes them again. Here each sub-batch is retrieved once with the union of the themes'
+column manifests, pre processed once, and the buildings go to every enabled theme's summary.
+
+Key features
+ - each theme writes its own log file, with the same rows and checks as its own pass
+ - resumable per theme: a postcode is only summarised for themes whose log file does not have it yet
+ - pre processing runs only the profile the enabled themes need, no geometry maths for age and typology alone
+"""
+
+from src.fuel_calc import summarise_fuel_batch, FUEL_COLUMNS, FUEL_BATCH_COLUMNS, FUEL_PROFILE
+from src.age_perc_calc import summarise_building_age_batch, AGE_COLUMNS, AGE_BATCH_COLUMNS, AGE_PROFILE
+from src.type_calc import summarise_buildtype_batch, TYPE_COLUMNS, TYPE_BATCH_COLUMNS, TYPE_PROFILE
+from src.fuel_proc import save_fuel_results
+from src.age_perc_proc import save_age_results
+from src.type_proc import save_type_results
+from src.pre_process_buildings import retrieve_subbatch_buildings, combined_profile
+from src.postcode_utils import building_columns
+
+from src.logging_config import get_logger
+logger = get_logger(__name__)
+
+
+# themes by their output directory name (attr_lab in pc_main)
+THEME_COLUMNS = {'fuel': FUEL_COLUMNS, 'age': AGE_COLUMNS, 'type': TYPE_COLUMNS}
+THEME_BATCH_COLUMNS = {'fuel': FUEL_BATCH_COLUMNS, 'age': AGE_BATCH_COLUMNS, 'type': TYPE_BATCH_COLUMNS}
+THEME_PROFILES = {'fuel': FUEL_PROFILE, 'age': AGE_PROFILE, 'type': TYPE_PROFILE}
+THEME_SAVERS = {'fuel': save_fuel_results, 'age': save_age_results, 'type': save_type_results}
+
+
+def unique_columns(column_lists):
+    """Columns of several lists in order, without repeats."""
+    return list(dict.fromkeys(c for column_list in column_lists for c in column_list))
+
+
+def multi_theme_columns(themes):
+    """Building columns to read for a set of themes: the union of their column manifests."""
+    unknown = [t for t in themes if t not in THEME_COLUMNS]
+    if unknown:
+        raise ValueError(f'Unknown themes: {unknown}, expected some of {list(THEME_COLUMNS)}')
+    return building_columns(*[THEME_COLUMNS[t] for t in themes])
+
+
+def summarise_theme(theme, pcs, buildings, gas_df=None, elec_df=None):
+    """
+    One theme's results for postcodes of a sub-batch.
+    buildings: the sub-batch's pre processed buildings with a 'postcode' column (see pre_process_subbatch_buildings).
+        Pre processing keeps every row and premise_use, so these also give the residential counts.
+    Returns: DataFrame with one row per postcode
+    """
+    if theme == 'fuel':
+        return summarise_fuel_batch(pcs, buildings, gas_df, elec_df)
+    if theme == 'age':
+        return summarise_building_age_batch(pcs, buildings)
+    return summarise_buildtype_batch(pcs, buildings)
+
+
+def process_multi_theme_batch(pc_batch, data, INPUT_GPK, process_batch_name, log_files, pending,
+                              gas_df=None, elec_df=None, retrieval='batch', retrieval_context=None):
+    """
+    Process a sub-batch of postcodes for every theme in log_files.
+    log_files: dict of theme -> log file
+    pending: dict of theme -> postcodes not yet in that theme's log file
+    """
+    themes = list(log_files)
+    pcs, buildings = retrieve_subbatch_buildings(
+        pc_batch, data, INPUT_GPK, multi_theme_columns(themes),
+        unique_columns(THEME_BATCH_COLUMNS[t] for t in themes), combined_profile([THEME_PROFILES[t] for t in themes]),
+        retrieval, retrieval_context)
+    pcs = list(dict.fromkeys(pcs))
+
+    for theme in themes:
+        results = summarise_theme(theme, [pc for pc in pcs if pc in pending[theme]], buildings, gas_df, elec_df)
+        logger.debug(f'Number of processed {theme} results: {len(results)}')
+        THEME_SAVERS[theme](results, log_files[theme], process_batch_name)
+
+
+def run_multi_theme_calc(pcs_list, data, INPUT_GPK, batch_size, batch_label, log_files, pending,
+                         gas_df=None, elec_df=None, retrieval='batch', retrieval_context=None):
+    logger.info(f"Starting {', '.join(log_files)} calculations for {len(pcs_list)} postcodes")
+    for i in range(0, len(pcs_list), batch_size):
+        batch = pcs_list[i:i + batch_size]
+        process_multi_theme_batch(batch, data, INPUT_GPK, batch_label, log_files, pending,
+                                  gas_df, elec_df, retrieval, retrieval_context)
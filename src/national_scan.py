@@ -0,0 +1,229 @@
+"""
+Module: national_scan.py
+Description: Building retrieval by one sequential scan of the building file, instead of a bbox query per postcode.
+
+The per postcode loop issues one spatial query per postcode (~1.7M for a national run), each a burst of small
+random reads. This module inverts the loop: the whole building file is streamed in large chunks, the fastest
+access pattern on spinning disks and Lustre, and every building is assigned to postcodes as it goes past.
+
+Key features
+ - UPRN side: buildings are matched to postcodes through an in memory UPRN -> postcode map from ONSUD
+ - spatial side: each chunk is queried against one spatial index over the postcode polygons, built before the scan
+ - same rows as find_data_pc_joint (UPRN matches are restricted to the postcode bbox, as the bbox read was)
+ - one scan serves every batch of a national run: it runs once as its own stage (main.py, or
+   stage_national_scan.py on HPC) and stages buildings per batch to intermediate_data/scan/{region}/{batch}/,
+   then theme runs use them with retrieval='scan'; a batch with nothing staged is an error
+"""
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+from pyogrio import read_info
+from shapely.geometry import box
+
+from .building_store import (is_building_store, load_store_manifest, open_partition, read_gpkg_chunk,
+                             store_table_to_gdf, GEOMETRY_COL)
+from .postcode_utils import load_ids_from_file, pc_shapefile_path, read_vector, SCAN_COLS
+from .postcode_store import is_postcode_store, read_postcode_store
+from .building_schema import apply_building_schema
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+def scan_path(data_dir, region_label, batch_label):
+    """Location of the staged scan results for one batch."""
+    return os.path.join(data_dir, 'scan', region_label, str(batch_label))
+
+
+def iter_building_chunks(input_gpk, chunk_size=500000):
+    """Stream every building in the building file (GeoPackage or building store) in large sequential chunks."""
+    if is_building_store(input_gpk):
+        for file_name in load_store_manifest(input_gpk)['file']:
+            pf, _, crs = open_partition(os.path.join(input_gpk, file_name))
+            for batch in pf.iter_batches(batch_size=chunk_size):
+                yield store_table_to_gdf(pa.Table.from_batches([batch]), crs)
+        return
+
+    n_features = read_info(input_gpk)['features']
+    for skip in range(0, n_features, chunk_size):
+        df, crs = read_gpkg_chunk(input_gpk, skip, chunk_size)
+        yield apply_building_schema(gpd.GeoDataFrame(df.drop(columns=[GEOMETRY_COL]),
+                                                     geometry=gpd.GeoSeries.from_wkb(df[GEOMETRY_COL].values, crs=crs)))
+
+
+def postcode_bounds(polys):
+    """Bbox of each postcode over all its polygons, the bbox find_data_pc_joint reads buildings with."""
+    bounds = polys.bounds
+    bounds['POSTCODE'] = polys['POSTCODE'].values
+    return bounds.groupby('POSTCODE').agg({'minx': 'min', 'miny': 'min', 'maxx': 'max', 'maxy': 'max'})
+
+
+def intersects_bounds(geoms, bounds):
+    """
+    Elementwise test of geometries against a (n, 4) array of bboxes.
+    Only geometries whose envelope crosses the bbox edge need a geometry test.
+    """
+    env = geoms.bounds.values
+    overlap = ((env[:, 0] <= bounds[:, 2]) & (env[:, 2] >= bounds[:, 0]) &
+               (env[:, 1] <= bounds[:, 3]) & (env[:, 3] >= bounds[:, 1]))
+    inside = ((env[:, 0] >= bounds[:, 0]) & (env[:, 2] <= bounds[:, 2]) &
+              (env[:, 1] >= bounds[:, 1]) & (env[:, 3] <= bounds[:, 3]))
+    result = inside.copy()
+    crossing = np.flatnonzero(overlap & ~inside)
+    if len(crossing):
+        boxes = gpd.GeoSeries([box(*b) for b in bounds[crossing]], crs=geoms.crs)
+        result[crossing] = geoms.iloc[crossing].intersects(boxes, align=False).values
+    return result
+
+
+def assign_chunk(chunk, uprn_map, polys, pc_bounds):
+    """
+    Postcode assignment for a chunk of buildings, with find_data_pc_joint semantics.
+    polys: postcode polygons with a default index, whose sindex is built once by scan_assign
+    Returns DataFrame of row (position in chunk), postcode, match_type ('uprn' or 'spatial').
+    """
+    rows = np.flatnonzero(chunk['uprn'].isin(uprn_map['UPRN']).values)
+    uprn_pairs = pd.DataFrame({
+        'row': rows,
+        'UPRN': chunk['uprn'].values[rows].astype(uprn_map['UPRN'].dtype),
+    }).merge(uprn_map, on='UPRN')
+    in_bbox = intersects_bounds(chunk.geometry.iloc[uprn_pairs['row'].values],
+                                pc_bounds.loc[uprn_pairs['PCDS']].values)
+    uprn_pairs = uprn_pairs[in_bbox]
+
+    # the chunk is queried against the polygon index, rather than sjoin building an index over the chunk
+    rows, poly_pos = polys.sindex.query_bulk(chunk.geometry, predicate='within').astype(np.intp)
+    order = np.lexsort((poly_pos, rows))
+    rows, poly_pos = rows[order], poly_pos[order]
+
+    pairs = pd.concat([
+        pd.DataFrame({'row': uprn_pairs['row'].values, 'postcode': uprn_pairs['PCDS'].values, 'match_type': 'uprn'}),
+        pd.DataFrame({'row': rows, 'postcode': polys['POSTCODE'].values[poly_pos], 'match_type': 'spatial'}),
+    ], ignore_index=True)
+    return pairs.drop_duplicates(['row', 'postcode'])
+
+
+def scan_assign(input_gpk, uprn_map, polys, chunk_size=500000):
+    """
+    One sequential pass over the building file.
+    uprn_map: DataFrame of UPRN, PCDS for the postcodes to assign
+    polys: GeoDataFrame of POSTCODE, geometry for the same postcodes
+    Yields the assigned buildings of each chunk, with the SCAN_COLS added.
+    """
+    polys = polys[['POSTCODE', 'geometry']].reset_index(drop=True)
+    pc_bounds = postcode_bounds(polys)
+    # one spatial index over the postcode polygons for the whole scan
+    polys.sindex
+    scanned = 0
+    for chunk in iter_building_chunks(input_gpk, chunk_size):
+        chunk = chunk.reset_index(drop=True)
+        pairs = assign_chunk(chunk, uprn_map, polys, pc_bounds)
+        assigned = chunk.iloc[pairs['row'].values].reset_index(drop=True)
+        assigned['postcode'] = pairs['postcode'].values
+        assigned['match_type'] = pairs['match_type'].values
+        assigned['scan_row'] = pairs['row'].values + scanned
+        scanned += len(chunk)
+        logger.info(f'Scanned {scanned} buildings, {len(assigned)} assigned in chunk')
+        yield assigned
+
+
+def load_batch_scan(path, pcs=None):
+    """Load staged scan results for a batch, optionally for a set of postcodes."""
+    filters = None if pcs is None else [('postcode', 'in', [pc.strip() for pc in pcs])]
+    # staged parts can each have their own extra categories
+    return apply_building_schema(gpd.read_parquet(path, filters=filters))
+
+
+def get_batch_scan(data_dir, region_label, batch_label, pcs):
+    """
+    Scanned buildings for a batch from the staged national scan.
+    Raises FileNotFoundError if the batch has not been staged: the scan is its own stage, run once for every
+    batch before the theme jobs, never from inside a batch job.
+    """
+    path = scan_path(data_dir, region_label, batch_label)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No staged scan for {region_label}/{batch_label} at {path}, '
+                                'run the national scan stage first')
+    logger.info(f'Using staged scan: {path}')
+    return load_batch_scan(path, pcs)
+
+
+def load_scan_targets(batch_paths, path_to_pcshp):
+    """
+    UPRN -> postcode map, postcode polygons and postcode -> batch for a set of batch files.
+    Only the UPRN and postcode ONSUD columns are kept, so a national set of targets fits in memory.
+    """
+    uprn_maps, pc_batches = [], []
+    for batch_path in batch_paths:
+        region_label = batch_path.split('/')[-2]
+        batch_label = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
+        onsud_path = os.path.join(os.path.dirname(batch_path), f'onsud_{batch_label}.csv')
+
+        pcs = [pc.strip() for pc in load_ids_from_file(batch_path)]
+        onsud = pd.read_csv(onsud_path, usecols=['UPRN', 'PCDS'], low_memory=False).dropna(subset=['PCDS'])
+        onsud['PCDS'] = onsud['PCDS'].str.strip()
+        uprn_maps.append(onsud[onsud['PCDS'].isin(pcs)])
+        pc_batches.append(pd.DataFrame({'POSTCODE': pcs, 'region': region_label, 'batch': batch_label}))
+
+    uprn_map = pd.concat(uprn_maps, ignore_index=True).drop_duplicates()
+    pc_batches = pd.concat(pc_batches, ignore_index=True).drop_duplicates()
+
+    leading_letters = uprn_map['PCDS'].str.extract(r'^([A-Za-z]{1,2})\d')[0].dropna().unique()
+    if is_postcode_store(path_to_pcshp):
+        polys = read_postcode_store(path_to_pcshp, leading_letters, pcs=pc_batches['POSTCODE'].unique())
+    else:
+        polys = []
+        for leading_letter in leading_letters:
+            pc_shp = read_vector(pc_shapefile_path(path_to_pcshp, leading_letter))
+            pc_shp['POSTCODE'] = pc_shp['POSTCODE'].str.strip()
+            polys.append(pc_shp[pc_shp['POSTCODE'].isin(pc_batches['POSTCODE'])])
+        polys = pd.concat(polys)
+    polys = polys.reset_index(drop=True)
+
+    # postcodes with no polygon drop out of the ONSUD merge, so find_data_pc_joint never sees them
+    uprn_map = uprn_map[uprn_map['PCDS'].isin(polys['POSTCODE'])]
+    return uprn_map, polys, pc_batches
+
+
+def run_national_scan(batch_paths, data_dir, path_to_pcshp, INPUT_GPK, chunk_size=500000):
+    """
+    Assign buildings for every batch in batch_paths in one pass over the building file, and stage them per batch.
+    Batches already staged are skipped.
+    """
+    pending = []
+    for batch_path in batch_paths:
+        region_label = batch_path.split('/')[-2]
+        batch_label = batch_path.split('/')[-1].split('.')[0].split('_')[-1]
+        if os.path.exists(scan_path(data_dir, region_label, batch_label)):
+            logger.info(f'Scan already staged, skipping: {region_label}/{batch_label}')
+        else:
+            pending.append(batch_path)
+    if not pending:
+        return
+
+    uprn_map, polys, pc_batches = load_scan_targets(pending, path_to_pcshp)
+    logger.info(f'Scanning {INPUT_GPK} for {len(pending)} batches, {pc_batches["POSTCODE"].nunique()} postcodes')
+
+    # stage into temp dirs so a timed out scan never leaves a partial batch behind
+    tmp_dirs = {key: scan_path(data_dir, *key) + '.tmp' for key in pc_batches[['region', 'batch']].drop_duplicates().itertuples(index=False, name=None)}
+    for tmp_dir in tmp_dirs.values():
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+    template = None
+    for chunk_num, assigned in enumerate(scan_assign(INPUT_GPK, uprn_map, polys, chunk_size)):
+        if template is None:
+            template = assigned.iloc[:0]
+        assigned = assigned.merge(pc_batches, left_on='postcode', right_on='POSTCODE')
+        for key, part in assigned.groupby(['region', 'batch']):
+            part = part.drop(columns=['POSTCODE', 'region', 'batch'])
+            part.to_parquet(os.path.join(tmp_dirs[key], f'part_{chunk_num:05d}.parquet'), index=False)
+
+    for key, tmp_dir in tmp_dirs.items():
+        if not os.listdir(tmp_dir):
+            template.to_parquet(os.path.join(tmp_dir, 'part_00000.parquet'), index=False)
+        os.replace(tmp_dir, scan_path(data_dir, *key))
+    logger.info(f'Staged scans for {len(tmp_dirs)} batches')
@@ -0,0 +1,90 @@
+"""
+Module: pc_assignment.py
+Description: Precomputed building to postcode assignment table.
+
+find_data_pc_joint assigns buildings to a postcode by UPRN match unioned with a within spatial join.
+Fuel, age and type each redo this for every postcode. Here the assignment is computed once per ONSUD
+batch and saved as a compact table of (upn, postcode, match_type), so theme runs can fetch a postcode's
+buildings by upn with no geometry work.
+
+Key features
+ - match_type is 'uprn' for UPRN matched buildings, 'spatial' for buildings only found by the within join
+ - rows are kept in find_data_pc_joint order, so buildings come back in the same order
+ - one parquet file per batch, intermediate_data/assignment/{region}/{batch}.parquet, so the union of all
+   batch files is the national table and batches can be built as separate HPC jobs
+"""
+
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .postcode_utils import load_onsud_data, load_ids_from_file, find_data_pc_batch, RETRIEVAL_COLUMNS
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+MATCH_TYPES = ['uprn', 'spatial']
+
+
+def assignment_path(data_dir, region_label, batch_label):
+    """Location of the assignment table for one batch."""
+    return os.path.join(data_dir, 'assignment', region_label, f'{batch_label}.parquet')
+
+
+def assign_postcode_batch(pcs, onsdata, input_gpk):
+    """
+    Building to postcode assignment for a sub-batch of postcodes.
+    Returns DataFrame of upn, postcode, match_type in find_data_pc_joint row order.
+    """
+    data, _ = onsdata
+    batch_buildings = find_data_pc_batch(pcs, onsdata, input_gpk, columns=RETRIEVAL_COLUMNS)
+    uprns = data[data['PCDS'].isin(batch_buildings.keys())].groupby('PCDS')['UPRN'].apply(set)
+
+    assigned = []
+    for pc, buildings in batch_buildings.items():
+        if buildings is None or buildings.empty:
+            continue
+        match_type = buildings['uprn'].isin(uprns[pc]).map({True: 'uprn', False: 'spatial'})
+        assigned.append(pd.DataFrame({'upn': buildings['upn'].values, 'postcode': pc,
+                                      'match_type': match_type.values}))
+    if not assigned:
+        return pd.DataFrame(columns=['upn', 'postcode', 'match_type'])
+    return pd.concat(assigned, ignore_index=True)
+
+
+def run_assignment(batch_path, data_dir, path_to_onsud_file, path_to_pcshp, INPUT_GPK,
+                   region_label, batch_label, log_size=1000):
+    """Compute and save the assignment table for one ONSUD batch. Skips batches already assigned."""
+    output_path = assignment_path(data_dir, region_label, batch_label)
+    if os.path.exists(output_path):
+        logger.info(f'Assignment already exists, skipping: {output_path}')
+        return
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    onsud_data = load_onsud_data(path_to_onsud_file, path_to_pcshp)
+    batch_ids = load_ids_from_file(batch_path)
+    logger.info(f'Assigning buildings for {len(batch_ids)} postcodes in batch {region_label}/{batch_label}')
+
+    assigned = []
+    for i in range(0, len(batch_ids), log_size):
+        assigned.append(assign_postcode_batch(batch_ids[i:i + log_size], onsud_data, INPUT_GPK))
+        logger.debug(f'Assigned sub-batch {i // log_size + 1}')
+    table = pd.concat(assigned, ignore_index=True)
+
+    # dictionary encode the repeated postcode / match type strings to keep the table compact
+    table['postcode'] = table['postcode'].astype('category')
+    table['match_type'] = pd.Categorical(table['match_type'], categories=MATCH_TYPES)
+    # write to a temp file first so a timed out job never leaves a partial table behind
+    pq.write_table(pa.Table.from_pandas(table, preserve_index=False), output_path + '.tmp')
+    os.replace(output_path + '.tmp', output_path)
+    logger.info(f'Saved {len(table)} assignments to {output_path}')
+
+
+def load_assignment(path, pcs=None):
+    """Load an assignment table (a batch file, or a directory of them), optionally for a set of postcodes."""
+    filters = None if pcs is None else [('postcode', 'in', [pc.strip() for pc in pcs])]
+    table = pq.read_table(path, filters=filters).to_pandas()
+    table['postcode'] = table['postcode'].astype(str)
+    table['match_type'] = table['match_type'].astype(str)
+    return table
@@ -14,10 +14,14 @@ Modified: 2024
 
 import os
 import pandas as pd
-from src.postcode_utils import load_onsud_data, load_ids_from_file
+from src.postcode_utils import load_onsud_data, load_ids_from_file, is_building_gpkg, gpkg_has_uprn_index, RetrievalContext
 from src.fuel_proc import run_fuel_calc_main, load_fuel_data
 from src.age_perc_proc import run_age_calc
 from src.type_proc import run_type_calc
+from src.multi_theme_proc import run_multi_theme_calc, multi_theme_columns
+from src.pc_assignment import assignment_path, load_assignment
+from src.national_scan import get_batch_scan
+from src.tile_cache import TileCache, DEFAULT_TILE_SIZE
 # from src.orientation_proc import run_orient_calc
 import logging 
 
@@ -44,10 +48,48 @@ def gen_batch_ids(batch_ids: list, log_file: str, logger: logging.Logger) -> lis
         logger.info('No existing log file found, processing all IDs')
         return batch_ids
 
+def setup_retrieval(retrieval, data_dir, region_label, batch_label, batch_ids, INPUT_GPK,
+                    tile_cache_mb=None, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Prepare building retrieval for a batch (see postcode_main for the modes).
+    Returns the RetrievalContext of the batch (the assignment table for 'assigned', the staged scanned buildings
+    for 'scan'), and the tile cache if one is used (else None).
+    """
+    retrieval_context = RetrievalContext()
+    if retrieval == 'assigned':
+        assignment = load_assignment(assignment_path(data_dir, region_label, batch_label), batch_ids)
+        logger.debug(f'Loaded {len(assignment)} building assignments')
+        retrieval_context = RetrievalContext(assignment=assignment)
+    elif retrieval == 'scan':
+        scanned_buildings = get_batch_scan(data_dir, region_label, batch_label, batch_ids)
+        logger.debug(f'Found {len(scanned_buildings)} building assignments by scan')
+        retrieval_context = RetrievalContext(scanned_buildings=scanned_buildings)
+    elif retrieval == 'sql':
+        if not is_building_gpkg(INPUT_GPK):
+            raise ValueError(f'SQL retrieval needs the building GeoPackage: {INPUT_GPK}')
+        # the index is created once beforehand (create_uprn_index.py), batch jobs never write to the input
+        if not gpkg_has_uprn_index(INPUT_GPK):
+            logger.warning('No uprn index (run create_uprn_index.py), SQL retrieval falls back to bbox reads')
+
+    tile_cache = None
+    if tile_cache_mb and retrieval in ('batch', 'postcode'):
+        tile_cache = TileCache(INPUT_GPK, tile_size=tile_size, memory_mb=tile_cache_mb)
+    return retrieval_context, tile_cache
+
+
 def postcode_main(batch_path, data_dir, path_to_onsud_file, path_to_pcshp, INPUT_GPK, 
          region_label, batch_label, attr_lab, process_function, gas_path=None, 
-         elec_path=None, overlap=None, batch_dir=None, overlap_outcode=None, log_size=100):
-    """Main processing function."""
+         elec_path=None, overlap=None, batch_dir=None, overlap_outcode=None, log_size=100,
+         retrieval='batch', tile_cache_mb=None, tile_size=DEFAULT_TILE_SIZE):
+    """Main processing function.
+    retrieval: 'batch' reads buildings once per sub-batch, 'postcode' reads them per postcode,
+        'assigned' uses the precomputed assignment table for the batch (see pc_assignment),
+        'scan' uses the batch's buildings staged by the national scan stage (see national_scan)
+        'sql' reads them per postcode with the UPRN and R-tree filters run inside the GeoPackage, using the uprn
+        index made by create_uprn_index.py (see postcode_utils.find_data_pc_sql)
+    tile_cache_mb: memory budget for a tile cache in front of 'batch' / 'postcode' building reads (see tile_cache),
+        None for no cache
+    """
     
     # Setup logging
     proc_dir = os.path.join(data_dir, attr_lab, region_label)
@@ -71,6 +113,8 @@ def postcode_main(batch_path, data_dir, path_to_onsud_file, path_to_pcshp, INPUT
     batch_ids = load_ids_from_file(batch_path)
     batch_ids = gen_batch_ids(batch_ids, log_file, logger)
 
+    retrieval_context, tile_cache = setup_retrieval(retrieval, data_dir, region_label, batch_label, batch_ids, INPUT_GPK,
+                                                    tile_cache_mb, tile_size)
     
     # Log processing parameters
     logger.debug('Processing parameters:')
@@ -84,6 +128,8 @@ def postcode_main(batch_path, data_dir, path_to_onsud_file, path_to_pcshp, INPUT
         'Overlap enabled': overlap,
         'Batch directory': batch_dir,
         'Output dir:' : data_dir, 
+        'Building retrieval': retrieval,
+        'Tile cache MB': tile_cache_mb,
     }
     for param, value in parameters.items():
         logger.debug(f'{param}: {value}')
@@ -91,7 +137,7 @@ def postcode_main(batch_path, data_dir, path_to_onsud_file, path_to_pcshp, INPUT
     process_function(
         batch_ids=batch_ids,
         onsud_data=onsud_data,
-        INPUT_GPK=INPUT_GPK,
+        INPUT_GPK=INPUT_GPK if tile_cache is None else tile_cache,
         subbatch_size=log_size,
         batch_label=batch_label,
         log_file=log_file,
@@ -99,14 +145,52 @@ def postcode_main(batch_path, data_dir, path_to_onsud_file, path_to_pcshp, INPUT
         elec_path=elec_path,
         overlap=overlap,
         batch_dir=batch_dir,
-        path_to_pcshp=path_to_pcshp
+        path_to_pcshp=path_to_pcshp,
+        retrieval=retrieval,
+        retrieval_context=retrieval_context
     )
+    if tile_cache is not None:
+        tile_cache.log_stats()
     logger.info('Batch processing completed successfully')
 
 
 
+def multi_theme_main(batch_path, data_dir, path_to_onsud_file, path_to_pcshp, INPUT_GPK, region_label, batch_label,
+                     themes, gas_path=None, elec_path=None, log_size=100, retrieval='batch', tile_cache_mb=None,
+                     tile_size=DEFAULT_TILE_SIZE):
+    """Run several themes ('fuel', 'age', 'type') over a batch in one pass, see multi_theme_proc.
+    Each theme writes the log file its own postcode_main run would, in data_dir/{theme}/{region_label}/.
+    """
+    multi_theme_columns(themes)
+    logger.info(f'Starting single pass for themes {themes}, region: {region_label}')
+
+    batch_ids = [pc.strip() for pc in load_ids_from_file(batch_path)]
+    log_files, pending = {}, {}
+    for theme in themes:
+        proc_dir = os.path.join(data_dir, theme, region_label)
+        os.makedirs(proc_dir, exist_ok=True)
+        log_files[theme] = os.path.join(proc_dir, f'{batch_label}_log_file.csv')
+        pending[theme] = set(gen_batch_ids(batch_ids, log_files[theme], logger))
+    batch_ids = [pc for pc in batch_ids if any(pc in pending[t] for t in themes)]
+    if not batch_ids:
+        logger.info('All themes already processed for batch')
+        return
+
+    onsud_data = load_onsud_data(path_to_onsud_file, path_to_pcshp)
+    retrieval_context, tile_cache = setup_retrieval(retrieval, data_dir, region_label, batch_label, batch_ids, INPUT_GPK,
+                                                    tile_cache_mb, tile_size)
+    gas_df, elec_df = load_fuel_data(gas_path, elec_path) if 'fuel' in themes else (None, None)
+
+    run_multi_theme_calc(batch_ids, onsud_data, INPUT_GPK if tile_cache is None else tile_cache, log_size,
+                         batch_label, log_files, pending, gas_df, elec_df, retrieval, retrieval_context)
+    if tile_cache is not None:
+        tile_cache.log_stats()
+    logger.info('Batch processing completed successfully')
+
+
 def run_fuel_process(batch_ids, onsud_data, INPUT_GPK, subbatch_size, batch_label, 
-                    log_file, gas_path, elec_path, overlap, batch_dir, path_to_pcshp):
+                    log_file, gas_path, elec_path, overlap, batch_dir, path_to_pcshp, retrieval='batch',
+                    retrieval_context=None):
     """Process fuel data."""
 
     gas_df, elec_df = load_fuel_data(gas_path, elec_path)
@@ -114,22 +198,23 @@ def run_fuel_process(batch_ids, onsud_data, INPUT_GPK, subbatch_size, batch_labe
     run_fuel_calc_main(
         batch_ids, onsud_data, INPUT_GPK=INPUT_GPK,
         subbatch_size=subbatch_size, batch_label=batch_label,
-        log_file=log_file, gas_df=gas_df, elec_df=elec_df
+        log_file=log_file, gas_df=gas_df, elec_df=elec_df, retrieval=retrieval,
+        retrieval_context=retrieval_context
     )
 
 def run_age_process(batch_ids, onsud_data, INPUT_GPK, subbatch_size, batch_label,
                    log_file, gas_path=None, elec_path=None, overlap=None,
-                   batch_dir=None, path_to_pcshp=None):
+                   batch_dir=None, path_to_pcshp=None, retrieval='batch', retrieval_context=None):
     """Process age data."""
 
     run_age_calc(batch_ids, onsud_data, INPUT_GPK, subbatch_size,
-                 batch_label, log_file, overlap)
+                 batch_label, log_file, overlap, retrieval, retrieval_context)
 
 def run_type_process(batch_ids, onsud_data, INPUT_GPK, subbatch_size, batch_label,
                     log_file, gas_path=None, elec_path=None, overlap=None,
-                    batch_dir=None, path_to_pcshp=None):
+                    batch_dir=None, path_to_pcshp=None, retrieval='batch', retrieval_context=None):
     """Process type data."""
 
     
     run_type_calc(batch_ids, onsud_data, INPUT_GPK, subbatch_size,
-                  batch_label, log_file)
+                  batch_label, log_file, retrieval, retrieval_context)
@@ -0,0 +1,166 @@
+"""
+Module: postcode_store.py
+Description: Consolidated store of the Codepoint postcode polygons, converted once from the area shapefiles.
+
+load_onsud_data reads every one / two letter postcode area shapefile its batch touches, in full, for every batch
+and theme - the same shapefiles are parsed hundreds of times in a national run. The store is a one-time
+conversion of PC_SHP_PATH into one GeoParquet file per area, and a batch reads only the rows of its own
+postcodes.
+
+Store layout:
+    store_dir/
+    ├── _areas.csv             (area, file, n_rows, pc_areas, minx, miny, maxx, maxy)
+    ├── ab.parquet             (one per area shapefile, named by its leading letters as pc_shapefile_path)
+    ├── b.parquet
+    └── ...
+
+Key features
+ - POSTCODE stored stripped, as find_postcode_for_ONSUD_file normalised it after every read
+ - rows sorted by POSTCODE, so the row group statistics locate a batch's postcodes and only those row groups
+   are read; rows come back in shapefile order, with the row number within the shapefile as the index, i.e. the
+   rows, columns and index of the shapefile read filtered to the batch's postcodes
+ - geometry kept as WKB and decoded only for the rows returned; the spatial index (GeoDataFrame.sindex) is
+   built lazily on the first spatial query, as for any GeoDataFrame
+"""
+
+import os
+import glob
+import json
+import shutil
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyproj import CRS
+
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+MANIFEST_NAME = '_areas.csv'
+# row number within the area shapefile, the index of a shapefile read
+SOURCE_ROW_COL = 'source_row'
+# separator of the PC_AREA values of an area file in the manifest
+PC_AREA_SEP = ';'
+
+
+def area_shapefiles(path_to_pcshp):
+    """Area key (lower case leading letters) -> shapefile, for every shapefile of the Codepoint layout."""
+    shp_paths = (glob.glob(os.path.join(path_to_pcshp, 'one_letter_pc_code/*/*.shp')) +
+                 glob.glob(os.path.join(path_to_pcshp, 'two_letter_pc_code/*.shp')))
+    return {os.path.splitext(os.path.basename(shp))[0].lower(): shp for shp in sorted(shp_paths)}
+
+
+def convert_pc_shapefiles_to_store(path_to_pcshp, output_dir, row_group_size=2000):
+    """
+    One-time conversion of the postcode area shapefiles under path_to_pcshp into a postcode store.
+    Returns: the area manifest
+    """
+    shapefiles = area_shapefiles(path_to_pcshp)
+    if not shapefiles:
+        raise ValueError(f'No postcode shapefiles found in {path_to_pcshp}')
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+
+    manifest = []
+    for area, shp in shapefiles.items():
+        logger.debug(f'Converting postcode shapefile: {shp}')
+        pc_shp = gpd.read_file(shp)
+        pc_shp['POSTCODE'] = pc_shp['POSTCODE'].str.strip()
+        pc_shp.insert(0, SOURCE_ROW_COL, pc_shp.index.values)
+        file_name = f'{area}.parquet'
+        pc_shp.sort_values('POSTCODE', kind='stable').to_parquet(os.path.join(output_dir, file_name), index=False,
+                                                                 row_group_size=row_group_size)
+        minx, miny, maxx, maxy = pc_shp.total_bounds if len(pc_shp) else [float('nan')] * 4
+        manifest.append({'area': area, 'file': file_name, 'n_rows': len(pc_shp),
+                         'pc_areas': PC_AREA_SEP.join(sorted(pc_shp['PC_AREA'].dropna().unique())),
+                         'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy})
+
+    manifest = pd.DataFrame(manifest)
+    manifest.to_csv(os.path.join(output_dir, MANIFEST_NAME), index=False)
+    load_postcode_manifest.cache_clear()
+    open_area.cache_clear()
+    logger.info(f'Converted {manifest.n_rows.sum()} postcodes from {len(manifest)} area shapefiles')
+    return manifest
+
+
+def is_postcode_store(path):
+    """True if path is a converted postcode store directory rather than the shapefile folder."""
+    return isinstance(path, (str, os.PathLike)) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+@lru_cache(maxsize=8)
+def load_postcode_manifest(store_dir):
+    """Area manifest indexed by area key, loaded once per process."""
+    return pd.read_csv(os.path.join(store_dir, MANIFEST_NAME), keep_default_na=False,
+                       na_values={c: [''] for c in ['minx', 'miny', 'maxx', 'maxy']}).set_index('area')
+
+
+@lru_cache(maxsize=256)
+def open_area(path):
+    """
+    Open an area file once per process.
+    Returns (ParquetFile, POSTCODE min and max of each row group, geometry column, crs)
+    """
+    pf = pq.ParquetFile(path)
+    col = pf.schema_arrow.names.index('POSTCODE')
+    stats = [pf.metadata.row_group(i).column(col).statistics for i in range(pf.num_row_groups)]
+    # row groups without min / max statistics (all null postcodes) are never matched
+    known = [s is not None and s.has_min_max for s in stats]
+    rg_min = np.array([s.min if k else '' for s, k in zip(stats, known)], dtype=object)
+    rg_max = np.array([s.max if k else '' for s, k in zip(stats, known)], dtype=object)
+    geo = json.loads(pf.schema_arrow.metadata[b'geo'])
+    geom_col = geo['primary_column']
+    crs = geo['columns'][geom_col].get('crs')
+    return pf, rg_min, rg_max, geom_col, CRS.from_user_input(crs) if crs else None
+
+
+def read_area(path, pcs=None):
+    """One area file as a GeoDataFrame in shapefile order, only the row groups holding pcs (None for all)."""
+    pf, rg_min, rg_max, geom_col, crs = open_area(path)
+    if pcs is None:
+        table = pf.read()
+    else:
+        query = np.array(sorted(set(pcs)), dtype=object)
+        # row groups whose [min, max] POSTCODE range holds any of the query postcodes
+        has_query = np.searchsorted(query, rg_max, side='right') > np.searchsorted(query, rg_min, side='left')
+        table = pf.read_row_groups(np.flatnonzero(has_query).tolist())
+        table = table.filter(pc.is_in(table['POSTCODE'], value_set=pa.array(query, pa.string())))
+    table = table.take(pc.sort_indices(table[SOURCE_ROW_COL]))
+    df = table.to_pandas().set_index(SOURCE_ROW_COL)
+    df.index.name = None
+    # decode the WKB in place, keeping the shapefile read's column order
+    df[geom_col] = gpd.GeoSeries.from_wkb(df[geom_col].values, crs=crs, index=df.index)
+    return gpd.GeoDataFrame(df, geometry=geom_col, crs=crs)
+
+
+def read_postcode_store(store_dir, leading_letters, pcs=None):
+    """
+    Postcode polygons of some postcode areas, as a read of each area's shapefile (concatenated in
+    leading_letters order) with POSTCODE stripped.
+    pcs: only return these postcodes (None for the whole areas); only the row groups holding them are read
+    Raises ValueError for areas not in the store, as reading their missing shapefile would.
+    """
+    manifest = load_postcode_manifest(store_dir)
+    areas = [str(a).lower() for a in leading_letters]
+    missing = [a for a in areas if a not in manifest.index]
+    if missing:
+        raise ValueError(f'Postcode areas not in postcode store {store_dir}: {missing}')
+    return pd.concat([read_area(os.path.join(store_dir, manifest.loc[area, 'file']), pcs) for area in areas])
+
+
+def postcode_store_areas(store_dir, leading_letters):
+    """
+    Number of unique PC_AREA values across the shapefiles of some areas, for the coverage check of a store read,
+    as counted over the concatenated shapefile reads.
+    """
+    manifest = load_postcode_manifest(store_dir)
+    if 'pc_areas' not in manifest.columns:
+        raise ValueError(f'Postcode store {store_dir} predates the pc_areas manifest column, convert it again')
+    pc_areas = manifest.loc[[str(a).lower() for a in leading_letters], 'pc_areas']
+    return len({a for areas in pc_areas for a in str(areas).split(PC_AREA_SEP) if a})
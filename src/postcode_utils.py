@@ -1,14 +1,217 @@
 import os 
+import numpy as np
 import pandas as pd
 import re 
 import geopandas as gpd
 from shapely.geometry import box 
+from shapely.ops import unary_union
 import glob 
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+from functools import lru_cache, cached_property
 from typing import Tuple, Optional
+from pyogrio import read_info
+from pyogrio.raw import read_arrow
+from shapely.prepared import prep
 
+from .building_store import is_building_store, read_building_store, has_key_index, gather_by_key
+from .postcode_store import is_postcode_store, read_postcode_store, postcode_store_areas
+from .read_planner import plan_postcode_read
+from .building_schema import apply_building_schema
 from .logging_config import get_logger
 logger = get_logger(__name__)
 
+# columns national_scan adds to each building: assigned postcode, 'uprn' / 'spatial' and position in the scan
+SCAN_COLS = ['postcode', 'match_type', 'scan_row']
+# building columns retrieval itself needs: upn as the key, uprn for the UPRN match, geometry for the within join
+RETRIEVAL_COLUMNS = ['upn', 'uprn', 'geometry']
+# reader for the building GeoPackage and postcode shapefiles: 'fiona' (gpd.read_file, one Python object per
+# feature) or 'arrow' (pyogrio Arrow stream, geometry kept as WKB until the GeoDataFrame is built)
+READ_ENGINES = ['fiona', 'arrow']
+READ_ENGINE = os.getenv('READ_ENGINE', 'fiona')
+# UPRNs per uprn IN (...) filter, keeps each statement well inside SQLite's limits
+UPRN_CHUNK = 500
+# GeoPackage R-tree bounds are float32 rounded outwards, envelope within queries are widened by this (metres)
+RTREE_TOLERANCE = 1.0
+
+
+class PostcodeGroups:
+    """
+    Rows of a frame grouped by a postcode column: the frame stably sorted by postcode and each postcode's
+    offsets into it, so the rows of a postcode are a contiguous slice (in frame order) found by a dict lookup
+    rather than a boolean scan of the whole frame.
+    """
+
+    def __init__(self, df, col):
+        codes, uniques = pd.factorize(df[col])
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        # rows without a postcode (code -1) sort first and belong to no group
+        ends = (codes < 0).sum() + np.cumsum(counts)
+        self.frame = df.iloc[order]
+        self.offsets = dict(zip(uniques, zip((ends - counts).tolist(), ends.tolist())))
+
+    def get(self, pc):
+        """Rows of a postcode, an empty frame with the same columns if it has none."""
+        start, end = self.offsets.get(pc, (0, 0))
+        return self.frame.iloc[start:end]
+
+    def take(self, pcs):
+        """Rows of several postcodes in one frame, postcode by postcode, in a single iloc rather than a concat."""
+        ranges = [self.offsets[pc] for pc in pcs if pc in self.offsets]
+        positions = np.concatenate([np.arange(start, end) for start, end in ranges]) if ranges else []
+        return self.frame.iloc[positions]
+
+
+class OnsudData(namedtuple('OnsudData', ['data', 'pcshp'])):
+    """
+    Output of load_onsud_data: the ONSUD rows merged with their postcode polygons, and the polygons.
+    Unpacks as the (data, pcshp) tuple; postcode_rows slices one postcode out of each through PostcodeGroups,
+    built on the first lookup so callers that never look up a postcode (e.g. split_onsud_file) skip the sort.
+    """
+
+    @cached_property
+    def data_groups(self):
+        return PostcodeGroups(self.data, 'PCDS')
+
+    @cached_property
+    def pcshp_groups(self):
+        return PostcodeGroups(self.pcshp, 'POSTCODE')
+
+
+# precomputed buildings of a batch for the 'assigned' and 'scan' retrievals: the upn -> postcode assignment table
+# (see pc_assignment) and the buildings staged by the national scan (see national_scan)
+RetrievalContext = namedtuple('RetrievalContext', ['assignment', 'scanned_buildings'], defaults=[None, None])
+
+
+def postcode_rows(onsdata, pc):
+    """
+    ONSUD rows and postcode polygons of one postcode, in the order of the batch frames.
+    Slices of the postcode groups for OnsudData, boolean filters for a plain (data, pcshp) tuple.
+    """
+    if isinstance(onsdata, OnsudData):
+        return onsdata.data_groups.get(pc), onsdata.pcshp_groups.get(pc)
+    data, pcshp = onsdata
+    return data[data['PCDS'] == pc], pcshp[pcshp['POSTCODE'] == pc]
+
+
+def postcode_polygons(onsdata, pcs):
+    """Postcode polygons of several postcodes: one take from the postcode groups of OnsudData, else a filter."""
+    if isinstance(onsdata, OnsudData):
+        return onsdata.pcshp_groups.take(pcs)
+    _, pcshp = onsdata
+    return pcshp[pcshp['POSTCODE'].isin(pcs)]
+
+
+def building_columns(*column_lists):
+    """Column manifest for a theme: retrieval columns plus the columns each step declares, without repeats."""
+    columns = list(RETRIEVAL_COLUMNS)
+    for column_list in column_lists:
+        columns += [c for c in column_list if c not in columns]
+    return columns
+
+
+@lru_cache(maxsize=8)
+def gpkg_fields(input_gpk):
+    """Attribute fields of the building GeoPackage."""
+    return tuple(read_info(input_gpk)['fields'])
+
+
+@lru_cache(maxsize=8)
+def gpkg_layer(input_gpk):
+    """Table and geometry column of the building GeoPackage layer."""
+    with closing(sqlite3.connect(f'file:{input_gpk}?mode=ro', uri=True)) as con:
+        return con.execute('SELECT table_name, column_name FROM gpkg_geometry_columns').fetchone()
+
+
+@lru_cache(maxsize=8)
+def gpkg_has_uprn_index(input_gpk):
+    """Whether the building GeoPackage has an index led by the uprn column."""
+    if not os.path.isfile(input_gpk):
+        return False
+    table, _ = gpkg_layer(input_gpk)
+    with closing(sqlite3.connect(f'file:{input_gpk}?mode=ro', uri=True)) as con:
+        for index in con.execute(f'PRAGMA index_list("{table}")').fetchall():
+            index_cols = con.execute(f'PRAGMA index_info("{index[1]}")').fetchall()
+            if index_cols and index_cols[0][2] == 'uprn':
+                return True
+    return False
+
+
+def ensure_uprn_index(input_gpk):
+    """
+    Create an index on the uprn column of the building GeoPackage if it has none, so uprn IN (...) filters
+    are index lookups inside SQLite. Writes to the input file, so only run once before any jobs, from
+    create_uprn_index.py; jobs only check for it with gpkg_has_uprn_index.
+    Returns whether the index exists (False if the file cannot be written).
+    """
+    if gpkg_has_uprn_index(input_gpk):
+        return True
+    table, _ = gpkg_layer(input_gpk)
+    logger.info(f'Creating uprn index on {input_gpk}')
+    try:
+        with closing(sqlite3.connect(input_gpk, timeout=3600)) as con:
+            con.execute(f'CREATE INDEX IF NOT EXISTS "{table}_uprn_idx" ON "{table}" (uprn)')
+            con.commit()
+    except sqlite3.OperationalError as e:
+        logger.warning(f'Could not create uprn index on {input_gpk}: {e}')
+        return False
+    gpkg_has_uprn_index.cache_clear()
+    return True
+
+
+def read_vector_arrow(path, bbox=None, mask=None, columns=None, where=None, row_id_col=None):
+    """
+    read_vector through pyogrio's Arrow stream: attributes come back as Arrow columns and geometry as one
+    WKB buffer, decoded in a single pass at the end instead of per feature.
+    GDAL applies the bbox filter. A mask is read by its bounds and then filtered here (pyogrio's own mask
+    option needs shapely 2).
+    where: optional SQL attribute filter, applied by GDAL
+    row_id_col: also return each feature's fid in this column
+    """
+    geom = mask if mask is not None else bbox
+    if geom is not None and not hasattr(geom, 'bounds'):
+        geom = box(*geom)
+    fields = None if columns is None else [f for f in gpkg_fields(path) if f in columns]
+    meta, table = read_arrow(path, bbox=None if geom is None else tuple(geom.bounds), columns=fields, where=where,
+                             return_fids=row_id_col is not None)
+    if row_id_col is not None:
+        # GDAL puts the fid first
+        table = table.rename_columns([row_id_col] + table.schema.names[1:])
+
+    gdf = arrow_table_to_gdf(meta, table)
+    if mask is not None and not mask.equals(box(*mask.bounds)):
+        prepared = prep(mask)
+        gdf = gdf[np.array([prepared.intersects(g) for g in gdf.geometry], dtype=bool)].reset_index(drop=True)
+    return gdf
+
+
+def arrow_table_to_gdf(meta, table):
+    """GeoDataFrame from a pyogrio Arrow read, geometry decoded from WKB in one pass."""
+    geom_col = meta['geometry_name'] or 'wkb_geometry'
+    wkb = table.column(geom_col).to_numpy(zero_copy_only=False)
+    return apply_building_schema(gpd.GeoDataFrame(table.drop([geom_col]).to_pandas(),
+                                                  geometry=gpd.GeoSeries.from_wkb(wkb, crs=meta['crs'])))
+
+
+def read_vector(path, bbox=None, mask=None, columns=None, engine=None, row_id_col=None):
+    """
+    Read a GeoPackage or shapefile (buildings, postcode polygons) to a GeoDataFrame.
+    Verisk string attributes come back as Categoricals, see building_schema.
+    columns: only read these attribute columns, None for all
+    engine: 'fiona' or 'arrow', defaults to READ_ENGINE (env var READ_ENGINE)
+    row_id_col: also return each feature's fid in this column; fids come from the Arrow reader, whatever the engine
+    """
+    engine = engine or READ_ENGINE
+    if engine == 'arrow' or row_id_col is not None:
+        return read_vector_arrow(path, bbox=bbox, mask=mask, columns=columns, row_id_col=row_id_col)
+    if engine != 'fiona':
+        raise ValueError(f'Unknown read engine: {engine}, expected one of {READ_ENGINES}')
+    if columns is None:
+        return apply_building_schema(gpd.read_file(path, bbox=bbox, mask=mask))
+    ignore_fields = [f for f in gpkg_fields(path) if f not in columns]
+    return apply_building_schema(gpd.read_file(path, bbox=bbox, mask=mask, ignore_fields=ignore_fields))
 
 
 def join_pc_map_three_pc(df, df_col,  pc_map  ):
@@ -28,27 +231,369 @@ def join_pc_map_three_pc(df, df_col,  pc_map  ):
 
 
 
-def find_data_pc_joint(pc, onsdata, input_gpk, overlap=False):
+def read_buildings(input_gpk, bbox=None, mask=None, columns=None, row_id_col=None):
+    """
+    Read buildings from the building file, filtered to a bbox or a mask geometry.
+    All building reads go through here so the retrieval backend can be swapped in one place.
+    input_gpk: Verisk GeoPackage, a building store directory from building_store.convert_gpkg_to_store,
+        or a reader with the same read(bbox, mask, columns) call such as tile_cache.TileCache
+    columns: only read these building columns (a theme's column manifest), None for all.
+        Geometry is always read, the spatial filter needs it.
+    row_id_col: also return each building's position in the building file in this column, to put rows of
+        separate reads back in file order (GeoPackage and building store only)
+    """
+    if hasattr(input_gpk, 'read'):
+        if row_id_col is not None:
+            raise ValueError(f'Row ids are only read from a building file, not from {input_gpk}')
+        return input_gpk.read(bbox=bbox, mask=mask, columns=columns)
+    if is_building_store(input_gpk):
+        return read_building_store(input_gpk, bbox=bbox, mask=mask, columns=columns, row_id_col=row_id_col)
+    return read_vector(input_gpk, bbox=bbox, mask=mask, columns=columns, row_id_col=row_id_col)
+
+
+def join_pc_buildings(buildings, uprns, pcshp, within_pos=None):
+    """
+    Joint UPRN and spatial match of buildings to one postcode.
+    buildings: buildings intersecting the postcode bbox
+    uprns: ONSUD UPRNs for the postcode
+    pcshp: postcode shapefile rows for the postcode
+    within_pos: optional positions in buildings already known to be within the postcode, skips the sjoin
+    """
+    uprn_match = buildings[buildings['uprn'].isin(uprns)].copy()
+
+    if within_pos is None:
+        sj_match = buildings.sjoin(pcshp, how='inner', predicate='within')[uprn_match.columns]
+    else:
+        sj_match = buildings.iloc[within_pos]
+    joint_data = pd.concat([uprn_match, sj_match]).drop_duplicates()
+    return joint_data 
+
+
+def find_data_pc_joint(pc, onsdata, input_gpk, overlap=False, columns=None, retrieval='postcode'):
     """
     Find buildings based on UPRN match to the postcodes and Spatial join 
     input: joint data product from onsud loadaer (pcshp and onsud data) 
+    columns: building columns to read (see building_columns), None for all
+    retrieval: 'sql' filters inside the building GeoPackage when it has a uprn index (see find_data_pc_sql),
+        any other mode reads the bbox
     """
     logger.debug(f"Finding data for postcode: {pc}")
-    data, pcshp = onsdata 
-    pcshp = pcshp[pcshp['POSTCODE']==pc]
+    data, pcshp = postcode_rows(onsdata, pc)
 
-    gd = gpd.GeoDataFrame(data[data['PCDS'] == pc].copy(), geometry='geometry')
+    gd = gpd.GeoDataFrame(data.copy(), geometry='geometry')
     if gd.empty:
         logger.warning(f"No data found for postcode {pc}")
         return None 
     
     bbox = box(*gd.total_bounds)
-    buildings = gpd.read_file(input_gpk, bbox=bbox)
-    uprn_match = buildings[buildings['uprn'].isin(gd['UPRN'])].copy()
+    if is_building_store(input_gpk) and has_key_index(input_gpk, 'uprn'):
+        return find_data_pc_indexed(gd, pcshp, input_gpk, bbox, columns)
+    if is_building_gpkg(input_gpk):
+        cover = plan_postcode_read(pc, pcshp.geometry)
+        if cover is not None:
+            return find_data_pc_covered(gd, pcshp, input_gpk, bbox, cover, columns)
+        if retrieval == 'sql' and gpkg_has_uprn_index(input_gpk):
+            return find_data_pc_sql(gd, pcshp, input_gpk, bbox, columns)
+    buildings = read_buildings(input_gpk, bbox=bbox, columns=columns)
+    return join_pc_buildings(buildings, gd['UPRN'], pcshp)
+
+
+def is_building_gpkg(input_gpk):
+    """Whether the building file is the GeoPackage itself (not a building store or a reader such as a tile cache)."""
+    return isinstance(input_gpk, (str, os.PathLike)) and not is_building_store(input_gpk)
+
+
+def read_uprn_matches(input_gpk, uprns, bbox, columns=None):
+    """
+    Buildings in the building GeoPackage with one of the given UPRNs that intersect the bbox, read with
+    uprn IN (...) filters so SQLite hands back only the matches (an index lookup with ensure_uprn_index).
+    """
+    uprns = pd.to_numeric(pd.Series(uprns), errors='coerce').dropna().astype(np.int64).unique()
+    wheres = [f"uprn IN ({','.join(str(u) for u in uprns[i:i + UPRN_CHUNK])})"
+              for i in range(0, len(uprns), UPRN_CHUNK)] or ['0 = 1']
+    matches = [read_vector_arrow(input_gpk, bbox=bbox, columns=columns, where=where) for where in wheres]
+    return matches[0] if len(matches) == 1 else pd.concat(matches, ignore_index=True)
+
+
+def read_envelope_within(input_gpk, bbox, columns=None):
+    """
+    Buildings of the building GeoPackage whose bbox lies inside a bbox, the only ones that can be within a
+    polygon inside it. Selected by SQL on the GeoPackage R-tree, so SQLite skips every other building.
+    """
+    table, geom_col = gpkg_layer(input_gpk)
+    fields = [f for f in gpkg_fields(input_gpk) if columns is None or f in columns]
+    select = ', '.join(f'b."{f}"' for f in fields + [geom_col])
+    minx, miny, maxx, maxy = bbox.bounds
+    sql = (f'SELECT {select} '
+           f'FROM "{table}" b JOIN "rtree_{table}_{geom_col}" r ON b.fid = r.id '
+           f'WHERE r.minx >= {minx - RTREE_TOLERANCE} AND r.maxx <= {maxx + RTREE_TOLERANCE} '
+           f'AND r.miny >= {miny - RTREE_TOLERANCE} AND r.maxy <= {maxy + RTREE_TOLERANCE}')
+    meta, arrow_table = read_arrow(input_gpk, sql=sql)
+    return arrow_table_to_gdf(meta, arrow_table)
 
-    sj_match = buildings.sjoin(pcshp, how='inner', predicate='within')[uprn_match.columns]
+
+def find_data_pc_sql(gd, pcshp, input_gpk, bbox, columns=None):
+    """
+    find_data_pc_joint with the filtering pushed into SQLite: the UPRN half is an indexed uprn IN (...) query
+    within the bbox, and the spatial half an R-tree query for buildings whose bbox lies inside the postcode
+    bbox. Same rows as the bbox read + isin + within join.
+    """
+    uprn_match = read_uprn_matches(input_gpk, gd['UPRN'], bbox, columns)
+    candidates = read_envelope_within(input_gpk, bbox, columns)
+    sj_match = candidates.sjoin(pcshp, how='inner', predicate='within')[uprn_match.columns]
     joint_data = pd.concat([uprn_match, sj_match]).drop_duplicates()
-    return joint_data 
+    return joint_data
+
+
+def find_data_pc_covered(gd, pcshp, input_gpk, bbox, cover, columns=None):
+    """
+    find_data_pc_joint for a postcode whose bbox is a poor fit to its polygon.
+    The UPRN half is an attribute query within the bbox, and the spatial half only reads the cover boxes from
+    read_planner.plan_postcode_read. The cover contains the polygon, so every building within the postcode is
+    read and the rows match the bbox read (order may differ).
+    """
+    uprn_match = read_uprn_matches(input_gpk, gd['UPRN'], bbox, columns)
+    candidates = pd.concat([read_buildings(input_gpk, bbox=b, columns=columns) for b in cover])
+    candidates = gpd.GeoDataFrame(candidates.drop_duplicates('upn'), geometry='geometry', crs=candidates.crs)
+    sj_match = candidates.sjoin(pcshp, how='inner', predicate='within')[uprn_match.columns]
+    joint_data = pd.concat([uprn_match, sj_match[~sj_match['upn'].isin(uprn_match['upn'])]])
+    return joint_data.reset_index(drop=True)
+
+
+def find_data_pc_indexed(gd, pcshp, store_dir, bbox, columns=None):
+    """
+    find_data_pc_joint against a building store with a uprn index.
+    The UPRN half is a gather through the index (restricted to the bbox, as the bbox read was), and the
+    spatial half only decodes buildings whose bbox lies inside the postcode bbox, the only ones that
+    can be within the postcode. Same rows as the bbox read + isin + within join.
+    """
+    uprn_match = gather_by_key(store_dir, gd['UPRN'], 'uprn', bbox=bbox, columns=columns)
+    candidates = read_building_store(store_dir, bbox=bbox, envelope_within=True, columns=columns)
+    sj_match = candidates.sjoin(pcshp, how='inner', predicate='within')[uprn_match.columns]
+    joint_data = pd.concat([uprn_match, sj_match]).drop_duplicates()
+    return joint_data
+
+
+def find_data_pc_batch(pcs, onsdata, input_gpk, columns=None):
+    """
+    Batch version of find_data_pc_joint: one building read for a whole sub-batch of postcodes.
+
+    Reads the union of the postcode bboxes once, then splits the buildings out to each postcode
+    in memory (spatial index query on the postcode bbox, then the same UPRN + within join).
+    Results match find_data_pc_joint for every postcode. Each postcode's ONSUD rows and polygons are sliced out
+    with postcode_rows, so an OnsudData batch is never scanned per sub-batch.
+
+    Returns: dict of postcode -> joint building data (None where the postcode has no ONSUD data)
+    """
+    pcs = [pc.strip() for pc in pcs]
+    logger.debug(f"Finding data for batch of {len(pcs)} postcodes")
+    pc_rows = {pc: postcode_rows(onsdata, pc) for pc in sorted(set(pcs))}
+    pc_groups = {pc: gpd.GeoDataFrame(rows, geometry='geometry') for pc, (rows, _) in pc_rows.items() if len(rows)}
+    pc_polys = {pc: polys for pc, (_, polys) in pc_rows.items() if len(polys)}
+    pcshp = postcode_polygons(onsdata, list(pc_rows))
+    pc_bboxes = {pc: box(*gd.total_bounds) for pc, gd in pc_groups.items()}
+    if not pc_bboxes:
+        logger.warning("No data found for any postcode in batch")
+        return {pc: None for pc in pcs}
+
+    # postcodes whose bbox is a poor fit to their polygon are read on their own through a polygon cover,
+    # so their bbox does not widen the shared read
+    covers = {}
+    if is_building_gpkg(input_gpk):
+        for pc, polys in pc_polys.items():
+            cover = plan_postcode_read(pc, polys.geometry) if pc in pc_bboxes else None
+            if cover is not None:
+                covers[pc] = cover
+    shared_bboxes = [b for pc, b in pc_bboxes.items() if pc not in covers]
+    if shared_bboxes:
+        buildings = read_buildings(input_gpk, mask=unary_union(shared_bboxes), columns=columns).reset_index(drop=True)
+    else:
+        buildings = read_buildings(input_gpk, bbox=(0, 0, 0, 0), columns=columns).iloc[:0]
+    logger.debug(f"Read {len(buildings)} buildings for batch, {len(covers)} postcodes read by polygon cover")
+
+    # one within join for the whole batch, split out per postcode below
+    within = buildings.sjoin(pcshp, how='inner', predicate='within')
+    within_groups = {pc: np.unique(within.index.values[pos]) for pc, pos in within.groupby('POSTCODE').indices.items()}
+
+    results = {}
+    for pc in pcs:
+        if pc not in pc_groups:
+            logger.warning(f"No data found for postcode {pc}")
+            results[pc] = None
+            continue
+        if pc in covers:
+            results[pc] = find_data_pc_covered(pc_groups[pc], pc_polys[pc], input_gpk,
+                                               pc_bboxes[pc], covers[pc], columns)
+            continue
+        # keep file order and a fresh index so output matches a bbox read for the postcode
+        idx = np.sort(buildings.sindex.query(pc_bboxes[pc], predicate='intersects'))
+        pc_buildings = buildings.iloc[idx].reset_index(drop=True)
+        pc_within = within_groups.get(pc, np.array([], dtype=int))
+        within_pos = np.searchsorted(idx, pc_within[np.isin(pc_within, idx)])
+        results[pc] = join_pc_buildings(pc_buildings, pc_groups[pc]['UPRN'], None, within_pos=within_pos)
+    return results
+
+
+def find_data_pc_assigned(pcs, onsdata, assignment, store_dir, columns=None):
+    """
+    Buildings for a sub-batch of postcodes from a precomputed assignment table (see pc_assignment),
+    gathered by upn through the building store index with no spatial work.
+    Same rows, in the same order, as find_data_pc_joint.
+
+    Returns: dict of postcode -> joint building data (None where the postcode has no ONSUD data)
+    """
+    if not (is_building_store(store_dir) and has_key_index(store_dir, 'upn')):
+        raise ValueError(f'Assigned retrieval needs a building store with a upn index: {store_dir}')
+    pcs = [pc.strip() for pc in pcs]
+    data, _ = onsdata
+    found_pcs = set(data.loc[data['PCDS'].isin(pcs), 'PCDS'])
+    assignment = assignment[assignment['postcode'].isin(pcs)]
+
+    buildings = gather_by_key(store_dir, assignment['upn'].unique(), 'upn', columns=columns)
+    upn_index = pd.Index(buildings['upn'])
+    pc_rows = assignment.groupby('postcode', sort=False)['upn'].apply(list)
+
+    results = {}
+    for pc in pcs:
+        if pc not in found_pcs:
+            logger.warning(f"No data found for postcode {pc}")
+            results[pc] = None
+            continue
+        positions = upn_index.get_indexer(pc_rows.get(pc, []))
+        if (positions == -1).any():
+            raise ValueError(f'Assignment for postcode {pc} has upns missing from the building store')
+        results[pc] = buildings.iloc[positions].reset_index(drop=True)
+    return results
+
+
+def find_data_pc_scanned(pcs, onsdata, scanned, columns=None):
+    """
+    Buildings for a sub-batch of postcodes from a sequential scan of the building file (see national_scan).
+    Same rows as find_data_pc_joint: UPRN matches first, then buildings only found by the within join,
+    each in scan order.
+
+    Returns: dict of postcode -> joint building data (None where the postcode has no ONSUD data)
+    """
+    pcs = [pc.strip() for pc in pcs]
+    data, _ = onsdata
+    found_pcs = set(data.loc[data['PCDS'].isin(pcs), 'PCDS'])
+    scanned = scanned[scanned['postcode'].isin(pcs)]
+    scanned = scanned.iloc[np.lexsort((scanned['scan_row'].values, scanned['match_type'].values != 'uprn'))]
+
+    pc_groups = scanned.groupby('postcode', sort=False).indices
+    buildings = scanned.drop(columns=SCAN_COLS).reset_index(drop=True)
+    if columns is not None:
+        buildings = buildings[[c for c in buildings.columns if c in columns]]
+
+    results = {}
+    for pc in pcs:
+        if pc not in found_pcs:
+            logger.warning(f"No data found for postcode {pc}")
+            results[pc] = None
+            continue
+        results[pc] = buildings.iloc[pc_groups.get(pc, [])].reset_index(drop=True)
+    return results
+
+
+def find_data_subbatch(pcs, onsdata, input_gpk, retrieval='batch', retrieval_context=None, columns=None):
+    """
+    Retrieve buildings for a sub-batch of postcodes.
+    retrieval: 'batch' (one read for the sub-batch), 'assigned' (from a precomputed assignment table),
+        'scan' (from buildings already found by a sequential scan), 'postcode' or 'sql' (read per postcode
+        later, returns None; 'sql' is per postcode with the filtering in SQLite, see find_data_pc_sql)
+    retrieval_context: RetrievalContext with the assignment table for 'assigned', the scanned buildings for 'scan'
+    columns: building columns to read (see building_columns), None for all
+    Returns: dict of postcode -> joint building data, or None for per postcode reads
+    """
+    if retrieval == 'batch':
+        return find_data_pc_batch(pcs, onsdata, input_gpk, columns)
+    retrieval_context = retrieval_context or RetrievalContext()
+    if retrieval == 'assigned':
+        if retrieval_context.assignment is None:
+            raise ValueError('assigned retrieval needs the assignment table for the batch')
+        return find_data_pc_assigned(pcs, onsdata, retrieval_context.assignment, input_gpk, columns)
+    if retrieval == 'scan':
+        if retrieval_context.scanned_buildings is None:
+            raise ValueError('scan retrieval needs the scanned buildings for the batch')
+        return find_data_pc_scanned(pcs, onsdata, retrieval_context.scanned_buildings, columns)
+    if retrieval in ('postcode', 'sql'):
+        return None
+    raise ValueError(f'Unknown building retrieval mode: {retrieval}')
+
+
+def get_pc_buildings(pc, onsdata, input_gpk, batch_buildings=None, columns=None, retrieval='postcode'):
+    """
+    Buildings for a postcode, from batch retrieval results if available else a per postcode read.
+    retrieval: mode of the per postcode read, 'postcode' or 'sql'
+    """
+    if batch_buildings is None:
+        return find_data_pc_joint(pc, onsdata, input_gpk=input_gpk, columns=columns, retrieval=retrieval)
+    return batch_buildings.get(pc)
+
+
+def stack_postcode_buildings(pc_buildings, columns=None):
+    """
+    One table of a sub-batch's buildings tagged with a 'postcode' column, for batch level processing.
+    pc_buildings: dict of postcode -> buildings (None for postcodes without any)
+    columns: building columns to keep, None for all
+    """
+    frames = {pc: df for pc, df in pc_buildings.items() if df is not None and len(df)}
+    if not frames:
+        return pd.DataFrame(columns=list(columns or []) + ['postcode'])
+    stacked = pd.concat([pd.DataFrame(df if columns is None else df[columns]) for df in frames.values()],
+                        ignore_index=True)
+    stacked['postcode'] = np.repeat(list(frames), [len(df) for df in frames.values()])
+    return stacked
+
+
+def postcode_codes(buildings, pcs):
+    """Position in pcs (unique) of each building's postcode, -1 where it is not in pcs."""
+    return pd.Index(pcs).get_indexer(buildings['postcode'])
+
+
+def match_record_dtypes(df, count_cols):
+    """
+    Give count columns the dtype pd.DataFrame(list of per postcode dicts) would: int64 where every postcode has a
+    value, float64 (NaN for missing) otherwise. Keeps batch aggregated log files identical to per postcode ones.
+    """
+    for col in count_cols:
+        if len(df) and df[col].notna().all():
+            df[col] = df[col].astype(np.int64)
+    return df
+
+
+def residential_category_counts(pcs, buildings, values, categories, missing, missing_col):
+    """
+    Per postcode counts of residential buildings by category, for a whole sub-batch in one bincount over
+    (postcode, category) codes. Same values and log format as the per postcode value_counts of the age and
+    typology themes: categories with no buildings are NaN, and postcodes with no buildings are all NaN.
+
+    pcs: postcodes in output order
+    buildings: the sub-batch's buildings with 'postcode' and 'premise_use' columns (see stack_postcode_buildings)
+    values: category of each building, aligned with buildings
+    categories: categories to count, in column order
+    missing: bool array aligned with buildings, residential buildings counted in missing_col
+    Returns: DataFrame of postcode, categories, len_res, missing_col
+    """
+    unique_pcs = list(dict.fromkeys(pcs))
+    n_pcs, n_cats = len(unique_pcs), len(categories)
+    pc_codes = postcode_codes(buildings, unique_pcs)
+    cat_codes = pd.Categorical(values, categories=categories).codes
+    res = (buildings['premise_use'] == 'Residential').values & (pc_codes >= 0)
+
+    counted = res & (cat_codes >= 0)
+    counts = np.bincount(pc_codes[counted] * n_cats + cat_codes[counted], minlength=n_pcs * n_cats)
+    counts = counts.reshape(n_pcs, n_cats).astype(float)
+    counts[counts == 0] = np.nan
+    has_buildings = np.bincount(pc_codes[pc_codes >= 0], minlength=n_pcs) > 0
+
+    result = pd.DataFrame(counts, columns=categories)
+    result.insert(0, 'postcode', unique_pcs)
+    result['len_res'] = np.where(has_buildings, np.bincount(pc_codes[res], minlength=n_pcs), np.nan)
+    result[missing_col] = np.where(has_buildings, np.bincount(pc_codes[res & missing], minlength=n_pcs), np.nan)
+    result = result.iloc[pd.Index(unique_pcs).get_indexer(pcs)].reset_index(drop=True)
+    return match_record_dtypes(result, list(categories) + ['len_res', missing_col])
+
 
 def check_duplicate_primary_key(df, primary_key_column):
     logger.debug(f"Checking duplicates in column: {primary_key_column}")
@@ -60,7 +605,7 @@ def load_ids_from_file(file_path):
         ids = file.read().splitlines()
     return ids
 
-def load_onsud_data(path_to_onsud_file: str, path_to_pcshp: str) -> Optional[Tuple[pd.DataFrame, pd.DataFrame]]:
+def load_onsud_data(path_to_onsud_file: str, path_to_pcshp: str) -> Optional[OnsudData]:
     """
     Load and process ONS UPRN Database (ONSUD) data from a regional file.
     
@@ -69,9 +614,10 @@ def load_onsud_data(path_to_onsud_file: str, path_to_pcshp: str) -> Optional[Tup
         path_to_pcshp: Path to the directory containing postcode shapefiles
         
     Returns:
-        Tuple containing:
+        OnsudData, unpacking as the tuple:
             - Processed ONSUD DataFrame with geographic data
             - Postcode shapefile DataFrame
+        with each postcode's rows sliced out through postcode_rows.
         Returns None if path_to_onsud_file is None
     """
     if path_to_onsud_file is None:
@@ -82,7 +628,14 @@ def load_onsud_data(path_to_onsud_file: str, path_to_pcshp: str) -> Optional[Tup
     logger.debug(f'Loading ONSUD file for batch: {region_label}')
     
     onsud_df = pd.read_csv(path_to_onsud_file, low_memory=False)
-    return find_postcode_for_ONSUD_file(onsud_df, path_to_pcshp)
+    return OnsudData(*find_postcode_for_ONSUD_file(onsud_df, path_to_pcshp))
+
+def pc_shapefile_path(path_to_pc_shp_folder, leading_letter):
+    """Postcode shapefile for a postcode area (one or two leading letters)."""
+    pc = leading_letter.lower()
+    if len(pc) == 1:
+        return os.path.join(path_to_pc_shp_folder, f'one_letter_pc_code/{pc}/{pc}.shp')
+    return os.path.join(path_to_pc_shp_folder, f'two_letter_pc_code/{pc}.shp')
 
 def find_postcode_for_ONSUD_file(onsud_file: pd.DataFrame, 
                                 path_to_pc_shp_folder: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -91,7 +644,8 @@ def find_postcode_for_ONSUD_file(onsud_file: pd.DataFrame,
     
     Args:
         onsud_file: DataFrame containing ONSUD data
-        path_to_pc_shp_folder: Path to folder containing postcode shapefiles
+        path_to_pc_shp_folder: Path to folder containing postcode shapefiles, or a postcode store made with
+            convert_postcode_store.py (then only the postcodes of onsud_file are read)
         
     Returns:
         Tuple containing:
@@ -105,22 +659,25 @@ def find_postcode_for_ONSUD_file(onsud_file: pd.DataFrame,
     onsud_file.loc[:, 'PCDS'] = onsud_file['PCDS'].str.strip()
     
     # Load and combine postcode shapefiles
-    whole_pc = []
-    for pc in onsud_file['leading_letter'].unique():
-        pc = pc.lower()
-        if len(pc) == 1:
-            pc_path = os.path.join(path_to_pc_shp_folder, f'one_letter_pc_code/{pc}/{pc}.shp')
-        else:
-            pc_path = os.path.join(path_to_pc_shp_folder, f'two_letter_pc_code/{pc}.shp')
-        logger.debug(f"Loading shapefile from: {pc_path}")
-        pc_shp = gpd.read_file(pc_path)
-        whole_pc.append(pc_shp)
-
-    pc_df = pd.concat(whole_pc)
-    pc_df['POSTCODE'] = pc_df['POSTCODE'].str.strip()
+    leading_letters = onsud_file['leading_letter'].unique()
+    if is_postcode_store(path_to_pc_shp_folder):
+        logger.debug(f"Loading postcodes of {len(leading_letters)} areas from store: {path_to_pc_shp_folder}")
+        pc_df = read_postcode_store(path_to_pc_shp_folder, leading_letters, pcs=onsud_file['PCDS'].unique())
+        n_pc_areas = postcode_store_areas(path_to_pc_shp_folder, leading_letters)
+    else:
+        whole_pc = []
+        for pc in leading_letters:
+            pc_path = pc_shapefile_path(path_to_pc_shp_folder, pc)
+            logger.debug(f"Loading shapefile from: {pc_path}")
+            pc_shp = read_vector(pc_path)
+            whole_pc.append(pc_shp)
+
+        pc_df = pd.concat(whole_pc)
+        pc_df['POSTCODE'] = pc_df['POSTCODE'].str.strip()
+        n_pc_areas = pc_df.PC_AREA.nunique()
     
     # Validate postcode coverage
-    if len(pc_df.PC_AREA.unique()) != len(onsud_file['leading_letter'].unique()):
+    if n_pc_areas != len(leading_letters):
         logger.error('Incomplete postcode coverage in shapefile')
         raise ValueError('Incomplete postcode coverage in shapefile')
     
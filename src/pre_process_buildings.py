@@ -17,7 +17,12 @@ Modified: 2024
 import pandas as pd
 import numpy as np
 import os 
-from .postcode_utils import check_merge_files
+from collections import namedtuple
+from functools import lru_cache
+import shapely
+from .postcode_utils import stack_postcode_buildings, find_data_subbatch, get_pc_buildings
+from .building_schema import (PRE_1919_AGES, HEIGHT_BINS, HEIGHT_BUCKETS, height_bucket_codes,
+                              height_bucket_labels)
 
 
 from .logging_config import get_logger
@@ -33,6 +38,32 @@ BASEMENT_HEIGHT = 2.4
 BASEMENT_PERCENTAGE_OF_PREMISE_AREA = 1
 DEFAULT_FLOOR_HEIGHT = 2.3
 
+# Verisk columns pre_process_building_data reads, part of each theme's column manifest
+PRE_PROCESS_COLUMNS = ['premise_age', 'height', 'premise_floor_count', 'listed_grade', 'premise_type',
+                       'uprn_count', 'map_simple_use', 'premise_area', 'basement', 'geometry']
+
+# pre processing profiles, each running the steps of the ones before it and more:
+#  attributes: age buckets and outbuilding premise types, no geometry or floor count maths
+#  volumetrics: the full chain of pre_process_buildings, floor counts, heated volumes and basements
+ATTRIBUTES = 'attributes'
+VOLUMETRICS = 'volumetrics'
+PRE_PROCESS_PROFILES = [ATTRIBUTES, VOLUMETRICS]
+# Verisk columns each profile reads
+PRE_PROCESS_PROFILE_COLUMNS = {
+    ATTRIBUTES: ['premise_age', 'height', 'premise_floor_count', 'premise_type', 'uprn_count'],
+    VOLUMETRICS: PRE_PROCESS_COLUMNS,
+}
+
+# local_fill_status of groups whose invalid floor counts / heights cannot be filled with a local average
+NO_VALID_FC = 'no valid fc'
+SINGLE_BUILDING = 'single building'
+NO_VALID_HEIGHT = 'no valid height'
+
+# keys of the global average floor count table, the last is matched to height_filled_bucket_code
+GLOBAL_AVERAGE_KEYS = ['map_simple_use', 'premise_age_bucketed', 'height_bucket']
+# global average floor counts as a dense table: floorcount[use code, age code, height bucket code]
+GlobalAverages = namedtuple('GlobalAverages', ['uses', 'ages', 'heights', 'floorcount'])
+
 # changed function to allow flexible but these are the defaults
 # MAX_THRESHOLD_FLOOR_HEIGHT = 5.3
 # MIN_THRESH_FL_HEIGHT = 2.2
@@ -50,23 +81,60 @@ def load_avg_floor_count():
     return pd.read_csv(csv_path)
 
 
+def global_average_lut(fc):
+    """
+    Dense lookup table of a global average floor count table (see load_avg_floor_count), NaN for key combinations
+    the table does not have. Validates the table once, so filling buildings needs no per merge checks.
+    """
+    missing = [c for c in GLOBAL_AVERAGE_KEYS + ['global_average_floorcount'] if c not in fc.columns]
+    if fc.empty or missing:
+        raise ValueError(f'Global average floor count table is empty or missing columns: {missing}')
+    if fc[GLOBAL_AVERAGE_KEYS].isna().any().any():
+        raise ValueError('Global average floor count table has null keys')
+    if fc.duplicated(GLOBAL_AVERAGE_KEYS).any():
+        raise ValueError('Global average floor count table has duplicate keys')
+
+    _, heights = get_height_bins()
+    unknown = set(fc['height_bucket']) - set(heights)
+    if unknown:
+        logger.warning(f'Global average height buckets not in get_height_bins, ignored: {sorted(unknown)}')
+        fc = fc[fc['height_bucket'].isin(heights)]
+
+    uses, ages = list(dict.fromkeys(fc['map_simple_use'])), list(dict.fromkeys(fc['premise_age_bucketed']))
+    floorcount = np.full((len(uses), len(ages), len(heights)), np.nan)
+    floorcount[pd.Categorical(fc['map_simple_use'], categories=uses).codes,
+               pd.Categorical(fc['premise_age_bucketed'], categories=ages).codes,
+               pd.Categorical(fc['height_bucket'], categories=heights).codes] = fc['global_average_floorcount'].values
+    return GlobalAverages(uses, ages, heights, floorcount)
+
+
+@lru_cache(maxsize=1)
+def load_global_averages():
+    """The global average floor count lookup table, loaded and validated once per process."""
+    logger.debug('Loading average floor count global averages')
+    return global_average_lut(load_avg_floor_count())
+
+
 def create_age_buckets(df):
-    df['premise_age_bucketed'] = np.where(df['premise_age'].isin(['Pre 1837', '1837-1869', '1870-1918']), 'Pre 1919', df['premise_age'])
+    df['premise_age_bucketed'] = np.where(df['premise_age'].isin(PRE_1919_AGES), 'Pre 1919', df['premise_age'])
     return df 
 
 def get_height_bins():
-    height_bins = [0, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 22, 24, 26, 28, 30, 35, 40, 45, 50, 55, 60, 70, 80, 90, 100, 200]
-    height_labels = [f"{b}-{height_bins[i+1]}m" for i, b in enumerate(height_bins[:-1])]
-    return height_bins, height_labels
+    return HEIGHT_BINS, HEIGHT_BUCKETS
 
 
-def create_height_bucket_cols(df, col):
-    """Bucket height into predefined categories."""
-    height_bins, height_labels = get_height_bins() 
+def create_height_bucket_cols(df, col, labels=True):
+    """
+    Bucket height into predefined categories: {col}_bucket_code, the index into get_height_bins labels (-1 when
+    outside the bins), and with labels=True the {col}_bucket label Categorical derived from it.
+    """
     # check if col exists in df 
     if col not in df.columns:
         raise Exception(f'Column {col} not found in df')
-    df[f'{col}_bucket'] = pd.cut(df[col], bins=height_bins, labels=height_labels, right=False)
+    codes = height_bucket_codes(df[col].values)
+    df[f'{col}_bucket_code'] = codes
+    if labels:
+        df[f'{col}_bucket'] = height_bucket_labels(codes)
     return df
 
 
@@ -95,6 +163,73 @@ def min_side(polygon):
     return least_width 
 
 
+def hull_rings(geoms):
+    """
+    Convex hull exterior coordinates of geometries as flat arrays: x, y, ring offsets and a mask of the geometries
+    whose hull is a polygon. Only those have a ring, ring i being [offsets[i], offsets[i+1]) with its first point
+    repeated last; hulls that are a LineString or Point (collinear or repeated points) have none.
+    Shapely 2 gets them for the whole array at once, shapely 1.8 per geometry.
+    """
+    if hasattr(shapely, 'get_coordinates'):
+        hulls = shapely.convex_hull(np.asarray(geoms, dtype=object))
+        is_polygon = shapely.get_type_id(hulls) == 3
+        xy, index = shapely.get_coordinates(hulls[is_polygon], return_index=True)
+        offsets = np.searchsorted(index, np.arange(is_polygon.sum() + 1))
+        return xy[:, 0], xy[:, 1], offsets, is_polygon
+
+    hulls = [geom.convex_hull for geom in geoms]
+    is_polygon = np.array([hull.geom_type == 'Polygon' for hull in hulls], dtype=bool)
+    rings = [np.column_stack(hull.exterior.xy) for hull, polygon in zip(hulls, is_polygon) if polygon]
+    offsets = np.concatenate([[0], np.cumsum([len(r) for r in rings])]).astype(np.int64)
+    xy = np.concatenate(rings) if rings else np.empty((0, 2))
+    return xy[:, 0], xy[:, 1], offsets, is_polygon
+
+
+def min_sides(geoms):
+    """
+    min_side of many geometries at once: rotating calipers over the convex hull coordinates in numpy.
+    Like shapely's minimum_rotated_rectangle, each hull edge direction gives a bounding box, the first with the
+    least area is the rectangle, and its shorter side is returned.
+    Geometries whose convex hull is not a polygon have no rotated rectangle and get NaN.
+    """
+    x, y, offsets, is_polygon = hull_rings(geoms)
+    result = np.full(len(is_polygon), np.nan)
+    n = len(offsets) - 1
+    if n == 0:
+        return result
+    n_pts = np.diff(offsets)
+    ring = np.repeat(np.arange(n), n_pts)
+
+    # one edge from each point to the next, the closing point starts none
+    starts = np.ones(len(x), dtype=bool)
+    starts[offsets[1:] - 1] = False
+    edge = np.flatnonzero(starts)
+    edge_ring = ring[edge]
+    dx, dy = x[edge + 1] - x[edge], y[edge + 1] - y[edge]
+    length = np.sqrt(dx ** 2 + dy ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ux, uy = dx / length, dy / length
+
+    # project every vertex of the ring onto each edge's axes (u along the edge, v across)
+    n_vert = (n_pts - 1)[edge_ring]
+    pair_starts = np.cumsum(n_vert) - n_vert
+    pair_edge = np.repeat(np.arange(len(edge)), n_vert)
+    vert = offsets[edge_ring][pair_edge] + np.arange(n_vert.sum()) - pair_starts[pair_edge]
+    px, py = x[vert], y[vert]
+    u = ux[pair_edge] * px + uy[pair_edge] * py
+    v = -uy[pair_edge] * px + ux[pair_edge] * py
+    width = np.maximum.reduceat(u, pair_starts) - np.minimum.reduceat(u, pair_starts)
+    height = np.maximum.reduceat(v, pair_starts) - np.minimum.reduceat(v, pair_starts)
+    area = np.where(length > 0, width * height, np.inf)
+
+    # first edge of least area in each ring
+    least = np.minimum.reduceat(area, offsets[:-1] - np.arange(n))
+    best = np.flatnonzero(area == least[edge_ring])
+    best = best[np.unique(edge_ring[best], return_index=True)[1]]
+    result[is_polygon] = np.minimum(width[best], height[best])
+    return result
+
+
 # ============================================================
 # Pre process fns 
 # ============================================================
@@ -108,12 +243,13 @@ def update_outbuildings(test):
 
 
 def update_avgfloor_count_outliers(df, MIN_THRESH_FL_HEIGHT=2.3, MAX_THRESHOLD_FLOOR_HEIGHT=5.3):
-    df['min_side'] = df['geometry'].astype(object).apply(min_side)
+    df['min_side'] = min_sides(df['geometry'].values)
     df['threex_minside'] = [x * 3 for x in df['min_side']]
     
     # Update height validation to include new constraint for heights < 2m with floor count
+    # a footprint with no min_side (degenerate convex hull) cannot validate its height
     df['validated_height'] = np.where(
-        (df['height_numeric'] >= df['threex_minside']) | 
+        (df['height_numeric'] >= df['threex_minside']) | df['min_side'].isna() |
         ((df['height_numeric'] < 2) & df['floor_count_numeric'].notna()),
         np.nan,
         df['height_numeric']
@@ -130,45 +266,60 @@ def update_avgfloor_count_outliers(df, MIN_THRESH_FL_HEIGHT=2.3, MAX_THRESHOLD_F
     return df
 
 
-def fill_local_averages(df):
+def fill_local_averages(df, by=None):
+    """
+    Fill invalid floor counts and heights with the mean of the valid ones in the same group (postcode).
+    by: column of group labels, None to treat df as a single group
+    Groups with no valid floor count or height, or a single building, get a local_fill_status of why instead of
+    'ok'; invalid values they cannot fill stay null.
+    """
     logger.debug('starting to fill local averages')
-    num_builds = len(df )
+    groups = df.groupby(np.zeros(len(df)) if by is None else df[by], sort=False, dropna=False)
 
-    num_fc_invalid = df.validated_fc.isna().sum() 
-    num_h_invalid = df.validated_height.isna().sum() 
+    fc_fla = groups['validated_fc'].transform('mean')
+    height_fla = groups['validated_height'].transform('mean')
 
-    if num_builds - num_fc_invalid ==0 | len(df)==1 | num_builds - num_h_invalid == 0 : 
-        print('Cannot do local fill for FC')
-        # height_fla = df[~df['validated_height'].isna()]['validated_height'].mean()
-        raise Exception('no local fill ')
+    df['local_fill_status'] = np.select(
+        [groups['validated_fc'].transform('count') == 0,
+         groups['validated_fc'].transform('size') == 1,
+         groups['validated_height'].transform('count') == 0],
+        [NO_VALID_FC, SINGLE_BUILDING, NO_VALID_HEIGHT],
+        default='ok'
+    )
+    if (df['local_fill_status'] != 'ok').any():
+        logger.debug('Cannot do local fill for some buildings')
 
-    fc_fla= df[~df['validated_fc'].isna()]['validated_fc'].mean()
-    
-    height_fla = df[~df['validated_height'].isna()]['validated_height'].mean()
-    
     df['fc_filled'] = np.where(df['validated_fc'].isna(), fc_fla, df['validated_fc'])
     df['height_filled'] = np.where(df['validated_height'].isna(), height_fla, df['validated_height'] )
-    df = create_height_bucket_cols(df, 'height_filled')
+    df = create_height_bucket_cols(df, 'height_filled', labels=False)
     logger.debug('Fill local averages complete')
     return df 
 
 def fill_glob_avs(df, fc = None  ):
+    """
+    Global average floor count of each building by map_simple_use, premise_age_bucketed and height bucket,
+    gathered from the dense lookup table by category codes. The height bucket is height_filled_bucket_code, or
+    the height_filled_bucket labels when a frame only has those.
+    fc: global average floor count table, None for the one in global_avs (loaded once per process)
+    """
     logger.debug('Starting to fill global averages')
-    if fc is None:
-        fc = load_avg_floor_count() 
-    
-    fc['height_bucket'] = fc['height_bucket'].astype('object')
-    df['height_filled_bucket'] = df['height_filled_bucket'].astype('object')
-    
-    logger.debug('Starting checks before global average merge')
-    check_merge_files(fc, df, 'map_simple_use', 'map_simple_use')
-    check_merge_files(fc, df, 'height_bucket', 'height_filled_bucket')
-    check_merge_files(fc, df, 'premise_age_bucketed', 'premise_age_bucketed')
-    
-    df = df.merge(fc, left_on=['map_simple_use', 'premise_age_bucketed',  'height_filled_bucket'], right_on = [ 'map_simple_use', 'premise_age_bucketed', 'height_bucket'], how='left')
     if df.empty:
         raise Exception ('Error merging with global averages')
-    df.drop(columns=[ 'height_bucket','total_count'], inplace=True )
+    lut = load_global_averages() if fc is None else global_average_lut(fc)
+
+    use = pd.Categorical(df['map_simple_use'], categories=lut.uses).codes
+    age = pd.Categorical(df['premise_age_bucketed'], categories=lut.ages).codes
+    if 'height_filled_bucket_code' in df.columns:
+        height = df['height_filled_bucket_code'].values
+    else:
+        height = pd.Categorical(df['height_filled_bucket'], categories=lut.heights).codes
+    found = (use >= 0) & (age >= 0) & (height >= 0)
+    floorcount = np.full(len(df), np.nan)
+    floorcount[found] = lut.floorcount[use[found], age[found], height[found]]
+
+    # a fresh index, as the merge this replaces gave
+    df = df.reset_index(drop=True)
+    df['global_average_floorcount'] = floorcount
     logger.debug('global average fill complete')
     return df 
 
@@ -225,8 +376,8 @@ def create_basement_metrics(df):
     df['basement_heated_vol'] = df['base_floor'] *  df['premise_area'] * BASEMENT_HEIGHT * BASEMENT_PERCENTAGE_OF_PREMISE_AREA 
     return df 
 
-def pre_process_buildings(df, fc,  MIN_THRESH_FL_HEIGHT = 2.3, MAX_THRESH_FL_HEIGHT= 5.3):
-    """ can only be applied   to a group where you want the local average within the group
+def pre_process_buildings(df, fc,  MIN_THRESH_FL_HEIGHT = 2.3, MAX_THRESH_FL_HEIGHT= 5.3, by=None):
+    """ local averages are taken within the group, the whole df or each group of the by column (postcode)
     - bcuekts age (turns all pre into pre 1919
     - updat listed into numeric / encoded
     - update outbuilds: for those with heht 3 storey 2 uprn 0 -> outbuildings 
@@ -251,7 +402,7 @@ def pre_process_buildings(df, fc,  MIN_THRESH_FL_HEIGHT = 2.3, MAX_THRESH_FL_HEI
     df=update_listed_type(df)
     df=update_outbuildings(df)
     df=update_avgfloor_count_outliers(df, MIN_THRESH_FL_HEIGHT, MAX_THRESH_FL_HEIGHT)
-    df=fill_local_averages(df)
+    df=fill_local_averages(df, by)
     df=fill_glob_avs(df, fc)
     df = create_heated_vol(df)
     df = create_basement_metrics(df)
@@ -311,18 +462,82 @@ def test_building_metrics(df):
     assert_larger(test, 'height', 'height_filled')
 
 
-def pre_process_building_data(build,  MIN_THRESH_FL_HEIGHT = 2.3, MAX_THRESH_FL_HEIGHT= 5.3):
+def combined_profile(profiles):
+    """The profile covering every one of profiles, the last of them in PRE_PROCESS_PROFILES."""
+    unknown = [p for p in profiles if p not in PRE_PROCESS_PROFILES]
+    if unknown:
+        raise ValueError(f'Unknown pre processing profiles: {unknown}, expected some of {PRE_PROCESS_PROFILES}')
+    return max(profiles, key=PRE_PROCESS_PROFILES.index)
+
+
+def pre_process_attributes(df):
+    """The attributes profile: age buckets and outbuildings of pre_process_buildings, no geometry needed."""
+    df = create_age_buckets(df)
+    df = update_outbuildings(df)
+    if df.empty:
+        raise Exception('Error empty df ')
+    return df
+
+
+def pre_process_building_data(build,  MIN_THRESH_FL_HEIGHT = 2.3, MAX_THRESH_FL_HEIGHT= 5.3, by=None,
+                              profile=VOLUMETRICS):
     # print(MIN_THRESH_FL_HEIGHT,MAX_THRESH_FL_HEIGHT )
-    """Calculate and validate building metrics from verisk data."""
+    """Calculate and validate building metrics from verisk data. by: group column for local averages, see pre_process_buildings
+    profile: ATTRIBUTES or VOLUMETRICS, the steps to run (see PRE_PROCESS_PROFILES)"""
+
+    combined_profile([profile])
+    if profile == ATTRIBUTES:
+        logger.debug('Starting to pre process building attributes')
+        return pre_process_attributes(build)
 
     logger.debug(f'Starting to pre process buildingd data, for min threhold floor height: {MIN_THRESH_FL_HEIGHT} and max threshold floor height: {MAX_THRESH_FL_HEIGHT} ')
     
-    fc = load_avg_floor_count() 
-    logger.debug('Loaded average floor count global averages ')
-    
-   
-    processed_df = pre_process_buildings(build, fc , MIN_THRESH_FL_HEIGHT, MAX_THRESH_FL_HEIGHT)
+    # global averages from the table loaded once per process
+    processed_df = pre_process_buildings(build, None, MIN_THRESH_FL_HEIGHT, MAX_THRESH_FL_HEIGHT, by)
     
     clean_df = produce_clean_building_data(processed_df)
     
-    return clean_df
\ No newline at end of file
+    return clean_df
+
+
+def pre_process_postcode_buildings(uprn_match, profile=VOLUMETRICS):
+    """Pre process one postcode's buildings. None if it has none, raises if pre processing drops rows."""
+    if uprn_match is None or uprn_match.empty:
+        return None
+    df = pre_process_building_data(uprn_match, profile=profile)
+    if len(df) != len(uprn_match):
+        raise ValueError('Data loss during pre-processing')
+    return df
+
+
+def pre_process_subbatch_buildings(pc_buildings, columns, profile=VOLUMETRICS):
+    """
+    Pre process a sub-batch's buildings in one call, with local averages per postcode.
+    pc_buildings: dict of postcode -> buildings as retrieved (None for postcodes without any)
+    columns: pre processed columns to keep
+    profile: pre processing steps to run, see PRE_PROCESS_PROFILES
+    Returns: DataFrame of the buildings with a 'postcode' column (see stack_postcode_buildings)
+    """
+    stacked = stack_postcode_buildings(pc_buildings)
+    if stacked.empty:
+        return pd.DataFrame(columns=list(columns) + ['postcode'])
+    df = pre_process_building_data(stacked, by='postcode', profile=profile)
+    if len(df) != len(stacked):
+        raise ValueError('Data loss during pre-processing')
+    return df[list(columns) + ['postcode']]
+
+
+def retrieve_subbatch_buildings(pc_batch, data, input_gpk, columns, batch_columns, profile=VOLUMETRICS,
+                                retrieval='batch', retrieval_context=None):
+    """
+    Retrieve and pre process a sub-batch's buildings, ready for the theme summaries.
+    columns: building columns to read (see building_columns)
+    batch_columns, profile: as for pre_process_subbatch_buildings
+    retrieval, retrieval_context: as for find_data_subbatch
+    Returns: (stripped postcodes of the sub-batch, pre processed buildings with a 'postcode' column)
+    """
+    batch_buildings = find_data_subbatch(pc_batch, data, input_gpk, retrieval, retrieval_context, columns=columns)
+    pcs = [pc.strip() for pc in pc_batch]
+    pc_buildings = {pc: get_pc_buildings(pc, data, input_gpk, batch_buildings, columns=columns, retrieval=retrieval)
+                    for pc in pcs}
+    return pcs, pre_process_subbatch_buildings(pc_buildings, batch_columns, profile)
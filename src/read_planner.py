@@ -0,0 +1,83 @@
+"""
+Module: read_planner.py
+Description: Plans building reads for postcodes whose bbox is a poor fit to the postcode polygon.
+
+find_data_pc_joint reads every building in the postcode bbox. For long, thin or L shaped rural and edge of town
+postcodes that box is mostly unrelated land and pulls in tens of thousands of buildings, and a few such postcodes
+dominate a batch's run time. The planner covers the polygon with a small set of tight boxes (a quadtree cover) so
+the spatial half of the join only reads those. The UPRN half is read by attribute, see
+postcode_utils.find_data_pc_covered.
+
+Key features
+ - read amplification = area read / postcode polygon area, logged before (bbox) and after (cover)
+ - postcodes whose bbox is already tight keep the single bbox read
+"""
+
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+# bbox at least this many times the polygon area before a cover is planned
+AMPLIFICATION_THRESHOLD = 4.0
+# stop splitting a quadtree cell once the polygon fills this share of its tight box
+MIN_FILL = 0.5
+MAX_DEPTH = 4
+
+
+def quadtree_cover(polygon, max_depth=MAX_DEPTH, min_fill=MIN_FILL):
+    """
+    Cover a polygon with disjoint boxes: split its bbox into quadrants, shrink each to the part of the polygon
+    inside it, and keep splitting boxes the polygon fills poorly.
+    """
+    if not polygon.is_valid:
+        polygon = polygon.buffer(0)
+    boxes = []
+
+    def split(cell, depth):
+        part = polygon.intersection(cell)
+        if part.is_empty:
+            return
+        tight = box(*part.bounds)
+        if depth == max_depth or tight.area == 0 or part.area / tight.area >= min_fill:
+            boxes.append(tight)
+            return
+        minx, miny, maxx, maxy = tight.bounds
+        midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+        for quadrant in [box(minx, miny, midx, midy), box(midx, miny, maxx, midy),
+                         box(minx, midy, midx, maxy), box(midx, midy, maxx, maxy)]:
+            split(quadrant, depth + 1)
+
+    split(box(*polygon.bounds), 0)
+    return boxes
+
+
+def read_amplification(polygon, boxes):
+    """Area read over polygon area."""
+    if polygon.area == 0:
+        return float('inf')
+    return sum(b.area for b in boxes) / polygon.area
+
+
+def plan_postcode_read(pc, geoms, threshold=AMPLIFICATION_THRESHOLD):
+    """
+    Plan the spatial read for one postcode.
+    geoms: the postcode's polygon(s) from the postcode shapefile
+    Returns list of boxes to read, or None to keep the single bbox read.
+    """
+    polygon = unary_union(list(geoms))
+    bbox = box(*polygon.bounds)
+    before = read_amplification(polygon, [bbox])
+    if before < threshold:
+        logger.debug(f'Postcode {pc}: read amplification {before:.1f}x, bbox read')
+        return None
+
+    boxes = quadtree_cover(polygon)
+    after = read_amplification(polygon, boxes)
+    if after * 2 > before:
+        logger.debug(f'Postcode {pc}: read amplification {before:.1f}x, cover only {after:.1f}x, bbox read')
+        return None
+    logger.info(f'Postcode {pc}: read amplification {before:.1f}x -> {after:.1f}x with {len(boxes)} boxes')
+    return boxes
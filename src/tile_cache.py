@@ -0,0 +1,204 @@
+"""
+Module: tile_cache.py
+Description: Tile based LRU cache in front of bbox building reads.
+
+Neighbouring postcodes in a batch have heavily overlapping bboxes, so find_data_pc_joint reads the same
+buildings from the building file again and again. The cache splits British National Grid into fixed tiles
+(500m by default) and serves each bbox / mask read from the tiles it covers, reading only the tiles it has not
+seen yet in one read.
+
+Key features
+ - a building is kept in every tile its bbox touches, with its row in the building file; tiles are combined
+   by dropping repeated rows and sorting on it, so a read returns read_buildings' rows in file order
+ - least recently used tiles are evicted once the cached buildings pass a memory budget, estimated from
+   memory_usage and the footprint coordinates
+ - hit / miss / eviction counters, to size the tile size and budget for a batch
+ - has the same read(bbox, mask, columns) call as read_buildings, so it can be passed anywhere INPUT_GPK is
+ - tiles hold the columns of the theme's column manifest, a read with a different manifest starts afresh
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from .building_store import bounds_intersect, bounds_within
+from .building_schema import apply_building_schema
+from .postcode_utils import read_buildings
+from .logging_config import get_logger
+logger = get_logger(__name__)
+
+
+DEFAULT_TILE_SIZE = 500
+# leaves room in the 8G job limit (nebula_job.sh) for ONSUD, postcode shapefiles and fuel data
+DEFAULT_MEMORY_MB = 2048
+# row of each cached building in the building file
+ROW_ID_COL = '_file_row'
+
+
+# memory of one x, y coordinate, and the coordinates assumed per footprint where they cannot be counted
+BYTES_PER_VERTEX = 16
+DEFAULT_VERTICES = 10
+
+
+def vertex_counts(geoms):
+    """
+    Coordinates of each geometry, counted in one vectorised call with shapely 2. The pinned shapely 1.8 has no
+    vectorised count, so every footprint is taken to have DEFAULT_VERTICES rather than looping over them.
+    """
+    if hasattr(shapely, 'get_num_coordinates'):
+        return shapely.get_num_coordinates(np.asarray(geoms.values))
+    return np.full(len(geoms), DEFAULT_VERTICES)
+
+
+def estimate_row_bytes(buildings):
+    """Approximate memory held by each row of a frame of buildings, from memory_usage plus its coordinates."""
+    frame_bytes = buildings.memory_usage(deep=True, index=False).sum()
+    per_row = frame_bytes / len(buildings) if len(buildings) else 0
+    return per_row + BYTES_PER_VERTEX * vertex_counts(buildings.geometry)
+
+
+class TileCache:
+    """
+    LRU cache of building reads, keyed on a fixed grid of BNG tiles.
+
+    Args:
+        input_gpk: Building file to read from (GeoPackage or building store)
+        tile_size: Tile edge length in metres
+        memory_mb: Budget for cached buildings, least recently used tiles are evicted past this
+    """
+
+    def __init__(self, input_gpk, tile_size=DEFAULT_TILE_SIZE, memory_mb=DEFAULT_MEMORY_MB):
+        self.input_gpk = input_gpk
+        self.tile_size = tile_size
+        self.max_bytes = memory_mb * 1024 ** 2
+        self.tiles = OrderedDict()
+        self.tile_bytes = {}
+        self.total_bytes = 0
+        self.template = None
+        self.columns = None
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return f'TileCache({self.input_gpk}, tile_size={self.tile_size})'
+
+    def tile_range(self, bounds):
+        """Tile keys (ix, iy) covering a bbox."""
+        minx, miny, maxx, maxy = bounds
+        ix = range(int(np.floor(minx / self.tile_size)), int(np.floor(maxx / self.tile_size)) + 1)
+        iy = range(int(np.floor(miny / self.tile_size)), int(np.floor(maxy / self.tile_size)) + 1)
+        return [(x, y) for x in ix for y in iy]
+
+    def tile_box(self, key):
+        x, y = key
+        return box(x * self.tile_size, y * self.tile_size, (x + 1) * self.tile_size, (y + 1) * self.tile_size)
+
+    def load_tiles(self, keys):
+        """Read the buildings for a set of missing tiles in one read and split them out per tile."""
+        buildings = read_buildings(self.input_gpk, mask=unary_union([self.tile_box(k) for k in keys]),
+                                   columns=self.columns, row_id_col=ROW_ID_COL)
+        self.reads += 1
+        if self.template is None:
+            self.template = buildings.iloc[:0]
+
+        # every tile a building's bbox touches, so a later read of any of them finds it: the (ix, iy) tile ranges of
+        # all buildings expanded to (row, tile) pairs, then grouped by tile
+        bounds = buildings.bounds.values
+        ix0, iy0, ix1, iy1 = np.floor(bounds / self.tile_size).astype(np.int64).T
+        nx, ny = ix1 - ix0 + 1, iy1 - iy0 + 1
+        n_tiles = nx * ny
+        rows = np.repeat(np.arange(len(buildings)), n_tiles)
+        offset = np.arange(len(rows)) - np.repeat(np.cumsum(n_tiles) - n_tiles, n_tiles)
+        tile_x = np.repeat(ix0, n_tiles) + offset // np.repeat(ny, n_tiles)
+        tile_y = np.repeat(iy0, n_tiles) + offset % np.repeat(ny, n_tiles)
+
+        # only the requested tiles are filled, in building order within each tile
+        codes = pd.MultiIndex.from_tuples(keys).get_indexer(pd.MultiIndex.from_arrays([tile_x, tile_y]))
+        found = codes >= 0
+        rows, codes = rows[found], codes[found]
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(keys))
+        ends = np.cumsum(counts)
+        row_bytes = estimate_row_bytes(buildings)
+
+        # tiles hold (buildings, their bounds) so reads filter on bounds without touching the geometries
+        loaded = {}
+        for key, start, end in zip(keys, ends - counts, ends):
+            tile_rows = rows[order[start:end]]
+            tile = (buildings.iloc[tile_rows] if len(tile_rows) else self.template, bounds[tile_rows].reshape(-1, 4))
+            loaded[key] = tile
+            self.tiles[key] = tile
+            self.tile_bytes[key] = int(row_bytes[tile_rows].sum())
+            self.total_bytes += self.tile_bytes[key]
+        return loaded
+
+    def clear(self):
+        self.tiles.clear()
+        self.tile_bytes.clear()
+        self.total_bytes = 0
+        self.template = None
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.tiles:
+            key, _ = self.tiles.popitem(last=False)
+            self.total_bytes -= self.tile_bytes.pop(key)
+            self.evictions += 1
+
+    def read(self, bbox=None, mask=None, columns=None):
+        """Buildings intersecting a bbox or mask geometry, the same rows in the same order as read_buildings."""
+        geom = mask if mask is not None else bbox
+        if geom is None:
+            raise ValueError('TileCache reads need a bbox or a mask')
+        if columns != self.columns:
+            self.clear()
+            self.columns = columns
+        if not hasattr(geom, 'bounds'):
+            geom = box(*geom)
+
+        keys = self.tile_range(geom.bounds)
+        tiles = {}
+        for key in keys:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                tiles[key] = self.tiles[key]
+        self.hits += len(tiles)
+
+        missing = [k for k in keys if k not in tiles]
+        if missing:
+            self.misses += len(missing)
+            tiles.update(self.load_tiles(missing))
+            self.evict()
+
+        # bbox prefilter per tile, then a geometry test only for buildings not already inside a rectangular query
+        is_rectangle = geom.equals(box(*geom.bounds))
+        candidates = []
+        for key in keys:
+            buildings, bounds = tiles[key]
+            keep = bounds_intersect(bounds, geom.bounds)
+            check = np.flatnonzero(keep & ~bounds_within(bounds, geom.bounds)) if is_rectangle else np.flatnonzero(keep)
+            if len(check):
+                keep[check] = buildings.geometry.iloc[check].intersects(geom).values
+            candidates.append(buildings.iloc[np.flatnonzero(keep)])
+        buildings = pd.concat(candidates).drop_duplicates(ROW_ID_COL).sort_values(ROW_ID_COL)
+        return apply_building_schema(buildings.drop(columns=ROW_ID_COL).reset_index(drop=True))
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'tiles_cached': len(self.tiles),
+            'cached_mb': round(self.total_bytes / 1024 ** 2, 1),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / requests, 3) if requests else 0.0,
+            'reads': self.reads,
+            'evictions': self.evictions,
+        }
+
+    def log_stats(self):
+        logger.info(f'Tile cache stats: {self.stats()}')
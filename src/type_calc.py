@@ -1,7 +1,9 @@
 
 
-from .pre_process_buildings import pre_process_building_data 
-from .postcode_utils import check_duplicate_primary_key , find_data_pc_joint
+from .pre_process_buildings import pre_process_postcode_buildings, PRE_PROCESS_PROFILE_COLUMNS, ATTRIBUTES
+from .building_schema import PREMISE_TYPES
+from .postcode_utils import (check_duplicate_primary_key , find_data_pc_joint, get_pc_buildings, building_columns,
+                             residential_category_counts)
 import numpy as np
 import pandas as pd
 import sys 
@@ -10,6 +12,15 @@ import numpy as np
 from .logging_config import get_logger
 logger = get_logger(__name__)
 
+# pre processing the typology theme needs: premise types with outbuildings, no geometry or floor count maths
+TYPE_PROFILE = ATTRIBUTES
+# building columns the typology theme reads
+TYPE_COLUMNS = building_columns(PRE_PROCESS_PROFILE_COLUMNS[TYPE_PROFILE], ['premise_use', 'premise_type'])
+# pre processed building columns summarise_buildtype_batch uses
+TYPE_BATCH_COLUMNS = ['upn', 'premise_use', 'premise_type']
+# premise types in the log file, in column order
+PREM_TYPES = PREMISE_TYPES
+
 
 def calc_counts_of_premise_type(df, prem_types):
     """
@@ -23,6 +34,8 @@ def calc_counts_of_premise_type(df, prem_types):
     # Calculate the count of each type and normalize to get percentages
     df=df[df['premise_use']=='Residential']
     all_premise_types = df['premise_type'].value_counts()
+    # a Categorical column counts every category, keep the types present as an object column would
+    all_premise_types = all_premise_types[all_premise_types > 0]
     nn =  df[df['premise_type'].isna()]
     # Filter to keep only the specified premise types
     filtered_premise_types = all_premise_types[all_premise_types.index.isin(prem_types)]
@@ -36,7 +49,7 @@ def calc_res_clean_counts(df):
     return len(res)
 
 
-def process_postcode_buildtype(pc, onsud_data,  INPUT_GPK, overlap = False, batch_dir=None, path_to_pcshp=None  ):
+def process_postcode_buildtype(pc, onsud_data,  INPUT_GPK, overlap = False, batch_dir=None, path_to_pcshp=None, batch_buildings=None):
     """Process one postcode, deriving building attributes and electricity and fuel info.
     
     Inputs: 
@@ -49,29 +62,20 @@ def process_postcode_buildtype(pc, onsud_data,  INPUT_GPK, overlap = False, batc
     overlap: bool, is this for the overlapping postcodes? 
     batch_dir = needed for overlap - where are the batche stored?
     path_to_schp: path to postcode shapefiles location , needed for overlap 
+    batch_buildings: optional output of find_data_pc_batch for the sub-batch, avoids a per postcode read
     """
-    prem_types = ['Medium height flats 5-6 storeys',
-    'Small low terraces',
-    '3-4 storey and smaller flats',
-    'Tall terraces 3-4 storeys',
-    'Large semi detached',
-    'Standard size detached',
-    'Standard size semi detached',
-    '2 storeys terraces with t rear extension',
-    'Semi type house in multiples',
-    'Tall flats 6-15 storeys',
-    'Large detached',
-    'Very tall point block flats',
-    'Very large detached',
-    'Planned balanced mixed estates',
-    'Linked and step linked premises',
-    'Domestic outbuilding',
-    'Unknown'
-    ]
+    pc = pc.strip() 
+    uprn_match= get_pc_buildings(pc, onsud_data, INPUT_GPK, batch_buildings, columns=TYPE_COLUMNS)
+    return summarise_buildtype(pc, uprn_match, pre_process_postcode_buildings(uprn_match, TYPE_PROFILE))
 
 
-    pc = pc.strip() 
-    uprn_match= find_data_pc_joint(pc, onsud_data, input_gpk=INPUT_GPK)
+def summarise_buildtype(pc, uprn_match, df):
+    """Typology attributes for one postcode.
+    uprn_match: the postcode's buildings as retrieved
+    df: the same buildings after pre_process_postcode_buildings (None if there are none)
+    """
+    prem_types = PREM_TYPES
+
     dc_full = {'postcode': pc  }
 
     for val in prem_types:
@@ -79,13 +83,10 @@ def process_postcode_buildtype(pc, onsud_data,  INPUT_GPK, overlap = False, batc
     dc_full['len_res'] = np.nan 
     dc_full['None_type'] = np.nan
 
-    if uprn_match.empty or   uprn_match is None:
+    if df is None:
         logger.debug('Empty uprn match')
         
     else:
-        df  = pre_process_building_data(uprn_match)    
-        if len(df)!=len(uprn_match):
-            raise Exception('Error in pre process - some cols dropped? ')
         dc = calc_counts_of_premise_type(df, prem_types)
         if df is not None:
             if check_duplicate_primary_key(df, 'upn'):
@@ -98,3 +99,20 @@ def process_postcode_buildtype(pc, onsud_data,  INPUT_GPK, overlap = False, batc
         dc_full.update(dc)
     
     return dc_full
+
+
+def summarise_buildtype_batch(pcs, buildings):
+    """
+    Typology attributes for a whole sub-batch, the same values and log format as summarise_buildtype per postcode,
+    without a value_counts per postcode. PREM_TYPES is the fixed category order of the counts.
+
+    pcs: postcodes in output order
+    buildings: the sub-batch's pre processed buildings with a 'postcode' column (see stack_postcode_buildings),
+        postcodes with no buildings are absent
+    Returns: DataFrame with one row per postcode
+    """
+    if buildings[['postcode', 'upn']].duplicated().any():
+        raise ValueError('Duplicate primary key found for upn')
+
+    premise_type = buildings['premise_type'].values
+    return residential_category_counts(pcs, buildings, premise_type, PREM_TYPES, pd.isna(premise_type), 'None_type')
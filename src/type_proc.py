@@ -1,23 +1,31 @@
 import pandas as pd 
 import os 
-from src.type_calc import process_postcode_buildtype
+from src.type_calc import summarise_buildtype_batch, TYPE_COLUMNS, TYPE_BATCH_COLUMNS, TYPE_PROFILE
+from src.pre_process_buildings import retrieve_subbatch_buildings
 from .logging_config import get_logger
 logger = get_logger(__name__)
 
-def process_type_batch(pc_batch, data, INPUT_GPK, process_batch_name, log_file):
+def process_type_batch(pc_batch, data, INPUT_GPK, process_batch_name, log_file, retrieval='batch', retrieval_context=None):
     logger.debug('Starting batch processing for typology...')
-    # Initialize an empty list to collect results
-    results = []
-    for pc in pc_batch:
-        logger.debug('Processing postcode:', pc)
-        pc_result = process_postcode_buildtype(pc, data, INPUT_GPK)
-        if pc_result is not None:
-            results.append(pc_result)
+    pcs, buildings = retrieve_subbatch_buildings(pc_batch, data, INPUT_GPK, TYPE_COLUMNS, TYPE_BATCH_COLUMNS, TYPE_PROFILE,
+                                                 retrieval, retrieval_context)
+    results = summarise_buildtype_batch(pcs, buildings)
     
     logger.debug(f'Number of processed results: {len(results)}')
     
+    save_type_results(results, log_file, process_batch_name)
+
+
+def run_type_calc(pcs_list, data, INPUT_GPK, batch_size, batch_label, log_file, retrieval='batch', retrieval_context=None):
+    for i in range(0, len(pcs_list) , batch_size):
+        batch = pcs_list[i:i+batch_size]
+        process_type_batch(batch, data, INPUT_GPK, batch_label, log_file, retrieval, retrieval_context)
+
+
+def save_type_results(results, log_file, process_batch_name):
+    """Append a sub-batch of typology results (list of per postcode dicts or a DataFrame) to the log file."""
     # Only proceed if we have results
-    if results:
+    if len(results):
         df = pd.DataFrame(results)
         logger.debug('Saving results to log file...')
         if df.groupby('postcode').size().max() > 1:
@@ -35,9 +43,3 @@ def process_type_batch(pc_batch, data, INPUT_GPK, process_batch_name, log_file):
             df.to_csv(log_file, mode='a', header=False, index=False)
 
         logger.info(f'Log file saved for batch: {process_batch_name}')
-
-
-def run_type_calc(pcs_list, data, INPUT_GPK, batch_size, batch_label, log_file):
-    for i in range(0, len(pcs_list) , batch_size):
-        batch = pcs_list[i:i+batch_size]
-        process_type_batch(batch, data, INPUT_GPK, batch_label, log_file)
@@ -0,0 +1,12 @@
+from src.national_scan import run_national_scan
+from src.postcode_utils import load_ids_from_file
+# Update paths as required
+BUILDING_PATH = '/rds/user/gb669/hpc-work/energy_map/data/building_files/UKBuildings_Edition_15_new_format_upn.gpkg'
+# the postcode shapefiles, or a postcode store made with convert_postcode_store.py
+PC_SHP_PATH = '/rds/user/gb669/hpc-work/energy_map/data/postcode_polygons/codepoint-poly_5267291'
+
+# One pass over the building file for every batch in batch_paths.txt, staged to intermediate_data/scan/.
+# Run once before submitting the theme jobs with RETRIEVAL=scan, which only read the staged buildings
+batch_paths = list(set(load_ids_from_file('batch_paths.txt')))
+run_national_scan(batch_paths, 'intermediate_data', PC_SHP_PATH, BUILDING_PATH)
+print(f'Successfully staged national scan for {len(batch_paths)} batches')
@@ -0,0 +1,91 @@
+import unittest
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+from unittest.mock import patch
+import sys
+sys.path.append('../')
+from src.postcode_utils import find_data_pc_joint, find_data_pc_batch, OnsudData, postcode_rows
+from src.pc_assignment import assign_postcode_batch
+
+
+def make_read_buildings(buildings):
+    """Stand in for the GPKG read: return buildings intersecting the bbox or mask, in file order."""
+    def read(input_gpk, bbox=None, mask=None, columns=None):
+        geom = bbox if bbox is not None else mask
+        return buildings[buildings.intersects(geom)].reset_index(drop=True)
+    return read
+
+
+class TestBatchRetrieval(unittest.TestCase):
+    def setUp(self):
+        pc_geoms = [box(0, 0, 10, 10), box(10, 0, 20, 10), box(40, 40, 50, 50)]
+        self.pcshp = gpd.GeoDataFrame({'POSTCODE': ['AA1 1AA', 'AA1 1AB', 'AA1 1AC'],
+                                       'PC_AREA': ['AA'] * 3}, geometry=pc_geoms)
+        onsud = pd.DataFrame({'UPRN': [1, 2, 3, 4, 5],
+                              'PCDS': ['AA1 1AA', 'AA1 1AA', 'AA1 1AB', 'AA1 1AB', 'AA1 1AC']})
+        self.data = onsud.merge(self.pcshp, left_on='PCDS', right_on='POSTCODE')
+        self.buildings = gpd.GeoDataFrame({
+            'upn': ['a', 'b', 'c', 'd', 'e', 'f'],
+            # 'd' straddles both postcodes, 'e' is UPRN matched but outside the polygon
+            'uprn': [1, np.nan, 3, 2, 4, 5],
+            'premise_type': ['x', 'y', 'z', 'x', 'y', 'z'],
+        }, geometry=[box(1, 1, 2, 2), box(3, 3, 4, 4), box(11, 1, 12, 2),
+                     box(9, 5, 11, 6), box(25, 5, 26, 6), box(41, 41, 42, 42)])
+
+    def test_batch_matches_per_postcode(self):
+        onsdata = (self.data, self.pcshp)
+        pcs = ['AA1 1AA', 'AA1 1AB ', 'AA1 1AC', 'ZZ1 1ZZ']
+        with patch('src.postcode_utils.read_buildings', side_effect=make_read_buildings(self.buildings)):
+            batch = find_data_pc_batch(pcs, onsdata, 'dummy.gpkg')
+            for pc in pcs:
+                pc = pc.strip()
+                expected = find_data_pc_joint(pc, onsdata, 'dummy.gpkg')
+                if expected is None:
+                    self.assertIsNone(batch[pc])
+                else:
+                    pd.testing.assert_frame_equal(batch[pc], expected)
+
+    def test_single_read_per_batch(self):
+        onsdata = (self.data, self.pcshp)
+        with patch('src.postcode_utils.read_buildings', side_effect=make_read_buildings(self.buildings)) as reader:
+            find_data_pc_batch(['AA1 1AA', 'AA1 1AB', 'AA1 1AC'], onsdata, 'dummy.gpkg')
+        self.assertEqual(reader.call_count, 1)
+
+    def test_straddling_building_uprn_match(self):
+        onsdata = (self.data, self.pcshp)
+        with patch('src.postcode_utils.read_buildings', side_effect=make_read_buildings(self.buildings)):
+            batch = find_data_pc_batch(['AA1 1AA', 'AA1 1AB'], onsdata, 'dummy.gpkg')
+        self.assertEqual(sorted(batch['AA1 1AA']['upn']), ['a', 'b', 'd'])
+        self.assertEqual(sorted(batch['AA1 1AB']['upn']), ['c'])
+
+    def test_assignment_match_types(self):
+        onsdata = (self.data, self.pcshp)
+        with patch('src.postcode_utils.read_buildings', side_effect=make_read_buildings(self.buildings)):
+            assigned = assign_postcode_batch(['AA1 1AA', 'AA1 1AB', 'ZZ1 1ZZ'], onsdata, 'dummy.gpkg')
+        result = sorted(zip(assigned['upn'], assigned['postcode'], assigned['match_type']))
+        self.assertEqual(result, [('a', 'AA1 1AA', 'uprn'), ('b', 'AA1 1AA', 'spatial'), ('c', 'AA1 1AB', 'uprn'),
+                                  ('d', 'AA1 1AA', 'uprn')])
+
+    def test_grouped_onsud_matches_filters(self):
+        # rows out of postcode order, and a row without a postcode
+        data = pd.concat([self.data.iloc[[4, 0, 2, 1, 3]], self.data.iloc[:1].assign(PCDS=None)])
+        grouped = OnsudData(data, self.pcshp)
+        self.assertEqual(grouped, (data, self.pcshp))
+        for pc in ['AA1 1AA', 'AA1 1AB', 'AA1 1AC', 'ZZ1 1ZZ']:
+            for rows, expected in zip(postcode_rows(grouped, pc), postcode_rows((data, self.pcshp), pc)):
+                pd.testing.assert_frame_equal(rows, expected)
+        with patch('src.postcode_utils.read_buildings', side_effect=make_read_buildings(self.buildings)):
+            pd.testing.assert_frame_equal(find_data_pc_joint('AA1 1AA', grouped, 'dummy.gpkg'),
+                                          find_data_pc_joint('AA1 1AA', (data, self.pcshp), 'dummy.gpkg'))
+            pcs = ['AA1 1AB', 'AA1 1AA', 'ZZ1 1ZZ']
+            batch = find_data_pc_batch(pcs, grouped, 'dummy.gpkg')
+            expected = find_data_pc_batch(pcs, (data, self.pcshp), 'dummy.gpkg')
+        self.assertIsNone(batch['ZZ1 1ZZ'])
+        for pc in pcs[:2]:
+            pd.testing.assert_frame_equal(batch[pc], expected[pc])
+
+
+if __name__ == '__main__':
+    unittest.main()
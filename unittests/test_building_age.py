@@ -6,7 +6,8 @@ import sys
 sys.path.append('/Users/gracecolverd/New_dataset')
 from src.pre_process_buildings import pre_process_building_data
 from src.postcode_utils import check_duplicate_primary_key, find_data_pc_joint
-from src.age_perc_calc import calc_filtered_percentage_of_building_age, calc_res_clean_counts, process_postcode_building_age
+from src.age_perc_calc import (calc_filtered_percentage_of_building_age, calc_res_clean_counts, process_postcode_building_age,
+                               summarise_building_age, summarise_building_age_batch)
 
 class TestBuildingAgeCalculations(unittest.TestCase):
     
@@ -38,6 +39,20 @@ class TestBuildingAgeCalculations(unittest.TestCase):
         expected = 3  # Only three residential premises
         self.assertEqual(result, expected)
 
+    def test_batch_matches_per_postcode(self):
+        other = pd.DataFrame({
+            'premise_use': ['Residential', 'Residential', 'Residential'],
+            'premise_age': ['Unknown date', None, '1919-1944'],
+            'upn': [5, 6, 7]
+        })
+        pc_buildings = {'AB1 1AA': self.df, 'AB1 1AB': other, 'AB1 1AD': None}
+        expected = pd.DataFrame([summarise_building_age(pc, df, None if df is None else df.copy())
+                                 for pc, df in pc_buildings.items()])
+        stacked = pd.concat([self.df.assign(postcode='AB1 1AA'), other.assign(postcode='AB1 1AB')], ignore_index=True)
+        result = summarise_building_age_batch(list(pc_buildings), stacked)
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(result.loc[1, 'None_age'], 2)
+
    
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append('../')
+from src.building_schema import (apply_building_schema, to_categorical, height_bucket_codes, height_bucket_labels,
+                                 PREMISE_TYPES, USES, HEIGHT_BINS, HEIGHT_BUCKETS)
+
+
+class TestBuildingSchema(unittest.TestCase):
+    def test_apply(self):
+        df = pd.DataFrame({'premise_type': ['Large detached', None, 'Domestic outbuilding'],
+                           'map_simple_use': ['Residential', 'Commercial', 'Residential'],
+                           'height': [3.0, 4.0, 5.0]})
+        apply_building_schema(df)
+        self.assertEqual(list(df['premise_type'].cat.categories), PREMISE_TYPES)
+        self.assertEqual(list(df['map_simple_use'].cat.categories), USES)
+        self.assertTrue(df['premise_type'].isna().iloc[1])
+        self.assertEqual(df['height'].dtype, np.float64)
+        # frames read separately concatenate without falling back to object
+        other = apply_building_schema(pd.DataFrame({'premise_type': ['Unknown'], 'map_simple_use': ['Mixed Use']}))
+        self.assertIsInstance(pd.concat([df, other])['premise_type'].dtype, pd.CategoricalDtype)
+
+    def test_values_outside_categories_kept(self):
+        cat = to_categorical(np.array(['Residential', 'Castle', None], dtype=object), USES, 'premise_use')
+        self.assertEqual(list(cat.astype(object)[:2]), ['Residential', 'Castle'])
+        self.assertEqual(list(cat.categories), USES + ['Castle'])
+
+    def test_height_buckets_match_cut(self):
+        heights = np.array([np.nan, -1, 0, 1.99, 2, 2.5, 20, 21.9, 35, 199.9, 200, 250])
+        codes = height_bucket_codes(heights)
+        expected = pd.cut(heights, bins=HEIGHT_BINS, labels=HEIGHT_BUCKETS, right=False)
+        np.testing.assert_array_equal(codes, expected.codes)
+        self.assertTrue(height_bucket_labels(codes).equals(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
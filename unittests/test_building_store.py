@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+import sys
+sys.path.append('../')
+from src.building_store import convert_gpkg_to_store, read_building_store, hilbert_index, is_building_store, gather_by_key, has_key_index
+
+
+class TestHilbertIndex(unittest.TestCase):
+    def test_order_one_curve(self):
+        # 2x2 grid visited (0,0) -> (0,1) -> (1,1) -> (1,0)
+        d = hilbert_index([0, 0, 1, 1], [0, 1, 1, 0], extent=(0, 0, 2, 2), order=1)
+        np.testing.assert_array_equal(d, [0, 1, 2, 3])
+
+    def test_unique_on_grid(self):
+        xs, ys = np.meshgrid(np.arange(8), np.arange(8))
+        d = hilbert_index(xs.ravel(), ys.ravel(), extent=(0, 0, 8, 8), order=3)
+        self.assertEqual(len(np.unique(d)), 64)
+
+
+class TestBuildingStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        pcshp = gpd.GeoDataFrame({'POSTCODE': ['A1 1AA', 'A1 1AB', 'AB1 1AA'], 'PC_AREA': ['A', 'A', 'AB']},
+                                 geometry=[box(0, 0, 50, 100), box(50, 0, 100, 100), box(100, 0, 200, 100)],
+                                 crs='EPSG:27700')
+        os.makedirs(os.path.join(cls.tmp, 'pcshp/one_letter_pc_code/a'))
+        os.makedirs(os.path.join(cls.tmp, 'pcshp/two_letter_pc_code'))
+        pcshp[pcshp.PC_AREA == 'A'].to_file(os.path.join(cls.tmp, 'pcshp/one_letter_pc_code/a/a.shp'))
+        pcshp[pcshp.PC_AREA == 'AB'].to_file(os.path.join(cls.tmp, 'pcshp/two_letter_pc_code/ab.shp'))
+
+        rng = np.random.default_rng(0)
+        x, y = rng.uniform(0, 220, 60), rng.uniform(0, 100, 60)
+        cls.gpk = os.path.join(cls.tmp, 'buildings.gpkg')
+        gpd.GeoDataFrame({'upn': [f'U{i}' for i in range(60)], 'uprn': np.arange(60) + 1.0,
+                          'premise_type': ['Large detached'] * 60},
+                         geometry=[box(a, b, a + 5, b + 5) for a, b in zip(x, y)],
+                         crs='EPSG:27700').to_file(cls.gpk, driver='GPKG')
+        cls.store = os.path.join(cls.tmp, 'store')
+        cls.manifest = convert_gpkg_to_store(cls.gpk, os.path.join(cls.tmp, 'pcshp'), cls.store,
+                                             chunk_size=25, row_group_size=8)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def test_manifest(self):
+        self.assertTrue(is_building_store(self.store))
+        self.assertFalse(is_building_store(self.gpk))
+        self.assertEqual(self.manifest['n_rows'].sum(), 60)
+        self.assertTrue({'A', 'AB'}.issubset(set(self.manifest['pc_area'])))
+
+    def test_bbox_read_matches_gpkg(self):
+        for bbox in [box(10, 10, 60, 40), box(95, 0, 105, 100), box(0, 0, 300, 300), box(500, 500, 600, 600)]:
+            expected = gpd.read_file(self.gpk, bbox=bbox)
+            result = read_building_store(self.store, bbox=bbox)
+            self.assertEqual(sorted(result['upn']), sorted(expected['upn']))
+            self.assertEqual(list(result.columns), list(expected.columns))
+
+    def test_rows_in_file_order(self):
+        result = read_building_store(self.store, bbox=box(0, 0, 300, 300))
+        self.assertEqual(list(result['upn']), [f'U{i}' for i in range(60)])
+
+    def test_uprn_gather_matches_isin(self):
+        self.assertTrue(has_key_index(self.store, 'uprn'))
+        result = gather_by_key(self.store, [1, 5, 7, 999], 'uprn')
+        self.assertEqual(list(result['upn']), ['U0', 'U4', 'U6'])
+        self.assertEqual(list(result.columns), list(gpd.read_file(self.gpk, rows=1).columns))
+
+    def test_uprn_gather_bbox_restriction(self):
+        bbox = box(10, 10, 60, 40)
+        buildings = gpd.read_file(self.gpk, bbox=bbox)
+        uprns = list(range(1, 61, 2))
+        expected = buildings[buildings['uprn'].isin(uprns)]
+        result = gather_by_key(self.store, uprns, 'uprn', bbox=bbox)
+        self.assertEqual(sorted(result['upn']), sorted(expected['upn']))
+
+    def test_column_projection(self):
+        bbox = box(10, 10, 60, 40)
+        result = read_building_store(self.store, bbox=bbox, columns=['upn', 'uprn'])
+        self.assertEqual(list(result.columns), ['upn', 'uprn', 'geometry'])
+        self.assertEqual(sorted(result['upn']), sorted(gpd.read_file(self.gpk, bbox=bbox)['upn']))
+
+    def test_gather_without_geometry(self):
+        result = gather_by_key(self.store, [1, 5, 7], 'uprn', columns=['upn', 'uprn'])
+        self.assertNotIsInstance(result, gpd.GeoDataFrame)
+        self.assertEqual(list(result.columns), ['upn', 'uprn'])
+        self.assertEqual(list(result['upn']), ['U0', 'U4', 'U6'])
+
+
+if __name__ == '__main__':
+    unittest.main()
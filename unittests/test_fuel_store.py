@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append('../')
+from src.fuel_store import (load_fuel_store, load_fuel_cache, fuel_cache_path, fuel_positions, take_fuel_column,
+                            FuelStore)
+from src.fuel_calc import lookup_fuel_vars
+
+
+class TestFuelStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.csv = os.path.join(self.tmp, 'gas.csv')
+        pd.DataFrame({'Postcode': ['AB1 1AA', 'AB1 1AB', 'AB1 1AA', None], 'Num_meters': [5, 7, 9, 1],
+                      'Total_cons_kwh': [1000.0, 2000.0, 3000.0, 4.0], 'Mean_cons_kwh': [200.0, 300.0, 400.0, 4.0],
+                      'Median_cons_kwh': [190.0, 290.0, 390.0, 4.0], 'Other': ['x'] * 4}).to_csv(self.csv, index=False)
+
+    def test_lookup_and_cache(self):
+        store = load_fuel_store(self.csv)
+        self.assertTrue(os.path.exists(fuel_cache_path(self.csv)))
+        cached = load_fuel_cache(fuel_cache_path(self.csv))
+        self.assertIsInstance(cached.postcodes, np.memmap)
+        for s in [store, cached]:
+            self.assertIsInstance(s, FuelStore)
+            positions = fuel_positions(s, ['AB1 1AB', 'AB1 1AA', 'ZZ9 9ZZ'])
+            np.testing.assert_array_equal(positions >= 0, [True, True, False])
+            # first row of a repeated postcode, as the DataFrame filter's iloc[0]
+            np.testing.assert_array_equal(take_fuel_column(s, 'Num_meters', positions), [7, 5, np.nan])
+            self.assertEqual(take_fuel_column(s, 'Num_meters', positions[:2]).dtype, np.int64)
+
+    def test_exact_match(self):
+        # as the Postcode == pc filter, postcodes only differing in case or spacing do not match
+        store = load_fuel_store(self.csv)
+        positions = fuel_positions(store, ['ab1 1ab', 'AB1  1AB', ' AB1 1AB', 'AB1 1AB ', 'AB1 1AB', ''])
+        np.testing.assert_array_equal(positions >= 0, [False, False, False, False, True, False])
+
+    def test_matches_frame_lookup(self):
+        pcs = ['AB1 1AA', 'XY1 1XY', 'ab1 1aa']
+        from_store, found = lookup_fuel_vars(pcs, 'gas', load_fuel_store(self.csv))
+        from_frame, _ = lookup_fuel_vars(pcs, 'gas', pd.read_csv(self.csv))
+        pd.testing.assert_frame_equal(from_store, from_frame)
+        np.testing.assert_array_equal(found, [True, False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append('../')
+from src.fuel_years import join_fuel_years, run_fuel_year_join, fuel_year_columns
+from src.fuel_store import fuel_store_from_frame
+
+
+def fuel_table(pcs, total):
+    return pd.DataFrame({'Postcode': pcs, 'Num_meters': [5] * len(pcs), 'Total_cons_kwh': total,
+                         'Mean_cons_kwh': [t / 5 for t in total], 'Median_cons_kwh': [t / 6 for t in total]})
+
+
+class TestFuelYears(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.paths = {}
+        for year, total in [(2021, [1000.0, 2000.0]), (2022, [1100.0, 2100.0])]:
+            gas = os.path.join(self.tmp, f'gas_{year}.csv')
+            elec = os.path.join(self.tmp, f'elec_{year}.csv')
+            fuel_table(['AB1 1AA', 'AB1 1AB'], total).to_csv(gas, index=False)
+            fuel_table(['AB1 1AA'], total[:1]).to_csv(elec, index=False)
+            self.paths[year] = (gas, elec)
+        # a fuel log file: building aggregates plus one year of fuel variables
+        self.log = pd.DataFrame({'postcode': ['AB1 1AA', 'AB1 1AB', 'ZZ9 9ZZ'], 'all_types_total_buildings': [3, 1, np.nan],
+                                 'num_meters_gas': [5, 5, np.nan], 'total_gas': [1.0, 2.0, np.nan],
+                                 'avg_gas': [1.0, 2.0, np.nan], 'median_gas': [1.0, 2.0, np.nan],
+                                 'total_elec': [1.0, np.nan, np.nan], 'avg_elec': [1.0, np.nan, np.nan],
+                                 'median_elec': [1.0, np.nan, np.nan], 'num_meters_elec': [5, np.nan, np.nan]})
+
+    def test_join(self):
+        result = join_fuel_years(self.log, self.paths)
+        self.assertEqual(list(result.columns),
+                         ['postcode', 'all_types_total_buildings'] + fuel_year_columns(2021) + fuel_year_columns(2022))
+        np.testing.assert_array_equal(result['total_gas_2021'], [1000.0, 2000.0, np.nan])
+        np.testing.assert_array_equal(result['total_gas_2022'], [1100.0, 2100.0, np.nan])
+        np.testing.assert_array_equal(result['total_elec_2022'], [1100.0, np.nan, np.nan])
+        stores = {2021: tuple(fuel_store_from_frame(pd.read_csv(p)) for p in self.paths[2021])}
+        pd.testing.assert_frame_equal(join_fuel_years(self.log, stores), join_fuel_years(self.log, {2021: self.paths[2021]}))
+
+    def test_run_resumes_and_adds_years(self):
+        os.makedirs(os.path.join(self.tmp, 'fuel', 'NW'))
+        self.log.to_csv(os.path.join(self.tmp, 'fuel', 'NW', '0_log_file.csv'), index=False)
+        out_file = os.path.join(self.tmp, 'fuel_years', 'NW', '0_log_file.csv')
+
+        run_fuel_year_join(self.tmp, {2021: self.paths[2021]})
+        self.assertIn('total_gas_2021', pd.read_csv(out_file).columns)
+        mtime = os.path.getmtime(out_file)
+        run_fuel_year_join(self.tmp, {2021: self.paths[2021]})
+        self.assertEqual(os.path.getmtime(out_file), mtime)
+        run_fuel_year_join(self.tmp, self.paths)
+        self.assertIn('total_gas_2022', pd.read_csv(out_file).columns)
+
+    def test_run_rejoins_updated_log(self):
+        log_file = os.path.join(self.tmp, 'fuel', 'NW', '0_log_file.csv')
+        os.makedirs(os.path.dirname(log_file))
+        self.log.iloc[:2].to_csv(log_file, index=False)
+        out_file = os.path.join(self.tmp, 'fuel_years', 'NW', '0_log_file.csv')
+        run_fuel_year_join(self.tmp, self.paths)
+        self.assertEqual(len(pd.read_csv(out_file)), 2)
+
+        # a resumed fuel run appends to the log file after the join
+        self.log.iloc[2:].to_csv(log_file, mode='a', header=False, index=False)
+        mtime = os.path.getmtime(out_file)
+        os.utime(log_file, (mtime + 1, mtime + 1))
+        run_fuel_year_join(self.tmp, self.paths)
+        self.assertEqual(list(pd.read_csv(out_file)['postcode']), ['AB1 1AA', 'AB1 1AB', 'ZZ9 9ZZ'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append('../')
+from shapely.geometry import box
+from src.pre_process_buildings import (fill_local_averages, fill_glob_avs, global_average_lut, load_avg_floor_count,
+                                       pre_process_subbatch_buildings, combined_profile, ATTRIBUTES, VOLUMETRICS,
+                                       NO_VALID_FC, SINGLE_BUILDING, NO_VALID_HEIGHT)
+
+
+class TestLocalFill(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'postcode': ['AB1 1AA'] * 3 + ['AB1 1AB'] * 2 + ['AB1 1AD'] + ['AB1 1AE'] * 2,
+            'validated_fc': [1.0, np.nan, 3.0, np.nan, np.nan, 2.0, 2.0, 4.0],
+            'validated_height': [3.0, 6.0, np.nan, 5.0, np.nan, 4.0, np.nan, np.nan],
+        })
+
+    def test_grouped_matches_per_group(self):
+        result = fill_local_averages(self.df.copy(), by='postcode')
+        for pc, group in self.df.groupby('postcode', sort=False):
+            expected = fill_local_averages(group.copy())
+            for col in ['fc_filled', 'height_filled', 'local_fill_status']:
+                np.testing.assert_array_equal(result.loc[group.index, col].values, expected[col].values)
+
+    def test_status(self):
+        result = fill_local_averages(self.df.copy(), by='postcode')
+        status = result.groupby('postcode')['local_fill_status'].first()
+        self.assertEqual(status.to_dict(), {'AB1 1AA': 'ok', 'AB1 1AB': NO_VALID_FC, 'AB1 1AD': SINGLE_BUILDING,
+                                            'AB1 1AE': NO_VALID_HEIGHT})
+        self.assertEqual(result.loc[1, 'fc_filled'], 2.0)
+        self.assertEqual(result.loc[2, 'height_filled'], 4.5)
+        self.assertTrue(np.isnan(result.loc[3, 'fc_filled']))
+
+
+class TestGlobalAverageFill(unittest.TestCase):
+    def test_matches_merge(self):
+        fc = load_avg_floor_count()
+        df = pd.DataFrame({'map_simple_use': ['Residential', 'Residential', 'Commercial', 'Residential', None],
+                           'premise_age_bucketed': ['Pre 1919', 'Post 1999', 'Pre 1919', None, 'Pre 1919'],
+                           'height_filled_bucket': pd.Categorical(['5-6m', '10-11m', '5-6m', '5-6m', '5-6m'])},
+                          index=[4, 3, 2, 1, 0])
+        expected = df.astype({'height_filled_bucket': object}).merge(
+            fc, left_on=['map_simple_use', 'premise_age_bucketed', 'height_filled_bucket'],
+            right_on=['map_simple_use', 'premise_age_bucketed', 'height_bucket'], how='left')
+        result = fill_glob_avs(df)
+        np.testing.assert_array_equal(result['global_average_floorcount'].values,
+                                      expected['global_average_floorcount'].values)
+        self.assertEqual(list(result.index), list(range(5)))
+        self.assertTrue(result['global_average_floorcount'].iloc[:2].notna().all())
+
+    def test_validation(self):
+        fc = load_avg_floor_count()
+        with self.assertRaises(ValueError):
+            global_average_lut(pd.concat([fc, fc.iloc[:1]]))
+        with self.assertRaises(ValueError):
+            global_average_lut(fc.drop(columns=['height_bucket']))
+
+
+class TestPreProcessProfiles(unittest.TestCase):
+    def buildings(self):
+        return pd.DataFrame({'upn': ['U1', 'U2', 'U3'], 'premise_use': ['Residential'] * 3,
+                             'premise_age': ['Pre 1837', '1960-1979', None],
+                             'premise_type': ['Large detached', 'Small low terraces', 'Large detached'],
+                             'height': [3.0, 6.0, 9.0], 'premise_floor_count': ['2', '2', '3'],
+                             'uprn_count': [0, 1, 1], 'listed_grade': [None] * 3, 'map_simple_use': ['Residential'] * 3,
+                             'premise_area': [40.0, 60.0, 80.0], 'basement': ['No basement'] * 3,
+                             'geometry': [box(0, 0, 8, 5), box(10, 0, 20, 6), box(30, 0, 40, 8)]})
+
+    def test_attributes_match_volumetrics(self):
+        columns = ['upn', 'premise_age', 'premise_age_bucketed', 'premise_type']
+        pc_buildings = {'AB1 1AA': self.buildings().iloc[:2], 'AB1 1AB': self.buildings().iloc[2:], 'AB1 1AC': None}
+        full = pre_process_subbatch_buildings({pc: None if b is None else b.copy() for pc, b in pc_buildings.items()},
+                                              columns, VOLUMETRICS)
+        # no geometry, floor count or area columns needed
+        attributes = pre_process_subbatch_buildings(
+            {pc: None if b is None else b[['upn', 'premise_age', 'premise_type', 'height', 'premise_floor_count',
+                                           'uprn_count']].copy() for pc, b in pc_buildings.items()},
+            columns, ATTRIBUTES)
+        pd.testing.assert_frame_equal(attributes.reset_index(drop=True), full.reset_index(drop=True))
+        self.assertEqual(attributes['premise_type'].iloc[0], 'Domestic outbuilding')
+
+    def test_combined_profile(self):
+        self.assertEqual(combined_profile([ATTRIBUTES, ATTRIBUTES]), ATTRIBUTES)
+        self.assertEqual(combined_profile([ATTRIBUTES, VOLUMETRICS]), VOLUMETRICS)
+        with self.assertRaises(ValueError):
+            combined_profile(['geometry'])
+
+
+if __name__ == '__main__':
+    unittest.main()
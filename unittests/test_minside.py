@@ -1,9 +1,10 @@
 import unittest
 import numpy as np
-from shapely.geometry import Polygon
+import pandas as pd
+from shapely.geometry import Polygon, MultiPolygon, Point
 import sys 
 sys.path.append('../')
-from src.pre_process_buildings import min_side  
+from src.pre_process_buildings import min_side, min_sides, update_avgfloor_count_outliers
 class TestMinSide(unittest.TestCase):
     def test_square(self):
         # Create a simple square polygon
@@ -44,6 +45,34 @@ class TestMinSide(unittest.TestCase):
         # The minimum rotated rectangle will have width equal to the height
         # of the triangle, which is the perpendicular distance from the base
         self.assertAlmostEqual(result, 3.0)
+    
+    def test_vectorized_matches(self):
+        rng = np.random.default_rng(0)
+        polygons = [Polygon([(0, 0), (3, 0), (0, 4)]), Polygon([(0, 0), (2, 1), (3, 4), (1, 3), (-1, 2)]),
+                    Point(5, 5).buffer(2), MultiPolygon([Polygon([(0, 0), (1, 0), (1, 1)]), Polygon([(5, 5), (6, 5), (6, 7)])])]
+        for _ in range(50):
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 8))
+            polygons.append(Polygon(np.column_stack([10 * np.cos(angles), 4 * np.sin(angles)])))
+        np.testing.assert_allclose(min_sides(polygons), [min_side(p) for p in polygons], rtol=1e-9)
+        self.assertEqual(len(min_sides([])), 0)
+    
+    def test_vectorized_degenerate(self):
+        # collinear and single point footprints have LineString / Point hulls, only those get NaN
+        square = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+        result = min_sides([Polygon([(0, 0), (1, 1), (2, 2)]), square, Polygon([(1, 1), (1, 1), (1, 1)])])
+        np.testing.assert_array_equal(np.isnan(result), [True, False, True])
+        self.assertAlmostEqual(result[1], 1.0)
+        self.assertTrue(np.isnan(min_sides([Polygon([(0, 0), (1, 1), (2, 2)])])).all())
+    
+    def test_outliers_degenerate(self):
+        # a degenerate footprint only invalidates its own height, the rest of the frame is still validated
+        df = pd.DataFrame({'geometry': [Polygon([(0, 0), (1, 1), (2, 2)]), Polygon([(0, 0), (10, 0), (10, 10), (0, 10)])],
+                           'height_numeric': [6.0, 6.0], 'height': [6.0, 6.0], 'floor_count_numeric': [2.0, 2.0],
+                           'av_fl_height': [3.0, 3.0]})
+        result = update_avgfloor_count_outliers(df)
+        self.assertTrue(np.isnan(result['validated_height'][0]))
+        self.assertEqual(result['validated_height'][1], 6.0)
+        np.testing.assert_array_equal(result['validated_fc'], [2.0, 2.0])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+import sys
+sys.path.append('../')
+from src.multi_theme_proc import summarise_theme, multi_theme_columns, unique_columns, THEME_BATCH_COLUMNS
+from src.pre_process_buildings import pre_process_postcode_buildings, pre_process_subbatch_buildings
+from src.fuel_calc import process_postcode_fuel, summarise_postcode_fuel, summarise_fuel_batch, FUEL_BATCH_COLUMNS
+from src.age_perc_calc import process_postcode_building_age
+from src.type_calc import process_postcode_buildtype, summarise_buildtype, summarise_buildtype_batch
+from src.postcode_utils import stack_postcode_buildings
+
+
+def make_buildings(n, seed):
+    rng = np.random.default_rng(seed)
+    uses = ['Residential', 'Residential', 'Commercial', 'Mixed Use']
+    return gpd.GeoDataFrame({
+        'upn': [f'U{seed}_{i}' for i in range(n)],
+        'uprn': np.arange(n) + 1.0,
+        'premise_type': rng.choice(np.array(['Small low terraces', 'Large detached', 'Domestic outbuilding', None], dtype=object), n),
+        'premise_use': rng.choice(uses, n),
+        'map_simple_use': rng.choice(uses, n),
+        'premise_age': rng.choice(np.array(['1870-1918', '1945-1959', 'Post 1999', 'Unknown date', None], dtype=object), n),
+        'height': np.round(rng.uniform(2, 20, n), 1),
+        'premise_floor_count': rng.choice(['1', '2', '3'], n),
+        'uprn_count': rng.integers(0, 3, n),
+        'listed_grade': rng.choice(np.array([None, 'II'], dtype=object), n),
+        'basement': rng.choice(['Basement confirmed', 'No basement'], n),
+        'premise_area': np.round(rng.uniform(20, 200, n), 2),
+    }, geometry=[box(i * 20, 0, i * 20 + 10, 8) for i in range(n)], crs='EPSG:27700')
+
+
+class TestMultiTheme(unittest.TestCase):
+    def setUp(self):
+        self.batch_buildings = {'AB1 1AA': make_buildings(12, 1), 'AB1 1AB': make_buildings(5, 2), 'AB1 1AD': None}
+        self.gas = pd.DataFrame({'Postcode': ['AB1 1AA'], 'Num_meters': [5], 'Total_cons_kwh': [1000.0],
+                                 'Mean_cons_kwh': [200.0], 'Median_cons_kwh': [190.0]})
+
+    def test_matches_separate_passes(self):
+        pcs = list(self.batch_buildings)
+        copy = lambda: {k: None if v is None else v.copy() for k, v in self.batch_buildings.items()}
+        buildings = pre_process_subbatch_buildings(copy(), unique_columns(THEME_BATCH_COLUMNS.values()))
+        expected = {
+            'fuel': [process_postcode_fuel(pc, None, self.gas, self.gas, None, batch_buildings=copy()) for pc in pcs],
+            'age': [process_postcode_building_age(pc, None, None, batch_buildings=copy()) for pc in pcs],
+            'type': [process_postcode_buildtype(pc, None, None, batch_buildings=copy()) for pc in pcs],
+        }
+        for theme in ['fuel', 'age', 'type']:
+            result = summarise_theme(theme, pcs, buildings, self.gas, self.gas)
+            pd.testing.assert_frame_equal(pd.DataFrame(result), pd.DataFrame(expected[theme]))
+
+    def test_type_batch_order_and_subset(self):
+        pc_buildings = {pc: pre_process_postcode_buildings(b) for pc, b in self.batch_buildings.items()}
+        pcs = ['AB1 1AD', 'AB1 1AB']
+        expected = pd.DataFrame([summarise_buildtype(pc, pc_buildings[pc], pc_buildings[pc]) for pc in pcs])
+        result = summarise_buildtype_batch(pcs, stack_postcode_buildings(pc_buildings, ['upn', 'premise_use', 'premise_type']))
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertTrue(np.isnan(result.loc[0, 'len_res']))
+
+    def test_type_batch_duplicate_upn(self):
+        buildings = pd.DataFrame({'postcode': ['AB1 1AA'] * 2, 'upn': ['U1'] * 2, 'premise_use': ['Residential'] * 2,
+                                  'premise_type': ['Detached'] * 2})
+        with self.assertRaises(ValueError):
+            summarise_buildtype_batch(['AB1 1AA'], buildings)
+
+    def test_fuel_batch_record_columns(self):
+        # a postcode without buildings or fuel data first changes the column order of the log file
+        pc_buildings = {pc: pre_process_postcode_buildings(b) for pc, b in self.batch_buildings.items()}
+        pcs = ['AB1 1AD', 'AB1 1AA', 'AB1 1AB']
+        expected = pd.DataFrame([summarise_postcode_fuel(pc, pc_buildings[pc], self.gas, self.gas) for pc in pcs])
+        result = summarise_fuel_batch(pcs, stack_postcode_buildings(pc_buildings, FUEL_BATCH_COLUMNS), self.gas, self.gas)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_fuel_batch_unexpected_type(self):
+        buildings = pd.DataFrame({'postcode': ['AB1 1AA'], 'map_simple_use': ['Residential'], 'premise_type': ['Castle']})
+        for col in FUEL_BATCH_COLUMNS[2:]:
+            buildings[col] = 1.0
+        with self.assertRaises(ValueError):
+            summarise_fuel_batch(['AB1 1AA'], buildings, self.gas, self.gas)
+
+    def test_columns(self):
+        columns = multi_theme_columns(['age', 'type'])
+        self.assertIn('premise_age', columns)
+        self.assertIn('premise_type', columns)
+        self.assertNotIn('premise_use', multi_theme_columns(['fuel']))
+        with self.assertRaises(ValueError):
+            multi_theme_columns(['orientation'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+import sys
+sys.path.append('../')
+from src.postcode_utils import find_data_pc_joint, find_data_subbatch, RetrievalContext
+from src.national_scan import run_national_scan, get_batch_scan
+
+
+class TestNationalScan(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        pc_geoms = [box(0, 0, 10, 10), box(10, 0, 20, 10), box(40, 40, 50, 50)]
+        pcshp = gpd.GeoDataFrame({'POSTCODE': ['AA1 1AA', 'AA1 1AB', 'AA1 1AC'], 'PC_AREA': ['AA'] * 3},
+                                 geometry=pc_geoms, crs='EPSG:27700')
+        onsud = pd.DataFrame({'UPRN': [1, 2, 3, 4, 5],
+                              'PCDS': ['AA1 1AA', 'AA1 1AA', 'AA1 1AB', 'AA1 1AB', 'AA1 1AC']})
+        cls.onsdata = (onsud.merge(pcshp, left_on='PCDS', right_on='POSTCODE'), pcshp)
+        cls.pcshp = os.path.join(cls.tmp, 'pcshp')
+        os.makedirs(os.path.join(cls.pcshp, 'two_letter_pc_code'))
+        pcshp.to_file(os.path.join(cls.pcshp, 'two_letter_pc_code', 'aa.shp'))
+        cls.batch_dir = os.path.join(cls.tmp, 'batches', 'T')
+        os.makedirs(cls.batch_dir)
+        onsud.to_csv(os.path.join(cls.batch_dir, 'onsud_0.csv'), index=False)
+        cls.gpk = os.path.join(cls.tmp, 'buildings.gpkg')
+        gpd.GeoDataFrame({
+            'upn': ['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+            # 'd' straddles both postcodes, 'e' is UPRN matched but outside the bbox, 'g' matches nothing
+            'uprn': [1, np.nan, 3, 2, 4, 5, 99],
+            'premise_type': ['x', 'y', 'z', 'x', 'y', 'z', 'x'],
+        }, geometry=[box(1, 1, 2, 2), box(3, 3, 4, 4), box(11, 1, 12, 2), box(9, 5, 11, 6),
+                     box(25, 5, 26, 6), box(41, 41, 42, 42), box(60, 60, 61, 61)],
+            crs='EPSG:27700').to_file(cls.gpk, driver='GPKG')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def scan_batch(self, pcs, chunk_size):
+        """Stage a national scan of one batch of postcodes and load it, as a theme run with retrieval='scan' does."""
+        batch_path = os.path.join(self.batch_dir, 'batch_0.txt')
+        with open(batch_path, 'w') as f:
+            f.write('\n'.join(pcs))
+        data_dir = tempfile.mkdtemp(dir=self.tmp)
+        run_national_scan([batch_path], data_dir, self.pcshp, self.gpk, chunk_size=chunk_size)
+        return get_batch_scan(data_dir, 'T', '0', pcs)
+
+    def test_scan_matches_per_postcode(self):
+        pcs = ['AA1 1AA', 'AA1 1AB', 'AA1 1AC', 'ZZ1 1ZZ']
+        # small chunks so postcodes are assembled across chunk boundaries
+        scanned = self.scan_batch(pcs, chunk_size=2)
+        result = find_data_subbatch(pcs, self.onsdata, self.gpk, 'scan', RetrievalContext(scanned_buildings=scanned))
+        for pc in pcs:
+            expected = find_data_pc_joint(pc, self.onsdata, self.gpk)
+            if expected is None:
+                self.assertIsNone(result[pc])
+                continue
+            self.assertEqual(sorted(result[pc]['upn']), sorted(expected['upn']))
+            self.assertEqual(list(result[pc].columns), list(expected.columns))
+
+    def test_match_types(self):
+        scanned = self.scan_batch(['AA1 1AA', 'AA1 1AB'], chunk_size=3)
+        result = sorted(zip(scanned['upn'], scanned['postcode'], scanned['match_type']))
+        self.assertEqual(result, [('a', 'AA1 1AA', 'uprn'), ('b', 'AA1 1AA', 'spatial'), ('c', 'AA1 1AB', 'uprn'),
+                                  ('d', 'AA1 1AA', 'uprn')])
+
+    def test_missing_staged_scan(self):
+        with self.assertRaises(FileNotFoundError):
+            get_batch_scan(self.tmp, 'T', '1', ['AA1 1AA'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+import sys
+sys.path.append('../')
+from src.postcode_store import (convert_pc_shapefiles_to_store, read_postcode_store, is_postcode_store,
+                                postcode_store_areas)
+from src.postcode_utils import find_postcode_for_ONSUD_file
+
+
+class TestPostcodeStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.pcshp = os.path.join(self.tmp, 'pcshp')
+        rng = np.random.default_rng(3)
+        for area, folder in [('AB', 'two_letter_pc_code'), ('B', 'one_letter_pc_code/b')]:
+            os.makedirs(os.path.join(self.pcshp, folder))
+            # shapefile order is not postcode order, and POSTCODE is padded
+            pcs = [f'{area}{i // 10} {i % 10}AA ' for i in rng.permutation(60)]
+            gpd.GeoDataFrame({'POSTCODE': pcs, 'UPP': 'x', 'PC_AREA': area},
+                             geometry=[box(i, 0, i + 1, 1) for i in range(60)], crs='EPSG:27700'
+                             ).to_file(os.path.join(self.pcshp, folder, f'{area.lower()}.shp'))
+        self.store = os.path.join(self.tmp, 'store')
+        convert_pc_shapefiles_to_store(self.pcshp, self.store, row_group_size=8)
+
+    def test_matches_shapefile_read(self):
+        self.assertTrue(is_postcode_store(self.store))
+        self.assertFalse(is_postcode_store(self.pcshp))
+        onsud = pd.DataFrame({'UPRN': [1, 2, 3, 4], 'PCDS': ['AB1 3AA', 'B5 2AA ', 'AB0 0AA', 'B5 2AA']})
+        data, pc_df = find_postcode_for_ONSUD_file(onsud.copy(), self.pcshp)
+        store_data, store_pc_df = find_postcode_for_ONSUD_file(onsud.copy(), self.store)
+        pd.testing.assert_frame_equal(store_data, data)
+        # the store only returns the batch's postcodes, with the shapefile rows' index and order
+        pd.testing.assert_frame_equal(store_pc_df, pc_df[pc_df['POSTCODE'].isin(data['PCDS'])])
+        self.assertEqual(store_pc_df.crs, pc_df.crs)
+
+    def test_area_count_matches_shapefiles(self):
+        # a row of the B shapefile filed under PC_AREA AB: the areas are counted once across both files
+        shp = os.path.join(self.pcshp, 'one_letter_pc_code/b/b.shp')
+        pc_shp = gpd.read_file(shp)
+        pc_shp.loc[0, 'PC_AREA'] = 'AB'
+        pc_shp.to_file(shp)
+        convert_pc_shapefiles_to_store(self.pcshp, self.store, row_group_size=8)
+        self.assertEqual(postcode_store_areas(self.store, ['AB', 'B']), 2)
+        self.assertEqual(postcode_store_areas(self.store, ['B']), 2)
+        onsud = pd.DataFrame({'UPRN': [1, 2], 'PCDS': ['AB1 3AA', 'B5 2AA']})
+        data, _ = find_postcode_for_ONSUD_file(onsud.copy(), self.pcshp)
+        store_data, _ = find_postcode_for_ONSUD_file(onsud.copy(), self.store)
+        pd.testing.assert_frame_equal(store_data, data)
+
+    def test_missing_area(self):
+        self.assertEqual(len(read_postcode_store(self.store, ['B'], pcs=['ZZ1 1ZZ'])), 0)
+        with self.assertRaises(ValueError):
+            read_postcode_store(self.store, ['CD'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box, Point
+from unittest.mock import patch
+import sys
+sys.path.append('../')
+from src.postcode_utils import (read_vector, ensure_uprn_index, gpkg_has_uprn_index, find_data_pc_sql,
+                                join_pc_buildings, find_data_pc_joint)
+
+
+class TestReadEngines(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        rng = np.random.default_rng(2)
+        x, y = rng.uniform(0, 200, 80), rng.uniform(0, 200, 80)
+        cls.gpk = os.path.join(cls.tmp, 'buildings.gpkg')
+        gpd.GeoDataFrame({'upn': [f'U{i}' for i in range(80)], 'uprn': np.arange(80) + 1.0,
+                          'premise_type': ['Large detached'] * 80, 'height': rng.uniform(2, 10, 80)},
+                         geometry=[box(a, b, a + 8, b + 4) for a, b in zip(x, y)],
+                         crs='EPSG:27700').to_file(cls.gpk, driver='GPKG')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def test_bbox_reads_match(self):
+        for bbox in [box(10, 10, 90, 60), box(0, 0, 300, 300), box(500, 500, 600, 600)]:
+            fiona = read_vector(self.gpk, bbox=bbox, engine='fiona')
+            arrow = read_vector(self.gpk, bbox=bbox, engine='arrow')
+            self.assertEqual(sorted(arrow['upn']), sorted(fiona['upn']))
+            self.assertEqual(list(arrow.columns), list(fiona.columns))
+            self.assertEqual(arrow.crs, fiona.crs)
+
+    def test_mask_and_columns(self):
+        mask = box(0, 0, 60, 60).union(box(120, 120, 200, 150))
+        fiona = read_vector(self.gpk, mask=mask, columns=['upn'], engine='fiona')
+        arrow = read_vector(self.gpk, mask=mask, columns=['upn'], engine='arrow')
+        self.assertEqual(sorted(arrow['upn']), sorted(fiona['upn']))
+        self.assertEqual(list(arrow.columns), ['upn', 'geometry'])
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            read_vector(self.gpk, engine='gdal')
+
+
+class TestSqlPushdown(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        rng = np.random.default_rng(4)
+        x, y = rng.uniform(0, 300, 400), rng.uniform(0, 300, 400)
+        self.gpk = os.path.join(self.tmp, 'buildings.gpkg')
+        gpd.GeoDataFrame({'upn': [f'U{i}' for i in range(400)], 'uprn': np.arange(400) + 1.0,
+                          'height': rng.uniform(2, 10, 400)},
+                         geometry=[box(a, b, a + 8, b + 4) for a, b in zip(x, y)],
+                         crs='EPSG:27700').to_file(self.gpk, driver='GPKG')
+
+    def test_ensure_uprn_index(self):
+        self.assertFalse(gpkg_has_uprn_index(self.gpk))
+        self.assertTrue(ensure_uprn_index(self.gpk))
+        self.assertTrue(gpkg_has_uprn_index(self.gpk))
+
+    def test_matches_bbox_read(self):
+        ensure_uprn_index(self.gpk)
+        pcshp = gpd.GeoDataFrame({'POSTCODE': ['AB1 1AA']}, geometry=[box(50, 50, 150, 120)], crs='EPSG:27700')
+        gd = gpd.GeoDataFrame({'UPRN': [3, 30, 300, 9999]}, geometry=[Point(50, 50), Point(150, 120), Point(60, 60), Point(70, 70)],
+                              crs='EPSG:27700')
+        bbox = box(*gd.total_bounds)
+        expected = join_pc_buildings(read_vector(self.gpk, bbox=bbox), gd['UPRN'], pcshp)
+        for chunk in [500, 2]:
+            with patch('src.postcode_utils.UPRN_CHUNK', chunk):
+                result = find_data_pc_sql(gd, pcshp, self.gpk, bbox)
+            self.assertEqual(sorted(result['upn']), sorted(expected['upn']))
+            self.assertEqual(list(result.columns), list(expected.columns))
+        result = find_data_pc_sql(gd, pcshp, self.gpk, bbox, columns=['upn', 'uprn', 'geometry'])
+        self.assertEqual(list(result.columns), ['upn', 'uprn', 'geometry'])
+
+    def test_sql_only_when_requested(self):
+        ensure_uprn_index(self.gpk)
+        pcshp = gpd.GeoDataFrame({'POSTCODE': ['AB1 1AA']}, geometry=[box(50, 50, 150, 120)], crs='EPSG:27700')
+        data = pd.DataFrame({'UPRN': [3, 300], 'PCDS': 'AB1 1AA', 'geometry': [Point(50, 50), Point(150, 120)]})
+        with patch('src.postcode_utils.find_data_pc_sql', wraps=find_data_pc_sql) as sql:
+            per_postcode = find_data_pc_joint('AB1 1AA', (data, pcshp), self.gpk)
+            self.assertEqual(sql.call_count, 0)
+            result = find_data_pc_joint('AB1 1AA', (data, pcshp), self.gpk, retrieval='sql')
+            self.assertEqual(sql.call_count, 1)
+        self.assertEqual(sorted(result['upn']), sorted(per_postcode['upn']))
+
+
+if __name__ == '__main__':
+    unittest.main()
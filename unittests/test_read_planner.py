@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box, Point
+import sys
+sys.path.append('../')
+from src.read_planner import quadtree_cover, read_amplification, plan_postcode_read
+from src.postcode_utils import find_data_pc_covered, join_pc_buildings, read_vector
+
+
+# L shaped postcode: a thin strip along the bottom and up the left side of a 400m box
+L_SHAPE = box(0, 0, 400, 30).union(box(0, 0, 30, 400))
+
+
+class TestQuadtreeCover(unittest.TestCase):
+    def test_cover_contains_polygon(self):
+        boxes = quadtree_cover(L_SHAPE)
+        self.assertTrue(gpd.GeoSeries(boxes).unary_union.contains(L_SHAPE))
+
+    def test_cover_is_tighter_than_bbox(self):
+        before = read_amplification(L_SHAPE, [box(*L_SHAPE.bounds)])
+        after = read_amplification(L_SHAPE, quadtree_cover(L_SHAPE))
+        self.assertGreater(before, 6)
+        self.assertLess(after, 2)
+
+    def test_plan(self):
+        self.assertIsNone(plan_postcode_read('AB1 1AA', [box(0, 0, 100, 50)]))
+        self.assertIsNotNone(plan_postcode_read('AB1 1AB', [L_SHAPE]))
+
+
+class TestCoveredRetrieval(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        rng = np.random.default_rng(3)
+        x, y = rng.uniform(-20, 400, 600), rng.uniform(-20, 400, 600)
+        cls.gpk = os.path.join(cls.tmp, 'buildings.gpkg')
+        gpd.GeoDataFrame({'upn': [f'U{i}' for i in range(600)], 'uprn': np.arange(600) + 1.0},
+                         geometry=[box(a, b, a + 8, b + 4) for a, b in zip(x, y)],
+                         crs='EPSG:27700').to_file(cls.gpk, driver='GPKG')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def test_matches_bbox_read(self):
+        pcshp = gpd.GeoDataFrame({'POSTCODE': ['AB1 1AB']}, geometry=[L_SHAPE], crs='EPSG:27700')
+        # UPRNs in the postcode, including addresses whose building lies outside the polygon
+        gd = gpd.GeoDataFrame({'UPRN': [5, 50, 300, 9999], 'PCDS': 'AB1 1AB'},
+                              geometry=[Point(0, 0), Point(400, 400), Point(10, 10), Point(20, 20)], crs='EPSG:27700')
+        bbox = box(*gd.total_bounds)
+        expected = join_pc_buildings(read_vector(self.gpk, bbox=bbox), gd['UPRN'], pcshp)
+        result = find_data_pc_covered(gd, pcshp, self.gpk, bbox, plan_postcode_read('AB1 1AB', pcshp.geometry))
+        self.assertEqual(sorted(result['upn']), sorted(expected['upn']))
+        self.assertEqual(list(result.columns), list(expected.columns))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from unittest.mock import patch
+import sys
+sys.path.append('../')
+from src.tile_cache import TileCache
+
+
+def make_read_buildings(buildings, calls):
+    """Stand in for the building file read: return buildings intersecting the bbox or mask, in file order."""
+    def read(input_gpk, bbox=None, mask=None, columns=None, row_id_col=None):
+        calls.append(mask if mask is not None else bbox)
+        geom = bbox if bbox is not None else mask
+        found = buildings[buildings.intersects(geom)]
+        if row_id_col is not None:
+            found = found.assign(**{row_id_col: found.index.values})
+        return found.reset_index(drop=True)
+    return read
+
+
+class TestTileCache(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        x, y = rng.uniform(0, 1000, 300), rng.uniform(0, 1000, 300)
+        self.buildings = gpd.GeoDataFrame({'upn': [f'U{i}' for i in range(300)], 'uprn': np.arange(300)},
+                                          geometry=[box(a, b, a + 30, b + 20) for a, b in zip(x, y)])
+        self.calls = []
+        patcher = patch('src.tile_cache.read_buildings', side_effect=make_read_buildings(self.buildings, self.calls))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_match_direct(self):
+        cache = TileCache('dummy.gpkg', tile_size=200)
+        for query in [box(100, 100, 350, 300), box(180, 150, 420, 260), box(0, 0, 1000, 1000), box(950, 950, 990, 999)]:
+            expected = self.buildings[self.buildings.intersects(query)]
+            self.assertEqual(sorted(cache.read(bbox=query)['upn']), sorted(expected['upn']))
+
+    def test_reads_in_file_order(self):
+        # reads served from tiles loaded by earlier reads come back as the direct read, rows in file order
+        cache = TileCache('dummy.gpkg', tile_size=200)
+        direct = make_read_buildings(self.buildings, [])
+        for query in [box(300, 300, 500, 500), box(100, 100, 350, 300), box(0, 0, 1000, 1000), box(180, 150, 420, 260)]:
+            pd.testing.assert_frame_equal(cache.read(bbox=query), direct('dummy.gpkg', bbox=query))
+
+    def test_read_needs_geometry(self):
+        with self.assertRaises(ValueError):
+            TileCache('dummy.gpkg').read()
+
+    def test_overlapping_reads_hit_cache(self):
+        cache = TileCache('dummy.gpkg', tile_size=200)
+        cache.read(bbox=box(10, 10, 390, 390))
+        cache.read(bbox=box(50, 50, 300, 300))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cache.stats()['misses'], 4)
+        self.assertEqual(cache.stats()['hits'], 4)
+
+    def test_memory_budget_evicts(self):
+        cache = TileCache('dummy.gpkg', tile_size=100, memory_mb=0.002)
+        cache.read(bbox=box(0, 0, 999, 999))
+        stats = cache.stats()
+        self.assertGreater(stats['evictions'], 0)
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+        # evicted tiles are read again
+        cache.read(bbox=box(0, 0, 50, 50))
+        self.assertEqual(len(self.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()